@@ -1,12 +1,11 @@
 from fastapi import APIRouter, HTTPException
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 import os
 import logging
-import google.generativeai as genai
 import datetime, asyncio
 from typing import List, Optional, Dict, Any
-from pymongo import MongoClient
+from app.utils.db import async_collection
 from app.utils.tasks import generate_chat_response
 
 # Configure logging
@@ -18,10 +17,8 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/chatbot", tags=["Chatbot"])
 
-# Connect to MongoDB for chat history
-client = AsyncIOMotorClient(os.getenv("MONGO_URI"))
-db = client["grovli"]
-chat_collection = db["chat_sessions"]
+# MongoDB for chat history, through the shared async client
+chat_collection = async_collection("chat_sessions")
 
 class Message(BaseModel):
     role: str
@@ -63,9 +60,6 @@ async def start_chat_session(request: ChatRequest):
             detail="GEMINI_API_KEY environment variable is not set"
         )
     
-    # Initialize Gemini API with the key
-    genai.configure(api_key=gemini_api_key)
-    
     try:
         # Generate a session ID if not provided
         session_id = request.session_id or f"chat_{request.user_id}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
@@ -156,7 +150,8 @@ async def send_message(request: ChatRequest):
         # Get existing messages
         existing_messages = chat_session.get("messages", []) + [user_message]
         
-        generate_chat_response.delay(
+        await run_in_threadpool(
+            generate_chat_response.delay,
             request.session_id, 
             request.dietary_preferences, 
             request.meal_type,
@@ -2,13 +2,11 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional, Union
 import os
-import json
-import google.generativeai as genai
 import logging
-from app.utils.redis_client import get_cache, set_cache
+from app.utils.redis_client import aget_cache, aset_cache
+from app.utils.llm import agenerate, LLMError
+from app.utils.llm_json import parse_llm_json, json_generation_config
 from google.api_core import exceptions as google_exceptions
-from concurrent.futures import ThreadPoolExecutor
-import asyncio
 
 # Configure logging
 logging.basicConfig(
@@ -19,9 +17,6 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/cultural-info", tags=["Cultural Info"])
 
-# Thread pool for running synchronous Gemini calls
-executor = ThreadPoolExecutor(max_workers=4)
-
 class CulturalInfoResponse(BaseModel):
     cuisine: str
     description: str
@@ -37,32 +32,11 @@ CULTURAL_KEY_PREFIX = "cultural:v2:"
 def validate_gemini_response(response_text: str) -> Dict:
     """Helper function to validate and parse Gemini response"""
     try:
-        # First try parsing directly
-        data = json.loads(response_text)
-        
-        # Check if we got a list instead of a dictionary (happens sometimes with Gemini)
-        if isinstance(data, list) and len(data) > 0:
-            logger.warning(f"Received list instead of object, taking first item: {data}")
-            # Take the first item if it's a list
-            data = data[0] if isinstance(data[0], dict) else {"error": "Invalid response structure"}
-            
-        return data
-    except json.JSONDecodeError:
-        # If direct parsing fails, try extracting JSON from markdown
-        try:
-            # Handle cases where response might be markdown with JSON code block
-            json_str = response_text.split('```json')[1].split('```')[0].strip()
-            data = json.loads(json_str)
-            
-            # Also check here if we got a list
-            if isinstance(data, list) and len(data) > 0:
-                logger.warning(f"Received list instead of object in markdown, taking first item")
-                data = data[0] if isinstance(data[0], dict) else {"error": "Invalid response structure"}
-                
-            return data
-        except (IndexError, json.JSONDecodeError) as e:
-            logger.error(f"Failed to extract JSON from response: {response_text}")
-            raise ValueError("Invalid response format from AI service")
+        # Gemini sometimes wraps the object in a list; the first object is used then
+        return parse_llm_json(response_text, expect=dict)
+    except ValueError:
+        logger.error(f"Failed to extract JSON from response: {response_text}")
+        raise ValueError("Invalid response format from AI service")
         
 @router.get("/{cuisine}", response_model=CulturalInfoResponse)
 async def get_cultural_info(cuisine: str):
@@ -75,7 +49,7 @@ async def get_cultural_info(cuisine: str):
     
     # Check Redis cache first with namespaced key
     cache_key = f"{CULTURAL_KEY_PREFIX}{cuisine}"
-    cached_info = get_cache(cache_key)
+    cached_info = await aget_cache(cache_key)
     
     if cached_info:
         logger.info(f"✅ Found cached info for {cuisine}")
@@ -88,9 +62,6 @@ async def get_cultural_info(cuisine: str):
             logger.error("Missing GEMINI_API_KEY environment variable")
             raise HTTPException(status_code=500, detail="Server configuration error")
             
-        genai.configure(api_key=gemini_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
         prompt = f"""Create a visually appealing, modern overview of {cuisine} cuisine with these exact JSON keys:
         - cuisine: name of the cuisine (capitalized string)
         - description: 1 short, engaging sentence about the cuisine
@@ -120,16 +91,13 @@ async def get_cultural_info(cuisine: str):
         "colorAccent": "#3A86FF"
         }}"""
         
-        # Run synchronous Gemini call in thread pool
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(
-            executor,
-            lambda: model.generate_content(
-                prompt,
-                generation_config={
-                    "temperature": 0.3,
-                    "max_output_tokens": 2000
-                }
+        # The gateway runs the synchronous Gemini call in a worker thread
+        response = await agenerate(
+            prompt,
+            caller="cultural_info",
+            generation_config=json_generation_config(
+                temperature=0.3,
+                max_output_tokens=2000
             )
         )
         
@@ -144,7 +112,7 @@ async def get_cultural_info(cuisine: str):
             validated_data = CulturalInfoResponse(**data)
             
             # Cache the validated data
-            set_cache(cache_key, validated_data.dict(), ttl=CULTURAL_CACHE_TTL)            
+            await aset_cache(cache_key, validated_data.dict(), ttl=CULTURAL_CACHE_TTL)            
             
             return validated_data
             
@@ -162,7 +130,7 @@ async def get_cultural_info(cuisine: str):
                 detail="Failed to process AI service response"
             )
             
-    except google_exceptions.GoogleAPIError as e:
+    except (google_exceptions.GoogleAPIError, LLMError) as e:
         logger.error(f"Gemini API error: {str(e)}")
         raise HTTPException(
             status_code=503,
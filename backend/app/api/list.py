@@ -5,6 +5,7 @@ from fastapi import HTTPException
 from pydantic import BaseModel
 from app.api.meals import MealPlanText
 from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from typing import List, Optional
 
 router = APIRouter(prefix="/shopping_list", tags=["Shopping List"])
@@ -88,7 +89,8 @@ async def create_shopping_list(ingredients: List[str], name: str = "Weekly Meal
     print(json.dumps(payload, indent=2))
 
     try:
-        response = requests.post(
+        response = await run_in_threadpool(
+            requests.post,
             INSTACART_API_URL,
             headers=headers,
             json=payload
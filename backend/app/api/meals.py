@@ -1,17 +1,26 @@
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
-import os, json, uuid
+import os, json, uuid, hashlib
 import requests
 import re, random, datetime
 from typing import List, Set
-from pymongo import MongoClient
 import logging
 from app.utils.tasks import (
     generate_meal_plan as meal_plan_task,
-    notify_meal_plan_ready_task
+    notify_meal_plan_ready_task,
+    claim_inflight_generation,
+    register_meal_plan_waiter,
+    INFLIGHT_GENERATION_TTL
     )
-from app.utils.redis_client import get_cache, set_cache, MEAL_CACHE_TTL
-from app.api.user_settings import user_settings_collection
+from app.utils.db import async_collection
+from app.utils.redis_client import aget_cache, aset_cache, MEAL_CACHE_TTL
+from app.utils.meal_plan_events import iter_meal_plan_events, reset_meal_plan_events
+from app.utils.meal_index import find_nearest_meals, plan_meals_filter, request_meals_filter
+from app.utils.plan_assembler import build_instant_plan
+from app.utils.plan_requests import meal_counts_for, build_request_hash, record_request_shape
+from app.utils.llm import add_llm_backlog, estimate_queue_wait
 
 # Configure logging
 logging.basicConfig(
@@ -22,11 +31,19 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/mealplan", tags=["Meal Plan"])
 
-# Connect to MongoDB
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["grovli"]
-meals_collection = db["meals"]
-chat_collection = db["chat_sessions"]
+# MongoDB through the shared async client; blocking helpers (plan assembly, Celery and
+# Redis bookkeeping in app.utils) are run in the threadpool
+meals_collection = async_collection("meals")
+chat_collection = async_collection("chat_sessions")
+user_settings_collection = async_collection("user_settings")
+
+# Meal ids are short hex digests; ids with other characters are rejected before any lookup,
+# which also keeps them safe to use in a prefix regex without escaping
+MEAL_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Shortest truncated id that is resolved to a meal by prefix
+MEAL_ID_MIN_PREFIX = int(os.getenv("MEAL_ID_MIN_PREFIX", "6"))
+# How long an unknown meal id is remembered, so repeated lookups of it skip MongoDB
+MEAL_MISS_TTL = int(os.getenv("MEAL_MISS_TTL", "300"))
 
 class MealPlanText(BaseModel):
     meal_plan: str
@@ -59,15 +76,7 @@ class MealPlanRequest(BaseModel):
     fat: int = Field(..., gt=0, description="Daily fat requirement in grams")
     meal_algorithm: str = Field("experimental", description="Algorithm type: 'pantry' or 'experimental'")
     pantry_ingredients: List[str] = Field(default_factory=list, description="Ingredients available in the user's pantry")
-
-# Define the expected number of meals based on Meal Type
-MEAL_TYPE_COUNTS = {
-    "Full Day": 4,       
-    "Breakfast": 1,
-    "Lunch": 1,
-    "Dinner": 1,
-    "Snack": 1,    
-}
+    instant: bool = Field(False, description="Assemble the plan from existing meals without generation when possible")
 
 def extract_recipe_titles(content: str) -> List[str]:
     """Extract recipe titles from the meal plan text."""
@@ -114,40 +123,25 @@ async def archive_meal_plan(request: MealPlanText):
     return {"status": "success", "message": "Meals archived successfully", "meal_plan_id": archive_id}
 
 
-def find_meal_by_macros(meal_type: str, dietary_type: str, macros: dict, session_id: str, num_meals: int):
+def find_meal_by_macros(meal_type: str, dietary_type: str, macros: dict, num_meals: int):
     """
-    Searches MongoDB for meals that match the exact required macros and meal type.
-    Returns stored meals if available, otherwise triggers new meal generation.
+    Searches the in-memory meal index for stored meals of the given meal type and dietary type
+    whose macros are within tolerance of the required macros, closest first.
     """
-    base_meal_id = f"{meal_type}_{dietary_type}_{macros['calories']}".lower()  
-
-    # Enforce strict macro matching
-    macro_filter = {
-        "macros.calories": macros.get("calories", 0),
-        "macros.protein": macros.get("protein", 0),
-        "macros.carbs": macros.get("carbs", 0),
-        "macros.fat": macros.get("fat", 0),
-        "macros.fiber": macros.get("fiber", 0),
-        "macros.sugar": macros.get("sugar", 0),
-        "session_id": session_id  # Ensure meals from the same session are retrieved together
-    }
-
-    # Fetch meals that **exactly** match the required macros
-    matching_meals = list(meals_collection.find({"base_meal_id": base_meal_id, **macro_filter}).limit(num_meals))
+    matching_meals = find_nearest_meals(meal_type, dietary_type, macros, k=num_meals)
 
     if len(matching_meals) >= num_meals:
-        print(f"✅ Found {len(matching_meals)} meals for {base_meal_id}. Returning stored results.")
-        return matching_meals
-
-    print(f"⚠️ Only found {len(matching_meals)} meals. Generating {num_meals - len(matching_meals)} more.")
-    return matching_meals  
+        logger.info(f"✅ Found {len(matching_meals)} meals near the {meal_type} macro target. Returning stored results.")
+    else:
+        logger.info(f"⚠️ Only found {len(matching_meals)} of {num_meals} meals near the {meal_type} macro target.")
+    return matching_meals
 
-def find_meal_by_meal_plan_id(meal_plan_id: str):
+async def find_meal_by_meal_plan_id(meal_plan_id: str):
     """
     Retrieves meals from MongoDB based on a shared `meal_plan_id`.
     This ensures meals are grouped and retrieved together.
     """
-    matching_meals = list(meals_collection.find({"meal_plan_id": meal_plan_id}))
+    matching_meals = await meals_collection.find(plan_meals_filter(meal_plan_id)).to_list(length=None)
 
     if matching_meals:
         print(f"✅ Found {len(matching_meals)} meals for meal_plan_id: {meal_plan_id}")
@@ -165,7 +159,7 @@ def find_meal_by_meal_plan_id(meal_plan_id: str):
         for meal in matching_meals
     ]
 
-def try_notify_meal_plan_ready(session_id, user_id, meal_plan_id):
+async def try_notify_meal_plan_ready(session_id, user_id, meal_plan_id):
     """
     Sends a notification to the chat service that the meal plan is ready.
     Now simply delegates to the Celery task.
@@ -175,7 +169,7 @@ def try_notify_meal_plan_ready(session_id, user_id, meal_plan_id):
     # First, verify that all expected meals are properly generated with images
     try:
         # Find all meals for this plan
-        meals = list(meals_collection.find({"meal_plan_id": meal_plan_id}))
+        meals = await meals_collection.find(plan_meals_filter(meal_plan_id)).to_list(length=None)
         
         # Verify we have all meals and that all meals have images
         if not meals:
@@ -203,7 +197,7 @@ def try_notify_meal_plan_ready(session_id, user_id, meal_plan_id):
     
     # Mark the session as having a meal plan ready
     try:
-        chat_collection.update_one(
+        await chat_collection.update_one(
             {"session_id": session_id},
             {
                 "$set": {
@@ -220,7 +214,7 @@ def try_notify_meal_plan_ready(session_id, user_id, meal_plan_id):
         logger.error(f"Failed to update chat session status: {str(e)}")
     
     # Then queue the notification task
-    notify_meal_plan_ready_task.delay(session_id, user_id, meal_plan_id)
+    await run_in_threadpool(notify_meal_plan_ready_task.delay, session_id, user_id, meal_plan_id)
     logger.info(f"Queued notification task for session {session_id}, meal plan {meal_plan_id}")
     return True
     
@@ -248,7 +242,7 @@ async def generate_meal_plan(request: MealPlanRequest, request_obj: Request):
         try:
             # Check Redis cache first
             settings_cache_key = f"user_settings:{user_id}"
-            cached_settings = get_cache(settings_cache_key)
+            cached_settings = await aget_cache(settings_cache_key)
             
             if cached_settings and cached_settings.get("dietaryPhilosophy"):
                 # If the user's preferences already include their philosophy, don't add it again
@@ -258,7 +252,7 @@ async def generate_meal_plan(request: MealPlanRequest, request_obj: Request):
                     logger.info(f"Added dietary philosophy '{philosophy}' from user settings")
             else:
                 # If not in Redis, check MongoDB
-                user_settings = user_settings_collection.find_one({"user_id": user_id})
+                user_settings = await user_settings_collection.find_one({"user_id": user_id})
                 if user_settings and user_settings.get("dietaryPhilosophy"):
                     philosophy = user_settings.get("dietaryPhilosophy")
                     if philosophy and philosophy not in dietary_preferences:
@@ -269,35 +263,31 @@ async def generate_meal_plan(request: MealPlanRequest, request_obj: Request):
             # Continue with original preferences if there's an error
     
     # Step 1: Determine the correct number and types of meals needed
-    if request.meal_type == "Full Day":
-        meal_counts = {
-            "Breakfast": request.num_days,  
-            "Lunch": request.num_days,      
-            "Dinner": request.num_days,     
-            "Snack": request.num_days      
-        }
-        total_meals_needed = sum(meal_counts.values())
-    else:
-        meal_counts = {request.meal_type: MEAL_TYPE_COUNTS.get(request.meal_type, 1) * request.num_days} 
-        total_meals_needed = meal_counts[request.meal_type]
-    
+    meal_counts, total_meals_needed = meal_counts_for(request.meal_type, request.num_days)
     logger.info(f"🍽️ Generating meal plan with {total_meals_needed} total meals: {meal_counts}")
-    
-    pantry_fingerprint = ""
-    if request.meal_algorithm == "pantry" and request.pantry_ingredients:
-        # Create a deterministic fingerprint of pantry ingredients
-        # Sort them to ensure consistent order regardless of input order
-        sorted_ingredients = sorted(request.pantry_ingredients)
-        # Take the first few ingredients to keep hash reasonably sized
-        pantry_sample = sorted_ingredients[:5]
-        pantry_fingerprint = f"_pantry_{'-'.join(pantry_sample)}"
-
-    request_hash = f"{request.meal_type}_{dietary_preferences}_{request.calories}_{request.protein}_{request.carbs}_{request.fat}_{request.fiber}_{request.sugar}_{request.meal_algorithm}{pantry_fingerprint}"
+
+    # Step 2: Identify the request. The same dict is handed to Celery if generation is needed
+    request_dict = {
+        "dietary_preferences": dietary_preferences,  # Use the combined preferences
+        "meal_type": request.meal_type,
+        "calories": request.calories,
+        "protein": request.protein,
+        "carbs": request.carbs,
+        "fat": request.fat,
+        "fiber": request.fiber,
+        "sugar": request.sugar,
+        "meal_algorithm": request.meal_algorithm,
+        "pantry_ingredients": request.pantry_ingredients
+    }
+    request_hash = build_request_hash(request_dict)
     logger.info(f"🔑 Request hash: {request_hash}")
+
+    # Popular shapes are pre-generated off-peak by the prewarm_popular_plans beat task
+    await run_in_threadpool(record_request_shape, request_hash, request_dict, request.num_days)
     
     # Step 3: Check Redis cache first
     cache_key = f"meal_plan:{request_hash}"
-    cached_meal_plan = get_cache(cache_key)
+    cached_meal_plan = await aget_cache(cache_key)
     
     if cached_meal_plan and len(cached_meal_plan) >= total_meals_needed:
         logger.info(f"✅ Found cached meal plan in Redis for request hash: {request_hash}")
@@ -319,16 +309,20 @@ async def generate_meal_plan(request: MealPlanRequest, request_obj: Request):
             formatted_meals.append(formatted_meal)
         
         # Notify user through the same logic as before
-        try_notify_meal_plan_ready(
-            session_id=get_active_session_id(user_id),
+        await try_notify_meal_plan_ready(
+            session_id=await get_active_session_id(user_id),
             user_id=user_id, 
             meal_plan_id=cached_meal_plan[0].get("meal_plan_id", request_hash)
         )
         
         return {"meal_plan": formatted_meals, "cached": True, "cache_source": "redis"}
     
-    # Step 4: If not in Redis, check MongoDB
-    existing_meal_plan = list(meals_collection.find({"request_hash": request_hash}).limit(total_meals_needed))
+    # Step 4: If not in Redis, check MongoDB. Meals are saved before their images exist, so a
+    # plan that is still being generated is left to the in-flight generation handled below
+    generation_in_flight = await aget_cache(f"inflight:{request_hash}") is not None
+    existing_meal_plan = [] if generation_in_flight else await meals_collection.find(
+        request_meals_filter(request_hash)
+    ).limit(total_meals_needed).to_list(length=None)
     if len(existing_meal_plan) >= total_meals_needed:
         logger.info(f"✅ Found cached meal plan in MongoDB for request hash: {request_hash}")
         logger.info(f"📋 DEBUG: Found {len(existing_meal_plan)} cached meals in MongoDB")
@@ -347,15 +341,16 @@ async def generate_meal_plan(request: MealPlanRequest, request_obj: Request):
             }
             formatted_meals.append(formatted_meal)
             
-        # Cache the results in Redis for future requests
-        set_cache(cache_key, existing_meal_plan, MEAL_CACHE_TTL)
-        logger.info(f"📋 DEBUG: Cached MongoDB results in Redis: {cache_key}")
+        # Cache the results in Redis for future requests, unless an image is still missing
+        if all(meal["imageUrl"] for meal in formatted_meals):
+            await aset_cache(cache_key, existing_meal_plan, MEAL_CACHE_TTL)
+            logger.info(f"📋 DEBUG: Cached MongoDB results in Redis: {cache_key}")
             
         # Try to send notification if possible
         try:
             # Look for active chat session based on user_id
             if user_id:
-                session_id = get_active_session_id(user_id)
+                session_id = await get_active_session_id(user_id)
                 if session_id:
                     # Get the meal plan ID from the first meal
                     meal_plan_id = existing_meal_plan[0].get("meal_plan_id", request_hash)
@@ -363,7 +358,7 @@ async def generate_meal_plan(request: MealPlanRequest, request_obj: Request):
                     # Only try to notify if we have session_id
                     if session_id:
                         # Update chat session to mark meal plan as ready
-                        chat_collection.update_one(
+                        await chat_collection.update_one(
                             {"session_id": session_id},
                             {
                                 "$set": {
@@ -376,7 +371,7 @@ async def generate_meal_plan(request: MealPlanRequest, request_obj: Request):
                         )
                         
                         # Add notification task to Celery queue
-                        notify_meal_plan_ready_task.delay(session_id, user_id, meal_plan_id)
+                        await run_in_threadpool(notify_meal_plan_ready_task.delay, session_id, user_id, meal_plan_id)
                         logger.info(f"Added notification task to Celery queue for cached meal plan")
                 else:
                     logger.warning(f"No chat session found for user_id: {user_id}")
@@ -388,17 +383,57 @@ async def generate_meal_plan(request: MealPlanRequest, request_obj: Request):
             
         return {"meal_plan": formatted_meals, "cached": True, "cache_source": "mongodb"}
     
-    # Step 5: If no cached plan exists, queue generation in Celery
+    # Step 5: In instant mode, assemble the plan from existing meals without any LLM calls
+    if request.instant and request.meal_algorithm != "pantry":
+        daily_macros = {
+            "calories": request.calories,
+            "protein": request.protein,
+            "carbs": request.carbs,
+            "fat": request.fat,
+            "fiber": request.fiber,
+            "sugar": request.sugar
+        }
+        instant_plan = await run_in_threadpool(build_instant_plan, request.meal_type, dietary_preferences, daily_macros, request.num_days)
+        if instant_plan:
+            # The id names this selection of meals, so a later instant plan for the same request
+            # that picks other meals never shares it
+            meal_ids_digest = hashlib.sha256(",".join(meal["meal_id"] for meal in instant_plan).encode()).hexdigest()[:12]
+            instant_plan_id = f"instant_{request_hash}_{meal_ids_digest}"
+            # Link the reused meals to the plan id so /by_id still finds the plan once the cache
+            # entry expires; the request hash is left alone, it belongs to the generated plan
+            await meals_collection.update_many(
+                {"meal_id": {"$in": list({meal["meal_id"] for meal in instant_plan})}},
+                {"$addToSet": {"reused_in_plans": instant_plan_id}}
+            )
+            await aset_cache(f"meal_plan_id:{instant_plan_id}", instant_plan, MEAL_CACHE_TTL)
+            logger.info(f"⚡ Assembled instant meal plan with {len(instant_plan)} existing meals")
+            formatted_meals = [
+                {
+                    "id": meal["meal_id"],
+                    "title": meal["meal_name"],
+                    "meal_type": meal["meal_type"],
+                    "nutrition": meal["macros"],
+                    "ingredients": meal["ingredients"],
+                    "instructions": meal["meal_text"],
+                    "imageUrl": meal.get("imageUrl")
+                }
+                for meal in instant_plan
+            ]
+            return {"meal_plan": formatted_meals, "meal_plan_id": instant_plan_id, "cached": True, "cache_source": "meal_pool"}
+        logger.info("⚠️ Meal pool too sparse for an instant plan, falling back to generation")
+
+    # Step 6: If no cached plan exists, queue generation in Celery
     logger.info(f"⚠️ No cached meal plan found. Scheduling generation of new meals.")
     meal_plan_id = request_hash
     
     # First, update chat session to mark meal plan as processing
+    session_id = None
     try:
         if user_id:
-            session_id = get_active_session_id(user_id)
+            session_id = await get_active_session_id(user_id)
             if session_id:
                 # Update chat session to mark meal plan as processing
-                chat_collection.update_one(
+                await chat_collection.update_one(
                     {"session_id": session_id},
                     {
                         "$set": {
@@ -412,21 +447,26 @@ async def generate_meal_plan(request: MealPlanRequest, request_obj: Request):
                 logger.info(f"Updated chat session {session_id} to mark meal plan as processing")
     except Exception as e:
         logger.error(f"⚠️ Non-critical error updating chat session: {str(e)}")
+
+    # Attach to an identical generation that is already in flight instead of queueing another one
+    inflight = await run_in_threadpool(claim_inflight_generation, request_hash, meal_plan_id)
+    if inflight:
+        meal_plan_id = inflight.get("meal_plan_id", meal_plan_id)
+        if session_id:
+            await run_in_threadpool(register_meal_plan_waiter, meal_plan_id, session_id, user_id)
+        logger.info(f"🔗 Attached request to in-flight generation for meal plan: {meal_plan_id}")
+        return {
+            "status": "processing",
+            "message": "Your meal plan is being generated. You can continue chatting while it's processing.",
+            "meal_plan_id": meal_plan_id,
+            "request_hash": request_hash,
+            "stream_url": f"/mealplan/stream/{meal_plan_id}",
+            "estimated_wait_seconds": await run_in_threadpool(estimate_queue_wait),
+            "attached": True
+        }
     
-    # Convert the Pydantic model to a dictionary for Celery
-    request_dict = {
-        "dietary_preferences": dietary_preferences,  # Use the combined preferences
-        "meal_type": request.meal_type,
-        "calories": request.calories,
-        "protein": request.protein,
-        "carbs": request.carbs,
-        "fat": request.fat,
-        "fiber": request.fiber,
-        "sugar": request.sugar
-    }
-    
-    # Queue the task
-    meal_plan_task.delay(
+    estimated_wait = await run_in_threadpool(
+        queue_meal_plan_generation,
         request_dict,
         user_id,
         meal_counts,
@@ -440,23 +480,42 @@ async def generate_meal_plan(request: MealPlanRequest, request_obj: Request):
         "status": "processing",
         "message": "Your meal plan is being generated. You can continue chatting while it's processing.",
         "meal_plan_id": meal_plan_id,
-        "request_hash": request_hash
+        "request_hash": request_hash,
+        "stream_url": f"/mealplan/stream/{meal_plan_id}",
+        "estimated_wait_seconds": estimated_wait
     }
 
+def queue_meal_plan_generation(request_dict, user_id, meal_counts, total_meals_needed, meal_plan_id, request_hash):
+    """
+    Starts the plan's progress stream from a clean history, then queues the task.
+    Its Gemini calls join the backlog the ETA is computed from. Returns the estimated wait.
+    """
+    reset_meal_plan_events(meal_plan_id)
+    add_llm_backlog(meal_plan_id, total_meals_needed, INFLIGHT_GENERATION_TTL)
+    meal_plan_task.delay(
+        request_dict,
+        user_id,
+        meal_counts,
+        total_meals_needed,
+        meal_plan_id,
+        request_hash
+    )
+    return estimate_queue_wait()
+
 # Helper to get the active session ID from a user ID
-def get_active_session_id(user_id):
+async def get_active_session_id(user_id):
     """Get the most recent chat session ID for a user."""
     if not user_id:
         return None
         
     # Try Redis cache first
     cache_key = f"active_session:{user_id}"
-    cached_session = get_cache(cache_key)
+    cached_session = await aget_cache(cache_key)
     if cached_session:
         return cached_session
     
     # If not in cache, query MongoDB
-    recent_chat = chat_collection.find_one(
+    recent_chat = await chat_collection.find_one(
         {"user_id": user_id},
         sort=[("created_at", -1)]
     )
@@ -465,7 +524,7 @@ def get_active_session_id(user_id):
         session_id = recent_chat.get("session_id")
         if session_id:
             # Cache the result for 5 minutes
-            set_cache(cache_key, session_id, 300)  # 5 minutes TTL
+            await aset_cache(cache_key, session_id, 300)  # 5 minutes TTL
             return session_id
     
     return None
@@ -487,7 +546,7 @@ async def get_latest_meal_session(request: Request):
         
         # Implement throttling to prevent excessive calls
         cache_key = f"session_check:{user_id}"
-        last_check = get_cache(cache_key) or 0
+        last_check = await aget_cache(cache_key) or 0
         current_time = datetime.datetime.now().timestamp()
         
         # Significantly increase throttling to 30 seconds to prevent excessive calls
@@ -500,10 +559,10 @@ async def get_latest_meal_session(request: Request):
             }
         
         # Update last check time with longer TTL
-        set_cache(cache_key, current_time, 180)  # 3 minute TTL for better rate limiting
+        await aset_cache(cache_key, current_time, 180)  # 3 minute TTL for better rate limiting
         
         # Find the active session
-        session_id = get_active_session_id(user_id)
+        session_id = await get_active_session_id(user_id)
         if not session_id:
             raise HTTPException(
                 status_code=404,
@@ -511,7 +570,7 @@ async def get_latest_meal_session(request: Request):
             )
             
         # Get the session details
-        chat_session = chat_collection.find_one({"session_id": session_id})
+        chat_session = await chat_collection.find_one({"session_id": session_id})
         if not chat_session:
             raise HTTPException(
                 status_code=404,
@@ -536,6 +595,42 @@ async def get_latest_meal_session(request: Request):
             detail=f"Failed to retrieve latest meal session: {str(e)}"
         )
 
+@router.get("/stream/{meal_plan_id}")
+async def stream_meal_plan(meal_plan_id: str, request: Request):
+    """
+    Streams meal plan progress as Server-Sent Events instead of polling.
+
+    Emits `meal_generated`, `meal_saved`, `meal_image` and `meal_image_failed` events as each
+    meal progresses, and closes after `plan_ready` or `plan_failed`. Events already published
+    are replayed on connect; reconnecting clients resume after the `Last-Event-ID` header.
+    """
+    try:
+        last_event_id = int(request.headers.get("last-event-id", -1))
+    except ValueError:
+        last_event_id = -1
+
+    async def event_source():
+        yield "retry: 3000\n\n"
+        async for seq, event in iter_meal_plan_events(meal_plan_id, last_event_id):
+            if await request.is_disconnected():
+                logger.info(f"Client disconnected from meal plan stream: {meal_plan_id}")
+                break
+            if event is None:
+                yield ": keepalive\n\n"
+                continue
+            frame = f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+            yield frame if seq is None else f"id: {seq}\n{frame}"
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 @router.get("/{meal_id}")
 async def get_meal_by_id(meal_id: str):
     """
@@ -546,7 +641,7 @@ async def get_meal_by_id(meal_id: str):
         
         # Check Redis cache first
         cache_key = f"meal:{meal_id}"
-        cached_meal = get_cache(cache_key)
+        cached_meal = await aget_cache(cache_key)
         if cached_meal:
             print(f"✅ Found meal in Redis cache: {cached_meal.get('meal_name')}")
             return {
@@ -560,25 +655,28 @@ async def get_meal_by_id(meal_id: str):
                 "cache_source": "redis"
             }
         
+        # Malformed ids and recently missed ids never reach MongoDB. A meal saved since the miss
+        # is still found, because persisting a meal caches it under meal:{meal_id} checked above.
+        miss_key = f"meal_miss:{meal_id}"
+        if not MEAL_ID_RE.match(meal_id) or await aget_cache(miss_key):
+            raise HTTPException(status_code=404, detail="Meal not found")
+
         # If not in Redis, direct lookup by meal_id in MongoDB
-        meal = meals_collection.find_one({"meal_id": meal_id})
+        meal = await meals_collection.find_one({"meal_id": meal_id})
         
         if not meal:
-            # Try using meal_id as a regex pattern as a fallback
-            try:
-                pattern = re.escape(meal_id)
-                meal = meals_collection.find_one({"meal_id": {"$regex": f".*{pattern}.*"}})
-            except Exception:
-                pass
+            # A truncated id resolves to the one meal it is a prefix of
+            meal = await find_meal_by_id_prefix(meal_id)
             
         if not meal:
-            print(f"⚠️ Meal still not found with pattern: {meal_id}")
+            print(f"⚠️ Meal not found with ID: {meal_id}")
+            await aset_cache(miss_key, True, MEAL_MISS_TTL)
             raise HTTPException(status_code=404, detail=f"Meal not found with ID: {meal_id}")
 
         print(f"✅ Found meal in MongoDB: {meal.get('meal_name')}")
         
         # Cache the result in Redis
-        set_cache(cache_key, meal, MEAL_CACHE_TTL)
+        await aset_cache(cache_key, meal, MEAL_CACHE_TTL)
         
         return {
             "id": meal["meal_id"],
@@ -596,6 +694,16 @@ async def get_meal_by_id(meal_id: str):
         print(f"Error in get_meal_by_id: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error")
 
+async def find_meal_by_id_prefix(prefix: str):
+    """
+    Resolves a truncated meal id with an anchored prefix match, which MongoDB answers with a
+    bounded scan of the meal_id index. Returns the meal only if the prefix is unambiguous.
+    """
+    if len(prefix) < MEAL_ID_MIN_PREFIX:
+        return None
+    matches = await meals_collection.find({"meal_id": {"$regex": f"^{prefix}"}}).limit(2).to_list(length=None)
+    return matches[0] if len(matches) == 1 else None
+
 @router.get("/by_id/{meal_plan_id}")
 async def get_meal_plan_by_id(meal_plan_id: str, full: bool = False, nocache: bool = False, request: Request = None):
     """
@@ -614,7 +722,7 @@ async def get_meal_plan_by_id(meal_plan_id: str, full: bool = False, nocache: bo
             user_id = request.headers.get("user-id") or request.headers.get("x-user-id") or "anonymous"
         
         throttle_key = f"meal_plan_check:{meal_plan_id}:{user_id}"
-        last_check = get_cache(throttle_key) or 0
+        last_check = await aget_cache(throttle_key) or 0
         current_time = datetime.datetime.now().timestamp()
         
         # Only allow checks once every 15 seconds
@@ -626,14 +734,14 @@ async def get_meal_plan_by_id(meal_plan_id: str, full: bool = False, nocache: bo
             }
         
         # Update last check time
-        set_cache(throttle_key, current_time, 60)  # 60 second TTL
+        await aset_cache(throttle_key, current_time, 60)  # 60 second TTL
         
         # Check if we should use cache
         use_cache = not nocache
         
         # Check Redis cache first if allowed
         cache_key = f"meal_plan_id:{meal_plan_id}"
-        cached_meals = get_cache(cache_key) if use_cache else None
+        cached_meals = await aget_cache(cache_key) if use_cache else None
         
         if cached_meals and not full:  # Only use cache if not requesting full meal plan
             logger.info(f"Found meal plan in Redis cache: {meal_plan_id}")
@@ -661,14 +769,14 @@ async def get_meal_plan_by_id(meal_plan_id: str, full: bool = False, nocache: bo
                 return {"meal_plan": formatted_meals, "cache_source": "redis"}
         
         # If not in cache or requesting full meal plan, find meals in MongoDB
-        query = {"meal_plan_id": meal_plan_id}
+        query = plan_meals_filter(meal_plan_id)
         
         # If requesting full meal plan, don't use limit (return all matching meals)
-        meals = list(meals_collection.find(query))
+        meals = await meals_collection.find(query).to_list(length=None)
         
         # If no meals found, try request_hash
         if not meals:
-            meals = list(meals_collection.find({"request_hash": meal_plan_id}))
+            meals = await meals_collection.find(request_meals_filter(meal_plan_id)).to_list(length=None)
             if not meals:
                 raise HTTPException(status_code=404, detail="Meal plan still generating")
         
@@ -681,7 +789,7 @@ async def get_meal_plan_by_id(meal_plan_id: str, full: bool = False, nocache: bo
         
         # Cache the results in Redis (unless nocache was specified)
         if use_cache:
-            set_cache(cache_key, meals, MEAL_CACHE_TTL)
+            await aset_cache(cache_key, meals, MEAL_CACHE_TTL)
         
         # Format the meals for return
         formatted_meals = []
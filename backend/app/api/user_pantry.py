@@ -1,27 +1,24 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, status
-from pymongo import MongoClient
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Dict, List, Any, Optional
 import datetime
 import os
 import uuid
 import requests
-import json
-import google.generativeai as genai
-from app.utils.redis_client import get_cache, set_cache, delete_cache, PROFILE_CACHE_TTL
+from app.utils.db import async_collection
+from app.utils.redis_client import get_cache, set_cache, aget_cache, aset_cache, adelete_cache, PROFILE_CACHE_TTL
 from app.api.user_recipes import get_auth0_user
+from app.utils.llm import generate, agenerate
+from app.utils.llm_json import parse_llm_json, json_generation_config, LLMJSONError
 
-# Set up Gemini API
+# Gemini calls go through the shared gateway in app.utils.llm
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
 
-# Get the MongoDB connection details
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["grovli"]
-user_pantry_collection = db["user_pantry"]
-user_collection = db["users"]
-meals_collection = db["meals"]
+# MongoDB through the shared async client
+user_pantry_collection = async_collection("user_pantry")
+user_collection = async_collection("users")
+meals_collection = async_collection("meals")
 
 router = APIRouter(prefix="/user-pantry", tags=["User Pantry"])
 
@@ -90,8 +87,7 @@ def auto_categorize_item(item_name: str) -> str:
         ]
         
         # Generate categorization using Gemini
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content(prompt_parts)
+        response = generate(prompt_parts, caller="pantry_categorize")
         
         # Process response
         category = response.text.strip()
@@ -186,19 +182,16 @@ def get_meal_recommendations(ingredients: List[str], dietary_preferences: Option
         )
         
         # Generate recommendations using Gemini
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content(prompt_parts)
+        response = generate(prompt_parts, caller="pantry_recommendations", generation_config=json_generation_config())
         
         # Parse the response to extract JSON
         try:
             # Attempt to find and parse JSON in the response
             response_text = response.text
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            
-            if json_start >= 0 and json_end > json_start:
-                json_str = response_text[json_start:json_end]
-                recommendations = json.loads(json_str)
+            if '{' in response_text or '[' in response_text:
+                recommendations = parse_llm_json(response_text)
+                if isinstance(recommendations, list):
+                    recommendations = {"recommendations": recommendations}
                 return recommendations
             
             # If no valid JSON found, process as text and convert to JSON format
@@ -233,7 +226,7 @@ def get_meal_recommendations(ingredients: List[str], dietary_preferences: Option
             
             return {"recommendations": meals}
             
-        except json.JSONDecodeError:
+        except LLMJSONError:
             # If JSON parsing fails, return a structured format of the text
             return {
                 "recommendations": [
@@ -256,7 +249,7 @@ async def add_pantry_item(item: PantryItem, current_user: dict = Depends(get_aut
         
         # Auto-categorize if category is not provided
         if not item.category:
-            item.category = auto_categorize_item(item.name)
+            item.category = await run_in_threadpool(auto_categorize_item, item.name)
         
         # Prepare the item document
         pantry_item = {
@@ -274,13 +267,13 @@ async def add_pantry_item(item: PantryItem, current_user: dict = Depends(get_aut
         }
         
         # Save to database
-        result = user_pantry_collection.insert_one(pantry_item)
+        result = await user_pantry_collection.insert_one(pantry_item)
         
         # Convert MongoDB ObjectId to string for JSON response
         pantry_item["_id"] = str(result.inserted_id)
         
         # Invalidate user pantry cache
-        delete_cache(f"user_pantry:{current_user.get('sub')}")
+        await adelete_cache(f"user_pantry:{current_user.get('sub')}")
         
         return pantry_item
     
@@ -296,13 +289,13 @@ async def get_pantry_items(current_user: dict = Depends(get_auth0_user)):
     try:
         # Check Redis cache first
         cache_key = f"user_pantry:{current_user.get('sub')}"
-        cached_items = get_cache(cache_key)
+        cached_items = await aget_cache(cache_key)
         
         if cached_items:
             return {"items": cached_items}
         
         # If not in cache, query MongoDB
-        items = list(user_pantry_collection.find({"user_id": current_user.get("sub")}))
+        items = await user_pantry_collection.find({"user_id": current_user.get("sub")}).to_list(length=None)
         
         # Convert ObjectId to string for each item
         for item in items:
@@ -315,7 +308,7 @@ async def get_pantry_items(current_user: dict = Depends(get_auth0_user)):
                 item["updated_at"] = item["updated_at"].isoformat()
         
         # Cache the results
-        set_cache(cache_key, items, PROFILE_CACHE_TTL)
+        await aset_cache(cache_key, items, PROFILE_CACHE_TTL)
         
         return {"items": items}
     
@@ -329,7 +322,7 @@ async def get_pantry_items(current_user: dict = Depends(get_auth0_user)):
 async def delete_pantry_item(item_id: str, current_user: dict = Depends(get_auth0_user)):
     """Delete a pantry item"""
     try:
-        result = user_pantry_collection.delete_one({
+        result = await user_pantry_collection.delete_one({
             "id": item_id,
             "user_id": current_user.get("sub")
         })
@@ -341,7 +334,7 @@ async def delete_pantry_item(item_id: str, current_user: dict = Depends(get_auth
             )
         
         # Invalidate cache
-        delete_cache(f"user_pantry:{current_user.get('sub')}")
+        await adelete_cache(f"user_pantry:{current_user.get('sub')}")
         
         return {"message": "Pantry item deleted successfully"}
     
@@ -358,7 +351,7 @@ async def update_pantry_item(item_id: str, item: PantryItem, current_user: dict
     """Update a pantry item"""
     try:
         # Get the existing item to make sure it belongs to the user
-        existing_item = user_pantry_collection.find_one({
+        existing_item = await user_pantry_collection.find_one({
             "id": item_id,
             "user_id": current_user.get("sub")
         })
@@ -371,7 +364,7 @@ async def update_pantry_item(item_id: str, item: PantryItem, current_user: dict
         
         # Auto-categorize if category is not provided
         if not item.category and item.name != existing_item.get("name"):
-            item.category = auto_categorize_item(item.name)
+            item.category = await run_in_threadpool(auto_categorize_item, item.name)
         
         # Prepare update document
         update_doc = {
@@ -393,16 +386,16 @@ async def update_pantry_item(item_id: str, item: PantryItem, current_user: dict
             update_doc["imageUrl"] = item.imageUrl
         
         # Update the item
-        user_pantry_collection.update_one(
+        await user_pantry_collection.update_one(
             {"id": item_id, "user_id": current_user.get("sub")},
             {"$set": update_doc}
         )
         
         # Invalidate cache
-        delete_cache(f"user_pantry:{current_user.get('sub')}")
+        await adelete_cache(f"user_pantry:{current_user.get('sub')}")
         
         # Get the updated item
-        updated_item = user_pantry_collection.find_one({"id": item_id})
+        updated_item = await user_pantry_collection.find_one({"id": item_id})
         if "_id" in updated_item:
             updated_item["_id"] = str(updated_item["_id"])
         
@@ -420,7 +413,7 @@ async def update_pantry_item(item_id: str, item: PantryItem, current_user: dict
 async def lookup_barcode(request: BarcodeRequest):
     """Look up product information using a barcode"""
     try:
-        product = get_product_from_barcode(request.barcode)
+        product = await run_in_threadpool(get_product_from_barcode, request.barcode)
         
         if not product:
             return {
@@ -446,7 +439,7 @@ async def recommend_meals(request: MealRecommendationRequest, current_user: dict
         # If no ingredients provided, try to use all ingredients from the user's pantry
         if not request.ingredients or len(request.ingredients) == 0:
             pantry_items = user_pantry_collection.find({"user_id": current_user.get("sub")})
-            ingredients = [item["name"] for item in pantry_items]
+            ingredients = [item["name"] async for item in pantry_items]
             
             if not ingredients:
                 raise HTTPException(
@@ -459,12 +452,12 @@ async def recommend_meals(request: MealRecommendationRequest, current_user: dict
         # Get dietary preferences from user profile if not provided
         dietary_preferences = request.dietary_preferences
         if not dietary_preferences:
-            user_profile = user_collection.find_one({"id": current_user.get("sub")})
+            user_profile = await user_collection.find_one({"id": current_user.get("sub")})
             if user_profile and "dietary_preferences" in user_profile:
                 dietary_preferences = " ".join(user_profile["dietary_preferences"])
         
         # Get recommendations
-        recommendations = get_meal_recommendations(ingredients, dietary_preferences)
+        recommendations = await run_in_threadpool(get_meal_recommendations, ingredients, dietary_preferences)
         
         return recommendations
     
@@ -492,7 +485,7 @@ async def bulk_add_pantry_items(
             
             # Auto-categorize if category is not provided
             if not item_data.category:
-                item_data.category = auto_categorize_item(item_data.name)
+                item_data.category = await run_in_threadpool(auto_categorize_item, item_data.name)
             
             # Prepare the item document
             pantry_item = {
@@ -516,7 +509,7 @@ async def bulk_add_pantry_items(
                 pantry_item["imageUrl"] = item_data.imageUrl
             
             # Insert the item
-            result = user_pantry_collection.insert_one(pantry_item)
+            result = await user_pantry_collection.insert_one(pantry_item)
             
             # Convert MongoDB ObjectId to string for serialization
             pantry_item_response = {**pantry_item, "_id": str(result.inserted_id)}
@@ -524,7 +517,7 @@ async def bulk_add_pantry_items(
             added_items.append(pantry_item_response)
         
         # Invalidate user pantry cache
-        delete_cache(f"user_pantry:{current_user.get('sub')}")
+        await adelete_cache(f"user_pantry:{current_user.get('sub')}")
         
         return {
             "message": f"Successfully added {len(added_items)} items to pantry",
@@ -556,8 +549,7 @@ async def suggest_ingredient(request: IngredientSuggestionRequest, current_user:
         ]
         
         # Generate suggestion using Gemini
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content(prompt_parts)
+        response = await agenerate(prompt_parts, caller="pantry_suggest_ingredient")
         
         # Process response
         suggested_ingredient = response.text.strip()
@@ -1,19 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, status
-from pymongo import MongoClient
 from typing import Dict, List, Any, Optional
 import datetime
-import os
 import uuid
 from pydantic import BaseModel 
 from app.utils.celery_config import celery_app
-from app.utils.redis_client import get_cache, set_cache, delete_cache, PROFILE_CACHE_TTL
+from app.utils.db import async_collection, collection
+from app.utils.redis_client import aget_cache, aset_cache, adelete_cache, delete_cache, PROFILE_CACHE_TTL
 
-# Get the MongoDB connection details
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["grovli"]
-user_meal_plans_collection = db["user_meal_plans"]
-saved_meals_collection = db["saved_meals"]
-user_collection = db["users"]
+# MongoDB through the shared async client
+user_meal_plans_collection = async_collection("user_meal_plans")
+saved_meals_collection = async_collection("saved_meals")
+user_collection = async_collection("users")
+meals_collection = async_collection("meals")
+
+# The cleanup task runs in Celery, which uses pymongo
+sync_users_collection = collection("users")
+sync_user_meal_plans_collection = collection("user_meal_plans")
 
 router = APIRouter(prefix="/user-plans", tags=["User Meal Plans"])
 
@@ -48,11 +50,11 @@ class DeleteMealRequest(BaseModel):
 # --- Helper to get user from Auth0 ID ---
 async def get_user_by_auth0_id(auth0_id: str):
     cache_key = f"user:{auth0_id}"
-    cached_user = get_cache(cache_key)
+    cached_user = await aget_cache(cache_key)
     if cached_user:
         return cached_user
         
-    user = user_collection.find_one({"auth0_id": auth0_id})
+    user = await user_collection.find_one({"auth0_id": auth0_id})
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -64,14 +66,21 @@ async def get_user_by_auth0_id(auth0_id: str):
     else:
         user_clean = user
         
-    set_cache(cache_key, user_clean, PROFILE_CACHE_TTL)
+    await aset_cache(cache_key, user_clean, PROFILE_CACHE_TTL)
     return user
 
+async def find_saved_recipe(meal_id: str):
+    """Finds a recipe by id in the users' saved meal plans."""
+    saved_plan = await saved_meals_collection.find_one({"recipes.id": meal_id}, {"recipes.$": 1})
+    if saved_plan and saved_plan.get("recipes"):
+        return saved_plan["recipes"][0]
+    return None
+
 # --- API Endpoints ---
 @router.post("/save")
 async def save_meal_plan(request: SaveMealPlanRequest):
     try:
-        user = user_collection.find_one({"auth0_id": request.userId})
+        user = await user_collection.find_one({"auth0_id": request.userId})
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -99,7 +108,7 @@ async def save_meal_plan(request: SaveMealPlanRequest):
             else:
                 # Fallback to cache/database lookup
                 meal_cache_key = f"meal:{meal_item.mealId}"
-                cached_meal = get_cache(meal_cache_key)
+                cached_meal = await aget_cache(meal_cache_key)
                 
                 if cached_meal:
                     meal_details = {
@@ -114,21 +123,10 @@ async def save_meal_plan(request: SaveMealPlanRequest):
                         "calories": cached_meal["macros"].get("calories", 0)
                     }
                 else:
-                    meal_details = None
-                    saved_meal_plans = saved_meals_collection.find({})
-                    
-                    for plan in saved_meal_plans:
-                        if "recipes" in plan:
-                            for recipe in plan["recipes"]:
-                                if recipe.get("id") == meal_item.mealId:
-                                    meal_details = recipe
-                                    break
-                            if meal_details:
-                                break
+                    meal_details = await find_saved_recipe(meal_item.mealId)
                     
                     if not meal_details:
-                        from app.api.meals import meals_collection
-                        meal_doc = meals_collection.find_one({"meal_id": meal_item.mealId})
+                        meal_doc = await meals_collection.find_one({"meal_id": meal_item.mealId})
                         if meal_doc:
                             meal_details = {
                                 "id": meal_doc["meal_id"],
@@ -141,7 +139,7 @@ async def save_meal_plan(request: SaveMealPlanRequest):
                                 "imageUrl": meal_doc.get("imageUrl", ""),
                                 "calories": meal_doc["macros"].get("calories", 0)
                             }
-                            set_cache(meal_cache_key, meal_doc, PROFILE_CACHE_TTL)
+                            await aset_cache(meal_cache_key, meal_doc, PROFILE_CACHE_TTL)
             
             if meal_details:
                 processed_meal = {
@@ -160,8 +158,8 @@ async def save_meal_plan(request: SaveMealPlanRequest):
             "meals": processed_meals
         }
         
-        user_meal_plans_collection.insert_one(meal_plan)
-        delete_cache(f"user_plans:{request.userId}")
+        await user_meal_plans_collection.insert_one(meal_plan)
+        await adelete_cache(f"user_plans:{request.userId}")
         
         return {
             "id": plan_id,
@@ -181,13 +179,13 @@ async def get_user_meal_plans(user_id: str):
     try:
         # Check Redis cache first
         cache_key = f"user_plans:{user_id}"
-        cached_plans = get_cache(cache_key)
+        cached_plans = await aget_cache(cache_key)
         
         if cached_plans:
             return cached_plans
         
         # If not in cache, query MongoDB
-        plans = list(user_meal_plans_collection.find({"user_id": user_id}))
+        plans = await user_meal_plans_collection.find({"user_id": user_id}).to_list(length=None)
         
         # Convert ObjectId to string and format dates to make it JSON serializable
         for plan in plans:
@@ -199,7 +197,7 @@ async def get_user_meal_plans(user_id: str):
                 plan["updated_at"] = plan["updated_at"].isoformat()
         
         # Cache the results
-        set_cache(cache_key, plans, PROFILE_CACHE_TTL)
+        await aset_cache(cache_key, plans, PROFILE_CACHE_TTL)
         
         return plans
     
@@ -214,13 +212,13 @@ async def get_meal_plan(plan_id: str):
     """Get a specific meal plan by ID"""
     # Check Redis cache first
     cache_key = f"plan:{plan_id}"
-    cached_plan = get_cache(cache_key)
+    cached_plan = await aget_cache(cache_key)
     
     if cached_plan:
         return cached_plan
     
     # If not in cache, query MongoDB
-    plan = user_meal_plans_collection.find_one({"id": plan_id})
+    plan = await user_meal_plans_collection.find_one({"id": plan_id})
     
     if not plan:
         raise HTTPException(
@@ -237,7 +235,7 @@ async def get_meal_plan(plan_id: str):
         plan["updated_at"] = plan["updated_at"].isoformat()
     
     # Cache the result
-    set_cache(cache_key, plan, PROFILE_CACHE_TTL)
+    await aset_cache(cache_key, plan, PROFILE_CACHE_TTL)
     
     return plan
 
@@ -247,8 +245,7 @@ async def update_meal_plan(request: UpdateMealPlanRequest):
     """Update an existing meal plan"""
     try:
         # Verify plan exists
-        from app.api.meals import meals_collection
-        plan = user_meal_plans_collection.find_one({"id": request.planId})
+        plan = await user_meal_plans_collection.find_one({"id": request.planId})
         if not plan:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -269,7 +266,7 @@ async def update_meal_plan(request: UpdateMealPlanRequest):
             
             # Check Redis cache for meal details
             meal_cache_key = f"meal:{meal_item.mealId}"
-            cached_meal = get_cache(meal_cache_key)
+            cached_meal = await aget_cache(meal_cache_key)
             
             if cached_meal:
                 # Use cached meal details
@@ -289,21 +286,11 @@ async def update_meal_plan(request: UpdateMealPlanRequest):
                 meal_details = None
                 
                 # Look up meal from saved_meals collection
-                saved_meal_plans = saved_meals_collection.find({})
-                
-                # Search through saved meal plans for this meal
-                for saved_plan in saved_meal_plans:
-                    if "recipes" in saved_plan:
-                        for recipe in saved_plan["recipes"]:
-                            if recipe.get("id") == meal_item.mealId:
-                                meal_details = recipe
-                                break
-                        if meal_details:
-                            break
+                meal_details = await find_saved_recipe(meal_item.mealId)
                 
                 # If not found in saved_meals, check meals collection
                 if not meal_details:
-                    meal_doc = meals_collection.find_one({"meal_id": meal_item.mealId})
+                    meal_doc = await meals_collection.find_one({"meal_id": meal_item.mealId})
                     if meal_doc:
                         meal_details = {
                             "id": meal_doc["meal_id"],
@@ -318,7 +305,7 @@ async def update_meal_plan(request: UpdateMealPlanRequest):
                         }
                         
                         # Cache this meal for future requests
-                        set_cache(meal_cache_key, meal_doc, PROFILE_CACHE_TTL)
+                        await aset_cache(meal_cache_key, meal_doc, PROFILE_CACHE_TTL)
             
             if meal_details:
                 # Ensure the meal has a name field
@@ -334,7 +321,7 @@ async def update_meal_plan(request: UpdateMealPlanRequest):
                 processed_meals.append(processed_meal)
         
         # Update the meal plan document
-        user_meal_plans_collection.update_one(
+        await user_meal_plans_collection.update_one(
             {"id": request.planId},
             {
                 "$set": {
@@ -345,11 +332,11 @@ async def update_meal_plan(request: UpdateMealPlanRequest):
         )
         
         # Invalidate caches
-        delete_cache(f"plan:{request.planId}")
+        await adelete_cache(f"plan:{request.planId}")
         
         # Get user ID to invalidate user plans cache
         if plan and "user_id" in plan:
-            delete_cache(f"user_plans:{plan['user_id']}")
+            await adelete_cache(f"user_plans:{plan['user_id']}")
         
         return {"message": "Meal plan updated successfully"}
     
@@ -363,10 +350,10 @@ async def update_meal_plan(request: UpdateMealPlanRequest):
 async def delete_meal_plan(plan_id: str):
     """Delete a meal plan"""
     # Get user ID before deleting for cache invalidation
-    plan = user_meal_plans_collection.find_one({"id": plan_id})
+    plan = await user_meal_plans_collection.find_one({"id": plan_id})
     user_id = plan.get("user_id") if plan else None
     
-    result = user_meal_plans_collection.delete_one({"id": plan_id})
+    result = await user_meal_plans_collection.delete_one({"id": plan_id})
     
     if result.deleted_count == 0:
         raise HTTPException(
@@ -375,9 +362,9 @@ async def delete_meal_plan(plan_id: str):
         )
     
     # Invalidate caches
-    delete_cache(f"plan:{plan_id}")
+    await adelete_cache(f"plan:{plan_id}")
     if user_id:
-        delete_cache(f"user_plans:{user_id}")
+        await adelete_cache(f"user_plans:{user_id}")
     
     return {"message": "Meal plan deleted successfully"}
 
@@ -386,7 +373,7 @@ async def delete_meal_from_plan(request: DeleteMealRequest):
     """Delete a specific meal from a plan"""
     try:
         # Get the current plan
-        plan = user_meal_plans_collection.find_one({"id": request.planId})
+        plan = await user_meal_plans_collection.find_one({"id": request.planId})
         if not plan:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -400,7 +387,7 @@ async def delete_meal_from_plan(request: DeleteMealRequest):
         ]
         
         # Update the plan
-        user_meal_plans_collection.update_one(
+        await user_meal_plans_collection.update_one(
             {"id": request.planId},
             {
                 "$set": {
@@ -411,9 +398,9 @@ async def delete_meal_from_plan(request: DeleteMealRequest):
         )
         
         # Invalidate caches
-        delete_cache(f"plan:{request.planId}")
+        await adelete_cache(f"plan:{request.planId}")
         if "user_id" in plan:
-            delete_cache(f"user_plans:{plan['user_id']}")
+            await adelete_cache(f"user_plans:{plan['user_id']}")
         
         return {"message": "Meal deleted from plan successfully"}
     
@@ -429,17 +416,17 @@ def cleanup_orphaned_meal_plans():
     """Background task to remove meal plans for users that no longer exist"""
     try:
         # Get all user IDs
-        user_ids = [user["id"] for user in user_collection.find({}, {"id": 1})]
+        user_ids = [user["id"] for user in sync_users_collection.find({}, {"id": 1})]
         
         # Find meal plans with no associated user
-        orphaned_plans = user_meal_plans_collection.find({"user_id": {"$nin": user_ids}})
+        orphaned_plans = sync_user_meal_plans_collection.find({"user_id": {"$nin": user_ids}})
         
         # Delete orphaned plans and invalidate their caches
         for plan in orphaned_plans:
             plan_id = plan.get("id")
             user_id = plan.get("user_id")
             
-            user_meal_plans_collection.delete_one({"id": plan_id})
+            sync_user_meal_plans_collection.delete_one({"id": plan_id})
             
             # Invalidate caches
             if plan_id:
@@ -1,10 +1,10 @@
 from fastapi import APIRouter, HTTPException, Request, Depends
 from pydantic import BaseModel, Field
-import os, json, datetime
+import datetime
 from typing import Optional, List
-from pymongo import MongoClient
 import logging
-from app.utils.redis_client import get_cache, set_cache, delete_cache, PROFILE_CACHE_TTL
+from app.utils.db import async_collection
+from app.utils.redis_client import aget_cache, aset_cache, adelete_cache, PROFILE_CACHE_TTL
 
 # Configure logging
 logging.basicConfig(
@@ -13,12 +13,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Connect to MongoDB
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["grovli"]
-user_profile_collection = db["user_profiles"]
-user_collection = db["users"]
-meal_completions_collection = db["meal_completions"]
+# MongoDB through the shared async client
+user_profile_collection = async_collection("user_profiles")
+user_collection = async_collection("users")
+meal_completions_collection = async_collection("meal_completions")
 
 # Create the router instance
 user_profile_router = APIRouter(prefix="/user-profile", tags=["User Profile"])
@@ -49,9 +47,9 @@ class MealCompletionStatus(BaseModel):
 
 async def ensure_user_exists(user_id: str):
     """Ensure the user exists in the user collection"""
-    user = user_collection.find_one({"auth0_id": user_id})
+    user = await user_collection.find_one({"auth0_id": user_id})
     if not user:
-        user_collection.insert_one({
+        await user_collection.insert_one({
             "auth0_id": user_id,
             "created_at": datetime.datetime.now(),
             "updated_at": datetime.datetime.now()
@@ -64,7 +62,7 @@ async def save_meal_completion(status: MealCompletionStatus):
     """Save a meal's completion status for a user on a specific date"""
     try:
         # Store in MongoDB
-        meal_completions_collection.update_one(
+        await meal_completions_collection.update_one(
             {
                 "user_id": status.user_id,
                 "date": status.date,
@@ -76,7 +74,7 @@ async def save_meal_completion(status: MealCompletionStatus):
         
         # Invalidate any cached meal data for this user/date
         cache_key = f"user_meals:{status.user_id}:{status.date}"
-        delete_cache(cache_key)
+        await adelete_cache(cache_key)
         
         return {"status": "success"}
     except Exception as e:
@@ -86,10 +84,10 @@ async def save_meal_completion(status: MealCompletionStatus):
 async def get_meal_completions(user_id: str, date: str):
     """Get all meal completion statuses for a user on a date"""
     try:
-        completions = list(meal_completions_collection.find(
+        completions = await meal_completions_collection.find(
             {"user_id": user_id, "date": date},
             {"_id": 0, "user_id": 0, "date": 0}
-        ))
+        ).to_list(length=None)
         
         # Convert to dictionary by meal type
         result = {c["meal_type"]: c["completed"] for c in completions}
@@ -105,14 +103,14 @@ async def get_user_profile(user_id: str):
         
         # Check Redis cache first
         cache_key = f"user_profile:{user_id}"
-        cached_profile = get_cache(cache_key)
+        cached_profile = await aget_cache(cache_key)
         
         if cached_profile:
             logger.info(f"Found profile in Redis cache for user {user_id}")
             return {"found": True, "profile": cached_profile, "cache_source": "redis"}
         
         # If not in cache, look up user profile in MongoDB
-        user_profile = user_profile_collection.find_one({"user_id": user_id})
+        user_profile = await user_profile_collection.find_one({"user_id": user_id})
         
         if not user_profile:
             logger.info(f"No profile found for user {user_id}")
@@ -125,7 +123,7 @@ async def get_user_profile(user_id: str):
             user_profile_clean = user_profile
             
         # Cache the profile in Redis
-        set_cache(cache_key, user_profile_clean, PROFILE_CACHE_TTL)
+        await aset_cache(cache_key, user_profile_clean, PROFILE_CACHE_TTL)
         logger.info(f"Cached user profile in Redis for user {user_id}")
             
         logger.info(f"Found profile in MongoDB for user {user_id}")
@@ -148,7 +146,7 @@ async def save_user_profile(user_id: str, profile_data: UserProfileData):
         await ensure_user_exists(user_id)
         
         # Check if profile already exists
-        existing_profile = user_profile_collection.find_one({"user_id": user_id})
+        existing_profile = await user_profile_collection.find_one({"user_id": user_id})
         
         # Prepare the data for storage
         profile_dict = profile_data.dict()
@@ -164,14 +162,14 @@ async def save_user_profile(user_id: str, profile_data: UserProfileData):
                 profile_dict["created_at"] = existing_profile["created_at"]
         
         # Update or insert the user profile
-        result = user_profile_collection.update_one(
+        result = await user_profile_collection.update_one(
             {"user_id": user_id},
             {"$set": profile_dict},
             upsert=True
         )
         
         # Also update the user record to mark onboarding as complete
-        user_collection.update_one(
+        await user_collection.update_one(
             {"auth0_id": user_id},
             {
                 "$set": {
@@ -184,7 +182,7 @@ async def save_user_profile(user_id: str, profile_data: UserProfileData):
         
         # Update the Redis cache
         cache_key = f"user_profile:{user_id}"
-        set_cache(cache_key, profile_dict, PROFILE_CACHE_TTL)
+        await aset_cache(cache_key, profile_dict, PROFILE_CACHE_TTL)
         logger.info(f"Updated user profile in Redis cache for user {user_id}")
         
         logger.info(f"Profile saved for user {user_id}: Modified={result.modified_count}, Upserted={result.upserted_id is not None}")
@@ -219,7 +217,7 @@ async def check_onboarding_status(user_id: str, request: Request):
             }
 
         # Check if the user exists in the `users` collection
-        user = user_collection.find_one({"auth0_id": user_id})
+        user = await user_collection.find_one({"auth0_id": user_id})
         if not user:
             logger.info(f"User {user_id} not found in the users collection.")
             return {
@@ -232,7 +230,7 @@ async def check_onboarding_status(user_id: str, request: Request):
         onboarding_completed = user.get("onboarding_completed", False)
 
         # Check if a user profile exists in the `user_profiles` collection
-        profile_exists = user_profile_collection.find_one({"user_id": user_id}) is not None
+        profile_exists = await user_profile_collection.find_one({"user_id": user_id}) is not None
 
         if "onboarding_completed" in user and user["onboarding_completed"] is False:
             onboarded = False
@@ -266,7 +264,7 @@ async def reset_onboarding(user_id: str):
         logger.info(f"Resetting onboarding status for user: {user_id}")
         
         # Update the user record to mark onboarding as incomplete
-        result = user_collection.update_one(
+        result = await user_collection.update_one(
             {"auth0_id": user_id},
             {
                 "$set": {
@@ -286,7 +284,7 @@ async def reset_onboarding(user_id: str):
             
         # Clear the Redis cache for this user's profile to ensure fresh data
         cache_key = f"user_profile:{user_id}"
-        delete_cache(cache_key)
+        await adelete_cache(cache_key)
         
         logger.info(f"Successfully reset onboarding status for user {user_id}")
         
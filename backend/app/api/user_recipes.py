@@ -1,11 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
-from pymongo import MongoClient
 from typing import List
 from pydantic import BaseModel
 import datetime, os, requests, uuid
 import hashlib
 from jose import jwt, JWTError
-from app.utils.redis_client import get_cache, set_cache, delete_cache, flush_pattern, PROFILE_CACHE_TTL, AUTH_CACHE_TTL
+from fastapi.concurrency import run_in_threadpool
+from app.utils.db import async_collection
+from app.utils.redis_client import aget_cache, aset_cache, adelete_cache, aflush_pattern, PROFILE_CACHE_TTL, AUTH_CACHE_TTL
 router = APIRouter(prefix="/user-recipes", tags=["User Recipes"])
 
 # Auth0 Configuration - Make sure these are set in your environment variables
@@ -17,12 +18,10 @@ JWKS_URL = f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
 jwks_cache = None
 jwks_last_fetched = 0
 
-# Get the database and collections
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["grovli"]
-meals_collection = db["meals"]
-user_collection = db["users"]
-saved_meal_plans_collection = db["saved_meals"]
+# MongoDB through the shared async client
+meals_collection = async_collection("meals")
+user_collection = async_collection("users")
+saved_meal_plans_collection = async_collection("saved_meals")
 
 # --- Pydantic Models ---
 
@@ -64,12 +63,12 @@ async def get_auth0_user(request: Request):
     
     # Check Redis cache first for user
     cache_key = f"user:{auth0_id}"
-    cached_user = get_cache(cache_key)
+    cached_user = await aget_cache(cache_key)
     if cached_user:
         return cached_user
     
     # Check if user exists in database
-    user = user_collection.find_one({"auth0_id": auth0_id})
+    user = await user_collection.find_one({"auth0_id": auth0_id})
     
     # If user doesn't exist, create new user record
     if not user:
@@ -83,8 +82,8 @@ async def get_auth0_user(request: Request):
             "username": username,
             "created_at": datetime.datetime.now()
         }
-        user_collection.insert_one(user)
-        user = user_collection.find_one({"auth0_id": auth0_id})
+        await user_collection.insert_one(user)
+        user = await user_collection.find_one({"auth0_id": auth0_id})
     
     # Clean user object for caching
     if "_id" in user:
@@ -93,7 +92,7 @@ async def get_auth0_user(request: Request):
         user_clean = user
     
     # Cache the user
-    set_cache(cache_key, user_clean, PROFILE_CACHE_TTL)
+    await aset_cache(cache_key, user_clean, PROFILE_CACHE_TTL)
     
     return user
 
@@ -129,16 +128,16 @@ async def save_recipes(request: SaveRecipeRequest, current_user: dict = Depends(
         # Check Redis cache for meal details
         if recipe_id:
             meal_cache_key = f"meal:{recipe_id}"
-            cached_meal = get_cache(meal_cache_key)
+            cached_meal = await aget_cache(meal_cache_key)
             
             if cached_meal:
                 mongo_recipe = cached_meal
             else:
-                mongo_recipe = meals_collection.find_one({"meal_id": recipe_id})
+                mongo_recipe = await meals_collection.find_one({"meal_id": recipe_id})
                 if mongo_recipe:
                     # Clean and cache the meal WITH imageUrl
                     mongo_recipe_clean = {k: v for k, v in mongo_recipe.items() if k != "_id"}
-                    set_cache(meal_cache_key, mongo_recipe_clean, PROFILE_CACHE_TTL)
+                    await aset_cache(meal_cache_key, mongo_recipe_clean, PROFILE_CACHE_TTL)
         else:
             mongo_recipe = None
         
@@ -174,10 +173,10 @@ async def save_recipes(request: SaveRecipeRequest, current_user: dict = Depends(
     }
     
     # Save to database
-    saved_meal_plans_collection.insert_one(meal_plan)
+    await saved_meal_plans_collection.insert_one(meal_plan)
     
     # Invalidate user's saved recipes cache
-    flush_pattern(f"user_saved_recipes:{user_id}*")
+    await aflush_pattern(f"user_saved_recipes:{user_id}*")
     
     # Return the created plan
     response_data = {
@@ -201,7 +200,7 @@ async def save_recipes(request: SaveRecipeRequest, current_user: dict = Depends(
     
     # Cache this new plan (including imageUrl)
     cache_data = response_data.copy()
-    set_cache(f"saved_plan:{plan_id}", cache_data, PROFILE_CACHE_TTL)
+    await aset_cache(f"saved_plan:{plan_id}", cache_data, PROFILE_CACHE_TTL)
     
     return response_data
 
@@ -222,7 +221,7 @@ async def get_saved_recipes(
     
     # Check Redis cache first
     cache_key = f"user_saved_recipes:{user_id}:{skip}:{limit}"
-    cached_plans = get_cache(cache_key)
+    cached_plans = await aget_cache(cache_key)
     
     if cached_plans:
         # ✅ Return cached data directly
@@ -234,7 +233,7 @@ async def get_saved_recipes(
     ).sort("created_at", -1).skip(skip).limit(limit)
     
     meal_plans = []
-    for doc in cursor:
+    async for doc in cursor:
         # Convert ObjectId to string to make it JSON serializable
         if "_id" in doc:
             doc["_id"] = str(doc["_id"])
@@ -247,7 +246,7 @@ async def get_saved_recipes(
     for plan in meal_plans:
         cache_plan = plan.copy()
         cache_meal_plans.append(cache_plan)
-    set_cache(cache_key, cache_meal_plans, PROFILE_CACHE_TTL)
+    await aset_cache(cache_key, cache_meal_plans, PROFILE_CACHE_TTL)
     
     return meal_plans
 
@@ -264,7 +263,7 @@ async def get_saved_meal_plan(plan_id: str, current_user: dict = Depends(get_aut
     
     # Check Redis cache first
     cache_key = f"saved_plan:{plan_id}"
-    cached_plan = get_cache(cache_key)
+    cached_plan = await aget_cache(cache_key)
     
     if cached_plan:
         if cached_plan.get("user_id") == user_id:
@@ -272,7 +271,7 @@ async def get_saved_meal_plan(plan_id: str, current_user: dict = Depends(get_aut
             return cached_plan
             
     # If not in cache or not owned by this user, query MongoDB
-    meal_plan = saved_meal_plans_collection.find_one({
+    meal_plan = await saved_meal_plans_collection.find_one({
         "id": plan_id,
         "user_id": user_id
     })
@@ -291,7 +290,7 @@ async def get_saved_meal_plan(plan_id: str, current_user: dict = Depends(get_aut
     
     # Cache the result (including imageUrl)
     cache_plan = meal_plan.copy()
-    set_cache(cache_key, cache_plan, PROFILE_CACHE_TTL)
+    await aset_cache(cache_key, cache_plan, PROFILE_CACHE_TTL)
     
     return meal_plan
 
@@ -309,7 +308,7 @@ async def delete_saved_meal_plan(
             detail="User ID not found in user data"
         )
     
-    result = saved_meal_plans_collection.delete_one({
+    result = await saved_meal_plans_collection.delete_one({
         "id": plan_id,
         "user_id": user_id
     })
@@ -321,8 +320,8 @@ async def delete_saved_meal_plan(
         )
     
     # Invalidate caches
-    delete_cache(f"saved_plan:{plan_id}")
-    flush_pattern(f"user_saved_recipes:{user_id}*")  
+    await adelete_cache(f"saved_plan:{plan_id}")
+    await aflush_pattern(f"user_saved_recipes:{user_id}*")  
     
     return {"message": "Meal plan deleted successfully"}
 
@@ -341,7 +340,7 @@ async def get_current_user_from_auth0(request: Request):
         cache_key = f"auth0_token:{token_hash}"
         
         # Check Redis cache first
-        cached_payload = get_cache(cache_key)
+        cached_payload = await aget_cache(cache_key)
         if cached_payload:
             print(f"Using cached token validation for sub: {cached_payload.get('sub', 'unknown')}")
             return cached_payload
@@ -363,7 +362,7 @@ async def get_current_user_from_auth0(request: Request):
         
         # Check Redis for JWKS cache
         jwks_cache_key = f"auth0_jwks:{AUTH0_DOMAIN}"
-        cached_jwks = get_cache(jwks_cache_key)
+        cached_jwks = await aget_cache(jwks_cache_key)
         
         if cached_jwks:
             print(f"Using cached JWKS from Redis")
@@ -371,13 +370,13 @@ async def get_current_user_from_auth0(request: Request):
         elif jwks_cache is None or current_time - jwks_last_fetched > 3600:  # Cache for 1 hour
             try:
                 print(f"Fetching JWKS from {JWKS_URL}")
-                jwks_response = requests.get(JWKS_URL, timeout=10)
+                jwks_response = await run_in_threadpool(requests.get, JWKS_URL, timeout=10)
                 jwks_response.raise_for_status()
                 jwks_cache = jwks_response.json()
                 jwks_last_fetched = current_time
                 
                 # Cache JWKS in Redis for 24 hours
-                set_cache(jwks_cache_key, jwks_cache, 86400)  # 24 hours
+                await aset_cache(jwks_cache_key, jwks_cache, 86400)  # 24 hours
                 print("JWKS fetched successfully and cached in Redis")
             except Exception as e:
                 print(f"Error fetching JWKS: {str(e)}")
@@ -407,7 +406,7 @@ async def get_current_user_from_auth0(request: Request):
             
             # Cache the validated payload in Redis
             # Use a shorter TTL than the actual token to ensure we refresh before expiry
-            set_cache(cache_key, payload, AUTH_CACHE_TTL)
+            await aset_cache(cache_key, payload, AUTH_CACHE_TTL)
             
             print(f"Token validated successfully for sub: {payload.get('sub', 'unknown')}")
             return payload
@@ -447,7 +446,7 @@ async def is_recipe_saved(
         
         # Check Redis cache first
         cache_key = f"is_saved:{user_id}:{recipe_id}"
-        cached_result = get_cache(cache_key)
+        cached_result = await aget_cache(cache_key)
         
         if cached_result is not None:  # Check explicitly against None since False is a valid result
             return {"isSaved": cached_result}
@@ -456,17 +455,17 @@ async def is_recipe_saved(
         saved_plans = saved_meal_plans_collection.find({"user_id": user_id})
         
         # Check if the recipe exists in any plan
-        for plan in saved_plans:
+        async for plan in saved_plans:
             if "recipes" in plan:
                 for recipe in plan["recipes"]:
                     if recipe.get("recipe_id") == recipe_id or recipe.get("id") == recipe_id:
                         # Cache the positive result
-                        set_cache(cache_key, True, PROFILE_CACHE_TTL)
+                        await aset_cache(cache_key, True, PROFILE_CACHE_TTL)
                         return {"isSaved": True}
         
         # If we've gone through all plans and not found it
         # Cache the negative result
-        set_cache(cache_key, False, PROFILE_CACHE_TTL)
+        await aset_cache(cache_key, False, PROFILE_CACHE_TTL)
         return {"isSaved": False}
     
     except Exception as e:
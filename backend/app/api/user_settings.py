@@ -1,10 +1,10 @@
 from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel, Field
-import os, json, datetime
+import datetime
 from typing import Optional
-from pymongo import MongoClient
 import logging
-from app.utils.redis_client import get_cache, set_cache, delete_cache, PROFILE_CACHE_TTL
+from app.utils.db import async_collection
+from app.utils.redis_client import aget_cache, aset_cache, PROFILE_CACHE_TTL
 
 
 # Configure logging
@@ -14,10 +14,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Connect to MongoDB using the same connection as other routers
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["grovli"]
-user_settings_collection = db["user_settings"]
+# MongoDB through the shared async client
+user_settings_collection = async_collection("user_settings")
 
 # Create the router instance
 user_settings_router = APIRouter(prefix="/user-settings", tags=["User Settings"])
@@ -61,14 +59,14 @@ async def get_user_settings(user_id: str):
         
         # Check Redis cache first
         cache_key = f"user_settings:{user_id}"
-        cached_settings = get_cache(cache_key)
+        cached_settings = await aget_cache(cache_key)
         
         if cached_settings:
             logger.info(f"Found settings in Redis cache for user {user_id}")
             return cached_settings
         
         # If not in cache, look up user settings in MongoDB
-        user_settings = user_settings_collection.find_one({"user_id": user_id})
+        user_settings = await user_settings_collection.find_one({"user_id": user_id})
         
         if not user_settings:
             logger.info(f"No settings found for user {user_id}, returning defaults")
@@ -83,7 +81,7 @@ async def get_user_settings(user_id: str):
             user_settings_clean = user_settings
         
         # Cache the settings in Redis
-        set_cache(cache_key, user_settings_clean, PROFILE_CACHE_TTL)
+        await aset_cache(cache_key, user_settings_clean, PROFILE_CACHE_TTL)
         logger.info(f"Cached user settings in Redis for user {user_id}")
         
         logger.info(f"Found settings in MongoDB for user {user_id}")
@@ -112,7 +110,7 @@ async def save_user_settings(user_id: str, settings: UserSettings):
         }
         
         # Update or insert the user settings in MongoDB
-        result = user_settings_collection.update_one(
+        result = await user_settings_collection.update_one(
             {"user_id": user_id},
             {"$set": settings_dict},
             upsert=True
@@ -120,7 +118,7 @@ async def save_user_settings(user_id: str, settings: UserSettings):
         
         # Update the Redis cache
         cache_key = f"user_settings:{user_id}"
-        set_cache(cache_key, settings_dict, PROFILE_CACHE_TTL)
+        await aset_cache(cache_key, settings_dict, PROFILE_CACHE_TTL)
         logger.info(f"Updated user settings in Redis cache for user {user_id}")
         
         logger.info(f"Settings saved for user {user_id}: Modified={result.modified_count}, Upserted={result.upserted_id is not None}")
@@ -1,4 +1,5 @@
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.meals import router as meal_plan_router
 from app.api.list import router as shopping_list_router
@@ -9,6 +10,10 @@ from app.api.user_settings import user_settings_router
 from app.api.user_profile import user_profile_router
 from app.api.user_pantry import router as user_pantry_router
 from app.api.cultural_info import router as cultural_info_router
+from app.utils.indexes import ensure_indexes_on_startup
+from app.utils.db import get_pool_stats
+from app.utils.redis_client import get_redis_pool_stats
+import os
 
 import logging
 
@@ -19,6 +24,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Whether GET /stats/connections is served; keep it off where the API is publicly reachable
+CONNECTION_STATS_ENABLED = os.getenv("CONNECTION_STATS_ENABLED", "false").lower() == "true"
+
 app = FastAPI()
 
 # Configure CORS
@@ -41,6 +49,18 @@ app.include_router(user_profile_router)
 app.include_router(user_pantry_router, prefix="/api")
 app.include_router(cultural_info_router)
 
+@app.on_event("startup")
+async def create_indexes():
+    # Idempotent, so every API worker can run it; pymongo is blocking, so it runs off the event loop
+    await run_in_threadpool(ensure_indexes_on_startup)
+
+# Pool counts are operational detail, so the endpoint only exists where monitoring enables it
+if CONNECTION_STATS_ENABLED:
+    @app.get("/stats/connections")
+    def connection_stats():
+        # Counts are per API worker process, so the pid tells the workers apart
+        return {"pid": os.getpid(), "mongo": get_pool_stats(), "redis": get_redis_pool_stats()}
+
 @app.get("/")
 def root():
     return {"message": "Meal Plan API is running"}
\ No newline at end of file
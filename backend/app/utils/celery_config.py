@@ -1,6 +1,15 @@
 from celery import Celery
+from celery.schedules import crontab
+from kombu import Queue
 import os
 
+from app.utils.green import green_pool_active, make_grpc_green
+
+# Workers started with `-P gevent` are patched by celery before this module is imported;
+# gRPC (Gemini, Vertex AI) needs its own switch before any channel is opened
+if green_pool_active():
+    make_grpc_green()
+
 # Configure Celery
 celery_app = Celery(
     'grovli',
@@ -9,6 +18,10 @@ celery_app = Celery(
     include=['app.utils.tasks'] 
 )
 
+# Generation priorities. On the Redis broker a lower number is consumed first.
+GENERATION_PRIORITY_INTERACTIVE = 3
+GENERATION_PRIORITY_BACKGROUND = 9
+
 # Optional configuration
 celery_app.conf.update(
     task_serializer='json',
@@ -18,5 +31,39 @@ celery_app.conf.update(
     enable_utc=True,
     task_acks_late=True,
     task_reject_on_worker_lost=True,
-    worker_prefetch_multiplier=1
+    worker_prefetch_multiplier=1,
+    # Each kind of work has its own queue and worker pool, so interactive chat replies never
+    # wait behind meal plan generation and text generation never blocks on image I/O.
+    # Scheduled maintenance stays on the default queue.
+    task_default_queue='celery',
+    task_queues=(
+        Queue('celery'),
+        Queue('chat'),
+        Queue('generation'),
+        Queue('images'),
+        Queue('notifications'),
+    ),
+    task_routes={
+        'generate_chat_response': {'queue': 'chat'},
+        'generate_meal_plan': {'queue': 'generation'},
+        'generate_meal_image_task': {'queue': 'images'},
+        'notify_meal_plan_ready_task': {'queue': 'notifications'},
+    },
+    # Plans users are waiting for go ahead of prewarming; with prefetch 1 a worker only
+    # holds the task it is running, so priorities apply to everything still queued
+    task_default_priority=GENERATION_PRIORITY_INTERACTIVE,
+    broker_transport_options={
+        'priority_steps': list(range(10)),
+        'queue_order_strategy': 'priority',
+    },
+    # Popular plan shapes are pre-generated once a day, off-peak (UTC)
+    beat_schedule={
+        'prewarm-popular-plans': {
+            'task': 'prewarm_popular_plans',
+            'schedule': crontab(
+                hour=os.environ.get('PREWARM_SCHEDULE_HOUR', '4'),
+                minute=os.environ.get('PREWARM_SCHEDULE_MINUTE', '0')
+            ),
+        },
+    }
 )
\ No newline at end of file
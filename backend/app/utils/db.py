@@ -0,0 +1,185 @@
+"""
+MongoDB client registry.
+
+Each process holds at most two MongoDB clients: a pymongo client for Celery tasks,
+scripts and threadpool work, and a Motor client for the async FastAPI handlers. Both
+are created on first use and recreated after a fork, so a worker forked from a parent
+that already connected never shares its sockets. Modules take their collections from
+collection() / async_collection() rather than building a MongoClient of their own, so
+the connection count of a process is bounded by the two pool sizes below.
+
+Pool activity of both clients is counted by a connection pool listener and reported
+by get_pool_stats().
+"""
+import os
+import logging
+import threading
+from typing import Any, Callable, Dict
+
+from pymongo import MongoClient, monitoring
+from motor.motor_asyncio import AsyncIOMotorClient
+
+logger = logging.getLogger(__name__)
+
+MONGO_DB_NAME = "grovli"
+# Connections per process for each client; callers beyond it wait up to MONGO_WAIT_QUEUE_TIMEOUT_MS
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_ASYNC_MAX_POOL_SIZE = int(os.getenv("MONGO_ASYNC_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+# Idle connections above the minimum are closed after this long
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts the connections and checkouts of one client's pools, across all its servers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {
+            "open": 0, "in_use": 0, "waiting": 0, "created": 0, "closed": 0,
+            "checkouts": 0, "checkout_failures": 0, "pool_clears": 0
+        }
+
+    def _add(self, **deltas: int) -> None:
+        with self._lock:
+            for name, delta in deltas.items():
+                self.counts[name] += delta
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add(pool_clears=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add(open=1, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(open=-1, closed=1)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(waiting=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._add(waiting=-1, in_use=1, checkouts=1)
+
+    def connection_checked_in(self, event):
+        self._add(in_use=-1)
+
+
+def _client_options(max_pool_size: int, listener: PoolStatsListener) -> Dict[str, Any]:
+    return {
+        "maxPoolSize": max_pool_size,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "event_listeners": [listener],
+    }
+
+
+_client = None
+_client_pid = None
+_client_stats = None
+_async_client = None
+_async_client_pid = None
+_async_client_stats = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    """Returns this process's pymongo client, creating it on first use (and after a fork)."""
+    global _client, _client_pid, _client_stats
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                # The parent's client is left alone: closing it here would close sockets the parent still uses
+                _client_stats = PoolStatsListener()
+                _client = MongoClient(os.getenv("MONGO_URI"), **_client_options(MONGO_MAX_POOL_SIZE, _client_stats))
+                _client_pid = os.getpid()
+                logger.info(f"Created MongoDB client for process {_client_pid} (pool size {MONGO_MAX_POOL_SIZE})")
+    return _client
+
+
+def get_async_client() -> AsyncIOMotorClient:
+    """
+    Returns this process's Motor client, creating it on first use (and after a fork).
+    Motor binds to the running event loop on first use, so call it from async code.
+    """
+    global _async_client, _async_client_pid, _async_client_stats
+    if _async_client is None or _async_client_pid != os.getpid():
+        with _client_lock:
+            if _async_client is None or _async_client_pid != os.getpid():
+                _async_client_stats = PoolStatsListener()
+                _async_client = AsyncIOMotorClient(
+                    os.getenv("MONGO_URI"), **_client_options(MONGO_ASYNC_MAX_POOL_SIZE, _async_client_stats)
+                )
+                _async_client_pid = os.getpid()
+                logger.info(f"Created async MongoDB client for process {_async_client_pid} (pool size {MONGO_ASYNC_MAX_POOL_SIZE})")
+    return _async_client
+
+
+def get_database():
+    return get_client()[MONGO_DB_NAME]
+
+
+def get_async_database():
+    return get_async_client()[MONGO_DB_NAME]
+
+
+class CollectionProxy:
+    """
+    A collection looked up on the current process's client at every use, so modules can
+    bind it at import time without connecting, and keep using it across a fork.
+    """
+    __slots__ = ("name", "_get_database")
+
+    def __init__(self, get_database: Callable[[], Any], name: str):
+        self.name = name
+        self._get_database = get_database
+
+    def __getattr__(self, attr):
+        return getattr(self._get_database()[self.name], attr)
+
+    def __repr__(self) -> str:
+        return f"CollectionProxy({self.name!r})"
+
+
+def collection(name: str) -> CollectionProxy:
+    """A pymongo collection of the grovli database, for sync code."""
+    return CollectionProxy(get_database, name)
+
+
+def async_collection(name: str) -> CollectionProxy:
+    """A Motor collection of the grovli database, for async handlers."""
+    return CollectionProxy(get_async_database, name)
+
+
+def get_pool_stats() -> Dict[str, Dict[str, int]]:
+    """Connection counts of this process's clients; a client not created yet is left out."""
+    stats = {}
+    if _client_pid == os.getpid():
+        stats["sync"] = dict(_client_stats.snapshot(), max_pool_size=MONGO_MAX_POOL_SIZE)
+    if _async_client_pid == os.getpid():
+        stats["async"] = dict(_async_client_stats.snapshot(), max_pool_size=MONGO_ASYNC_MAX_POOL_SIZE)
+    return stats
@@ -0,0 +1,56 @@
+"""
+Gevent worker pools for IO-bound queues.
+
+Chat replies, notifications and images spend nearly all their time waiting on Gemini,
+Vertex AI, GCS, MongoDB, Redis or the frontend webhook, so their workers run a gevent
+pool: one process runs dozens of tasks as greenlets that yield whenever they wait on
+the network. For that to work every client must yield instead of blocking the process:
+- the standard library is monkey-patched before anything else is imported, which covers
+  sockets, threads, locks and queues, and with them pymongo, redis-py, requests (GCS,
+  USDA, webhook) and the thread pools in tasks.py and usda_client.py
+- gRPC, used by Gemini and Vertex AI, runs its own C threads and is switched to its
+  gevent integration by make_grpc_green()
+Eventlet is not supported, since gRPC has no eventlet integration.
+
+The celery CLI patches the standard library itself when started with `-P gevent`;
+app/utils/worker.py calls patch_for_pool() for standalone workers.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+GREEN_POOLS = ("gevent",)
+
+_grpc_green = False
+
+
+def patch_for_pool(pool: str) -> None:
+    """Monkey-patches the standard library for `pool`. Must run before any other import."""
+    if pool not in GREEN_POOLS:
+        return
+    from gevent import monkey
+    monkey.patch_all()
+    make_grpc_green()
+
+
+def green_pool_active() -> bool:
+    """True if this process has been monkey-patched for a gevent pool."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("socket")
+
+
+def make_grpc_green() -> None:
+    """Makes gRPC calls yield to the gevent hub instead of blocking every greenlet. Idempotent."""
+    global _grpc_green
+    if _grpc_green:
+        return
+    try:
+        import grpc.experimental.gevent as grpc_gevent
+    except ImportError:
+        logger.warning("grpc has no gevent support installed; Gemini and Vertex AI calls will block the worker")
+        return
+    grpc_gevent.init_gevent()
+    _grpc_green = True
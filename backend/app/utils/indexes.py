@@ -0,0 +1,208 @@
+"""
+MongoDB index registry.
+
+Every index the backend relies on is declared in INDEXES, next to the hot queries it
+serves in HOT_QUERIES. ensure_indexes() creates any that are missing and is idempotent,
+so it runs on every API startup; check_query_plans() explains each hot query against
+the live database and reports the ones that would scan a whole collection, so a query
+that drifts away from its index is caught before the collection grows.
+
+Usage:
+    python -m app.utils.indexes ensure
+    python -m app.utils.indexes check
+    python -m app.utils.indexes list
+"""
+import os
+import sys
+import logging
+import argparse
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+from app.utils.db import get_database
+
+logger = logging.getLogger(__name__)
+
+# Whether the API creates missing indexes, and explains the hot queries, when it starts
+MONGO_ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "true").lower() == "true"
+MONGO_CHECK_QUERY_PLANS = os.getenv("MONGO_CHECK_QUERY_PLANS", "false").lower() == "true"
+
+
+class IndexSpec(NamedTuple):
+    collection: str
+    keys: List[Tuple[str, int]]
+
+    @property
+    def name(self) -> str:
+        """The name MongoDB gives the index by default, e.g. user_id_1_created_at_-1."""
+        return "_".join(f"{field}_{direction}" for field, direction in self.keys)
+
+
+class HotQuery(NamedTuple):
+    collection: str
+    filter: Dict[str, Any]
+    sort: Optional[List[Tuple[str, int]]]
+    description: str
+
+
+INDEXES = [
+    # Meal lookups by id, plan and request hash; (request_hash, meal_name) also serves the
+    # duplicate check when a plan is persisted
+    IndexSpec("meals", [("meal_id", ASCENDING)]),
+    IndexSpec("meals", [("meal_plan_id", ASCENDING)]),
+    # Plans and requests that reference a stored meal instead of copying it
+    IndexSpec("meals", [("reused_in_plans", ASCENDING)]),
+    IndexSpec("meals", [("reused_in_requests", ASCENDING)]),
+    IndexSpec("meals", [("request_hash", ASCENDING), ("meal_name", ASCENDING)]),
+    IndexSpec("meal_images", [("fingerprint", ASCENDING)]),
+    IndexSpec("chat_sessions", [("session_id", ASCENDING)]),
+    IndexSpec("chat_sessions", [("user_id", ASCENDING), ("created_at", DESCENDING)]),
+    IndexSpec("user_pantry", [("user_id", ASCENDING)]),
+    IndexSpec("saved_meals", [("user_id", ASCENDING), ("created_at", DESCENDING)]),
+    IndexSpec("saved_meals", [("recipes.id", ASCENDING)]),
+    IndexSpec("user_meal_plans", [("id", ASCENDING)]),
+    IndexSpec("user_meal_plans", [("user_id", ASCENDING)]),
+    IndexSpec("meal_completions", [("user_id", ASCENDING), ("date", ASCENDING), ("meal_type", ASCENDING)]),
+    IndexSpec("users", [("auth0_id", ASCENDING)]),
+    IndexSpec("users", [("id", ASCENDING)]),
+    IndexSpec("user_profiles", [("user_id", ASCENDING)]),
+    IndexSpec("user_settings", [("user_id", ASCENDING)]),
+]
+
+# The filters and sorts of the queries on request paths, with placeholder values
+HOT_QUERIES = [
+    HotQuery("meals", {"meal_id": "meal-id"}, None, "meal by id"),
+    HotQuery("meals", {"meal_id": {"$regex": "^a1b2c3"}}, None, "meal by id prefix"),
+    HotQuery("meals", {"meal_id": {"$in": ["meal-id"]}}, None, "meals of a plan by id"),
+    HotQuery("meals", {"$or": [{"meal_plan_id": "plan-id"}, {"reused_in_plans": "plan-id"}]}, None, "meals of a plan"),
+    HotQuery("meals", {"$or": [{"request_hash": "hash"}, {"reused_in_requests": "hash"}]}, None, "cached plan by request hash"),
+    HotQuery("meals", {"request_hash": "hash", "meal_name": {"$in": ["title"]}}, None, "duplicate meals of a plan"),
+    HotQuery("meal_images", {"fingerprint": {"$in": ["fingerprint"]}}, None, "catalogued meal images"),
+    HotQuery("chat_sessions", {"session_id": "session-id"}, None, "chat session"),
+    HotQuery("chat_sessions", {"user_id": "user-id"}, [("created_at", DESCENDING)], "latest chat session of a user"),
+    HotQuery("user_pantry", {"user_id": "user-id"}, None, "pantry of a user"),
+    HotQuery("user_pantry", {"id": "item-id", "user_id": "user-id"}, None, "pantry item of a user"),
+    HotQuery("saved_meals", {"user_id": "user-id"}, [("created_at", DESCENDING)], "saved meal plans of a user"),
+    HotQuery("saved_meals", {"id": "plan-id", "user_id": "user-id"}, None, "saved meal plan of a user"),
+    HotQuery("saved_meals", {"recipes.id": "meal-id"}, None, "saved recipe by id"),
+    HotQuery("user_meal_plans", {"id": "plan-id"}, None, "user meal plan"),
+    HotQuery("user_meal_plans", {"user_id": "user-id"}, None, "meal plans of a user"),
+    HotQuery("meal_completions", {"user_id": "user-id", "date": "2024-01-01"}, None, "meal completions of a day"),
+    HotQuery("meal_completions", {"user_id": "user-id", "date": "2024-01-01", "meal_type": "Lunch"}, None, "meal completion upsert"),
+    HotQuery("users", {"auth0_id": "auth0|user"}, None, "user by Auth0 id"),
+    HotQuery("users", {"id": "user-id"}, None, "user by id"),
+    HotQuery("user_profiles", {"user_id": "user-id"}, None, "profile of a user"),
+    HotQuery("user_settings", {"user_id": "user-id"}, None, "settings of a user"),
+]
+
+
+def ensure_indexes(database=None) -> List[str]:
+    """
+    Creates every registered index that does not exist yet. Existing indexes are left as
+    they are, so this is safe to run repeatedly and from several processes at once.
+    Returns the names of the indexes created.
+    """
+    database = database if database is not None else get_database()
+    created = []
+    for collection_name in dict.fromkeys(spec.collection for spec in INDEXES):
+        collection = database[collection_name]
+        try:
+            existing = {
+                tuple((field, direction if isinstance(direction, str) else int(direction)) for field, direction in info["key"].items())
+                for info in collection.list_indexes()
+            }
+        except PyMongoError as e:
+            logger.error(f"Failed to list indexes of {collection_name}: {str(e)}")
+            continue
+        for spec in INDEXES:
+            if spec.collection != collection_name or tuple(spec.keys) in existing:
+                continue
+            try:
+                collection.create_index(spec.keys, name=spec.name)
+                created.append(f"{collection_name}.{spec.name}")
+                logger.info(f"Created index {spec.name} on {collection_name}")
+            except PyMongoError as e:
+                logger.error(f"Failed to create index {spec.name} on {collection_name}: {str(e)}")
+    return created
+
+
+def _plan_stages(plan: Any) -> List[str]:
+    """Collects the stage names of an explain() plan tree, whatever the server version's layout."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_plan_stages(value))
+    return stages
+
+
+def explain_query(query: HotQuery, database=None) -> List[str]:
+    """Returns the stages of the winning plan of a hot query."""
+    database = database if database is not None else get_database()
+    cursor = database[query.collection].find(query.filter)
+    if query.sort:
+        cursor = cursor.sort(query.sort)
+    return _plan_stages(cursor.explain()["queryPlanner"]["winningPlan"])
+
+
+def check_query_plans(database=None) -> List[str]:
+    """
+    Explains every hot query and returns a description of each one whose winning plan
+    scans a whole collection (COLLSCAN) or could not be explained. An empty list means
+    every hot query is served by an index.
+    """
+    failures = []
+    for query in HOT_QUERIES:
+        try:
+            stages = explain_query(query, database)
+        except PyMongoError as e:
+            failures.append(f"{query.collection}: {query.description}: explain failed ({str(e)})")
+            continue
+        if "COLLSCAN" in stages:
+            failures.append(f"{query.collection}: {query.description} does a COLLSCAN ({' <- '.join(stages)})")
+    return failures
+
+
+def ensure_indexes_on_startup() -> None:
+    """Startup hook of the API: creates missing indexes and optionally checks the hot query plans."""
+    if MONGO_ENSURE_INDEXES:
+        created = ensure_indexes()
+        logger.info(f"MongoDB indexes ensured ({len(created)} created)")
+    if MONGO_CHECK_QUERY_PLANS:
+        for failure in check_query_plans():
+            logger.error(f"Unindexed hot query: {failure}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the MongoDB indexes of the backend")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("ensure", help="Create every registered index that is missing")
+    subparsers.add_parser("check", help="Explain the hot queries and fail if any does a COLLSCAN")
+    subparsers.add_parser("list", help="Show the registered indexes")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    if args.command == "ensure":
+        created = ensure_indexes()
+        print(f"Created {len(created)} indexes" + (": " + ", ".join(created) if created else ""))
+    elif args.command == "check":
+        failures = check_query_plans()
+        for failure in failures:
+            print(f"FAIL  {failure}")
+        print(f"{len(HOT_QUERIES) - len(failures)}/{len(HOT_QUERIES)} hot queries use an index")
+        if failures:
+            sys.exit(1)
+    else:
+        for spec in INDEXES:
+            print(f"{spec.collection}.{spec.name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Shared Gemini gateway.
+
+Every Gemini call in the backend goes through generate() (or agenerate() from async
+code) so they all share one model instance per process, a per-process concurrency
+limit, a request timeout and retries with jittered exponential backoff on transient
+errors. Latency and token usage are recorded per caller, both in-process
+(get_llm_stats) and in Redis under `llm_stats:{caller}` so all workers add up.
+
+Across processes, calls draw from one Redis token bucket per minute for requests and
+for tokens. A call waits up to LLM_RATE_LIMIT_MAX_WAIT for budget and then raises
+LLMRateLimited, so Celery tasks can requeue themselves instead of failing. Queued work
+registers its expected calls in a backlog, from which estimate_queue_wait() derives
+an ETA for new requests.
+"""
+import math
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Union
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+from app.utils.redis_client import redis_client, RateLimiter
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+# Gemini calls in flight at once per process; further callers wait up to LLM_TIMEOUT_SECONDS for a slot
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+# Retries after the first attempt; the delay before retry n is uniform in [0, min(max, base * 2^n)]
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "20"))
+LLM_STATS_TTL = 3600 * 24 * 7  # 1 week
+
+# Gemini quota shared by every process; 0 disables a limit
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "1000"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+# How long a call may wait for quota before raising LLMRateLimited
+LLM_RATE_LIMIT_MAX_WAIT = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT", "30"))
+# Output tokens reserved for a call that doesn't set max_output_tokens, until the real count is known
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "1000"))
+# Prompt plus output tokens of a typical queued call, used for queue ETAs
+LLM_ESTIMATED_TOKENS_PER_CALL = int(os.getenv("LLM_ESTIMATED_TOKENS_PER_CALL", "2000"))
+
+rate_limiter = RateLimiter("llm_rate", LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
+
+# Expected remaining calls of each queued job, and when each entry is abandoned
+LLM_BACKLOG_KEY = "llm_backlog"
+LLM_BACKLOG_EXPIRY_KEY = "llm_backlog:expires"
+
+# Rate limiting, overload and timeouts are worth retrying; bad requests and auth errors are not
+TRANSIENT_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.GatewayTimeout,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class LLMError(Exception):
+    """Raised when a Gemini call fails after all retries, or no call slot frees up in time."""
+
+
+class LLMRateLimited(LLMError):
+    """Raised when the shared quota has no room for a call within LLM_RATE_LIMIT_MAX_WAIT."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+_model = None
+_model_pid = None
+_model_lock = threading.Lock()
+_semaphore = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+
+def get_model() -> "genai.GenerativeModel":
+    """Returns this process's model instance, configuring the client on first use (and after a fork)."""
+    global _model, _model_pid
+    if _model is None or _model_pid != os.getpid():
+        with _model_lock:
+            if _model is None or _model_pid != os.getpid():
+                api_key = os.getenv("GEMINI_API_KEY")
+                if not api_key:
+                    raise LLMError("GEMINI_API_KEY environment variable is not set")
+                genai.configure(api_key=api_key)
+                _model = genai.GenerativeModel(GEMINI_MODEL)
+                _model_pid = os.getpid()
+    return _model
+
+
+def _record(caller: str, latency: float, response=None, retries: int = 0, failed: bool = False) -> None:
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    with _stats_lock:
+        stats = _stats.setdefault(caller, {
+            "calls": 0, "errors": 0, "retries": 0, "latency_total": 0.0, "latency_max": 0.0,
+            "prompt_tokens": 0, "output_tokens": 0
+        })
+        stats["calls"] += 1
+        stats["errors"] += failed
+        stats["retries"] += retries
+        stats["latency_total"] += latency
+        stats["latency_max"] = max(stats["latency_max"], latency)
+        stats["prompt_tokens"] += prompt_tokens
+        stats["output_tokens"] += output_tokens
+
+    try:
+        key = f"llm_stats:{caller}"
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hincrby(key, "calls", 1)
+        pipe.hincrby(key, "errors", int(failed))
+        pipe.hincrby(key, "retries", retries)
+        pipe.hincrbyfloat(key, "latency_total", latency)
+        pipe.hincrby(key, "prompt_tokens", prompt_tokens)
+        pipe.hincrby(key, "output_tokens", output_tokens)
+        pipe.expire(key, LLM_STATS_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.debug(f"Failed to record LLM stats for {caller}: {str(e)}")
+
+
+def estimate_tokens(contents: Union[str, List[Any]], generation_config: Optional[dict] = None) -> int:
+    """Rough token count of a call: about four characters per prompt token plus the expected output."""
+    max_output = (generation_config or {}).get("max_output_tokens", LLM_EXPECTED_OUTPUT_TOKENS)
+    return len(str(contents)) // 4 + max_output
+
+
+def get_llm_stats() -> Dict[str, Dict[str, float]]:
+    """Per-caller call counts, latency and token totals of this process, with the average latency."""
+    with _stats_lock:
+        return {
+            caller: dict(stats, latency_avg=stats["latency_total"] / stats["calls"] if stats["calls"] else 0.0)
+            for caller, stats in _stats.items()
+        }
+
+
+def generate(
+    contents: Union[str, List[Any]],
+    caller: str,
+    generation_config: Optional[dict] = None,
+    timeout: float = LLM_TIMEOUT_SECONDS,
+    max_retries: int = LLM_MAX_RETRIES,
+):
+    """
+    Calls Gemini's generate_content and returns the response. `contents` is a prompt
+    string, a list of prompt parts or a chat history of {"role", "parts"} messages.
+    `caller` names the call site in the stats. Raises LLMRateLimited if the shared quota
+    stays exhausted, LLMError once retries are exhausted; non-transient errors are raised
+    immediately.
+    """
+    model = get_model()
+    estimated_tokens = estimate_tokens(contents, generation_config)
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        retry_after = rate_limiter.acquire(estimated_tokens, max_wait=LLM_RATE_LIMIT_MAX_WAIT)
+        if retry_after:
+            _record(caller, time.monotonic() - started, retries=attempt, failed=True)
+            raise LLMRateLimited(f"Gemini quota exhausted, retry in {retry_after:.0f}s ({caller})", retry_after)
+        if not _semaphore.acquire(timeout=timeout):
+            _record(caller, time.monotonic() - started, retries=attempt, failed=True)
+            raise LLMError(f"No Gemini call slot became free within {timeout}s ({caller})")
+        try:
+            response = model.generate_content(
+                contents, generation_config=generation_config, request_options={"timeout": timeout}
+            )
+            _record(caller, time.monotonic() - started, response, retries=attempt)
+            actual_tokens = getattr(getattr(response, "usage_metadata", None), "total_token_count", 0)
+            if actual_tokens:
+                rate_limiter.settle(actual_tokens - estimated_tokens)
+            return response
+        except TRANSIENT_ERRORS as e:
+            if attempt >= max_retries:
+                _record(caller, time.monotonic() - started, retries=attempt, failed=True)
+                raise LLMError(f"Gemini call failed after {attempt + 1} attempts ({caller}): {str(e)}") from e
+            error = e
+        except Exception:
+            _record(caller, time.monotonic() - started, retries=attempt, failed=True)
+            raise
+        finally:
+            _semaphore.release()
+
+        delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+        attempt += 1
+        logger.warning(f"Transient Gemini error ({caller}), retry {attempt}/{max_retries} in {delay:.1f}s: {str(error)}")
+        time.sleep(delay)
+
+
+async def agenerate(
+    contents: Union[str, List[Any]],
+    caller: str,
+    generation_config: Optional[dict] = None,
+    timeout: float = LLM_TIMEOUT_SECONDS,
+    max_retries: int = LLM_MAX_RETRIES,
+):
+    """generate() for async endpoints: runs in a worker thread so the event loop is never blocked."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, lambda: generate(contents, caller, generation_config, timeout, max_retries)
+    )
+
+
+def add_llm_backlog(job_id: str, calls: int, ttl: int = 3600) -> None:
+    """Registers the Gemini calls a queued job is expected to make."""
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hset(LLM_BACKLOG_KEY, job_id, calls)
+        pipe.zadd(LLM_BACKLOG_EXPIRY_KEY, {job_id: time.time() + ttl})
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to add LLM backlog for {job_id}: {str(e)}")
+
+
+def complete_llm_backlog(job_id: str, calls: int = 1) -> None:
+    """Marks `calls` of a job's expected calls as done."""
+    if calls <= 0:
+        return
+    try:
+        if redis_client.hexists(LLM_BACKLOG_KEY, job_id):
+            redis_client.hincrby(LLM_BACKLOG_KEY, job_id, -calls)
+    except Exception as e:
+        logger.error(f"Failed to update LLM backlog for {job_id}: {str(e)}")
+
+
+def clear_llm_backlog(job_id: str) -> None:
+    """Removes a finished (or failed) job from the backlog."""
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hdel(LLM_BACKLOG_KEY, job_id)
+        pipe.zrem(LLM_BACKLOG_EXPIRY_KEY, job_id)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to clear LLM backlog for {job_id}: {str(e)}")
+
+
+def estimate_queue_wait() -> int:
+    """
+    Seconds until the quota could serve every call currently in the backlog: the calls
+    (and their estimated tokens) beyond what the buckets hold now, at the per-minute rate.
+    """
+    try:
+        abandoned = redis_client.zrangebyscore(LLM_BACKLOG_EXPIRY_KEY, "-inf", time.time())
+        if abandoned:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hdel(LLM_BACKLOG_KEY, *abandoned)
+            pipe.zrem(LLM_BACKLOG_EXPIRY_KEY, *abandoned)
+            pipe.execute()
+        pending_calls = sum(max(0, int(calls)) for calls in redis_client.hvals(LLM_BACKLOG_KEY))
+    except Exception as e:
+        logger.error(f"Failed to read LLM backlog: {str(e)}")
+        return 0
+
+    demand = {"requests": pending_calls, "tokens": pending_calls * LLM_ESTIMATED_TOKENS_PER_CALL}
+    available = rate_limiter.available()
+    wait_minutes = 0.0
+    for budget, limit in rate_limiter.limits().items():
+        deficit = demand[budget] - available.get(budget, limit)
+        wait_minutes = max(wait_minutes, deficit / limit)
+    return math.ceil(wait_minutes * 60)
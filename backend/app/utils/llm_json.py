@@ -0,0 +1,216 @@
+"""
+JSON output from Gemini.
+
+Call sites that expect JSON ask for it with json_generation_config(), which turns on
+Gemini's JSON mode and, when a schema is given, constrains the output to it. Replies
+are parsed with parse_llm_json(), which takes the JSON out of a markdown fence or
+surrounding prose and locally repairs the defects models commonly produce (trailing
+commas, raw newlines and unescaped quotes inside strings, output cut off mid-array)
+before giving up, so a salvageable reply never costs a regeneration.
+"""
+import re
+import json
+import logging
+from typing import Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)\s*(?:```|$)", re.DOTALL | re.IGNORECASE)
+_CLOSERS = {"{": "}", "[": "]"}
+# Keys under which a model sometimes wraps the list it was asked for, e.g. {"meals": [...]}
+LIST_WRAPPER_KEYS = ("meals", "items", "results", "data")
+
+# Schema of the meal list returned by the meal generation prompt
+MEAL_LIST_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "title": {"type": "STRING"},
+            "meal_type": {"type": "STRING"},
+            "meal_plan_id": {"type": "STRING"},
+            "nutrition": {
+                "type": "OBJECT",
+                "properties": {
+                    "calories": {"type": "NUMBER"},
+                    "protein": {"type": "NUMBER"},
+                    "carbs": {"type": "NUMBER"},
+                    "fat": {"type": "NUMBER"},
+                    "fiber": {"type": "NUMBER"},
+                    "sugar": {"type": "NUMBER"},
+                },
+                "required": ["calories", "protein", "carbs", "fat", "fiber", "sugar"],
+            },
+            "ingredients": {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "name": {"type": "STRING"},
+                        "quantity": {"type": "STRING"},
+                        "macros": {
+                            "type": "OBJECT",
+                            "properties": {
+                                "calories": {"type": "NUMBER"},
+                                "protein": {"type": "NUMBER"},
+                                "carbs": {"type": "NUMBER"},
+                                "fat": {"type": "NUMBER"},
+                                "fiber": {"type": "NUMBER"},
+                                "sugar": {"type": "NUMBER"},
+                            },
+                        },
+                    },
+                    "required": ["name", "quantity"],
+                },
+            },
+            "instructions": {"type": "STRING"},
+        },
+        "required": ["title", "nutrition", "ingredients", "instructions"],
+    },
+}
+
+
+class LLMJSONError(ValueError):
+    """Raised when a reply holds no JSON that can be parsed, even after repair."""
+
+
+def json_generation_config(schema: Optional[dict] = None, **config) -> dict:
+    """Generation config that makes Gemini reply with JSON only, optionally matching `schema`."""
+    generation_config = dict(config, response_mime_type="application/json")
+    if schema:
+        generation_config["response_schema"] = schema
+    return generation_config
+
+
+def _extract(text: str) -> str:
+    """The JSON part of a reply: the inside of a code fence, else from the first bracket on."""
+    fence = _FENCE_RE.search(text)
+    if fence and fence.group(1).lstrip()[:1] in ("{", "["):
+        text = fence.group(1)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    return text[min(starts):].strip() if starts else text.strip()
+
+
+def _next_significant(text: str, start: int) -> str:
+    for char in text[start:]:
+        if not char.isspace():
+            return char
+    return ""
+
+
+def repair_json(text: str) -> str:
+    """
+    Repairs common defects of model-written JSON in one pass:
+    - raw control characters inside strings are escaped
+    - a quote inside a string is escaped unless it is followed by , : } ] or the end
+    - trailing commas before } and ] are dropped
+    - anything after the root value is dropped
+    - truncated output is closed; a truncated array keeps only its complete elements
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+    # Output length right after the last complete element of the root array
+    last_root_element = None
+
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+                out.append(char)
+            elif char == "\\":
+                escaped = True
+                out.append(char)
+            elif char == '"':
+                if _next_significant(text, i + 1) in (",", ":", "}", "]", ""):
+                    in_string = False
+                    out.append(char)
+                else:
+                    out.append('\\"')
+            elif char == "\n":
+                out.append("\\n")
+            elif char == "\r":
+                out.append("\\r")
+            elif char == "\t":
+                out.append("\\t")
+            elif ord(char) < 0x20:
+                out.append(f"\\u{ord(char):04x}")
+            else:
+                out.append(char)
+            continue
+
+        if char == '"':
+            in_string = True
+            out.append(char)
+        elif char in _CLOSERS:
+            stack.append(_CLOSERS[char])
+            out.append(char)
+        elif char in ("}", "]"):
+            if not stack or stack[-1] != char:
+                continue  # stray closer
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            out.append(stack.pop())
+            if not stack:
+                return "".join(out)
+            if len(stack) == 1 and stack[0] == "]":
+                last_root_element = len(out)
+        else:
+            out.append(char)
+
+    # Truncated output: close what is open
+    if stack and stack[0] == "]" and last_root_element is not None and (in_string or len(stack) > 1):
+        # Drop the incomplete element of the root array rather than guess at its contents
+        return "".join(out[:last_root_element]) + "]"
+
+    repaired = "".join(out)
+    if in_string:
+        if escaped:
+            repaired = repaired[:-1]
+        repaired += '"'
+    return _trim_dangling(repaired, in_object=bool(stack) and stack[-1] == "}") + "".join(reversed(stack))
+
+
+def _trim_dangling(text: str, in_object: bool) -> str:
+    """Drops a trailing comma, or an object key that was cut off before its value."""
+    text = text.rstrip()
+    if text.endswith(","):
+        return text[:-1]
+    key = re.search(r'([{,])\s*"(?:[^"\\]|\\.)*"\s*(:?)$', text)
+    if key and (key.group(2) or in_object):
+        return text[:key.start() + 1].rstrip(",")
+    return text
+
+
+def parse_llm_json(text: str, expect: Optional[type] = None) -> Any:
+    """
+    Parses the JSON in a model reply, repairing it if needed. With expect=list a single
+    object becomes a one-item list, and an object holding the list under one of
+    LIST_WRAPPER_KEYS is unwrapped; with expect=dict a list
+    yields its first object. Raises LLMJSONError if nothing can be recovered.
+    """
+    candidate = _extract(text or "")
+    try:
+        data = json.loads(candidate)
+    except json.JSONDecodeError as e:
+        try:
+            data = json.loads(repair_json(candidate))
+        except json.JSONDecodeError:
+            raise LLMJSONError(f"Reply is not valid JSON: {str(e)}") from e
+        logger.info("Repaired malformed JSON in model reply")
+
+    if expect is list and isinstance(data, dict):
+        # Only known wrapper keys are unwrapped: a single meal also holds a list (its ingredients)
+        wrapped = [data[key] for key in LIST_WRAPPER_KEYS if isinstance(data.get(key), list)]
+        data = wrapped[0] if len(wrapped) == 1 else [data]
+    elif expect is dict and isinstance(data, list):
+        objects = [item for item in data if isinstance(item, dict)]
+        if not objects:
+            raise LLMJSONError("Reply is a list without any object")
+        data = objects[0]
+    if expect is not None and not isinstance(data, expect):
+        raise LLMJSONError(f"Reply is a {type(data).__name__}, expected a {expect.__name__}")
+    return data
@@ -0,0 +1,310 @@
+"""
+Nearest-neighbour macro index over stored meals.
+
+Stored meals are grouped by (meal_type, dietary_type) and each group keeps its macros
+in a compact float32 NumPy matrix, so "k nearest meals within tolerance" is a single
+vectorized pass instead of a Mongo query. The index loads once per process and then
+refreshes incrementally: only meals inserted after the last seen _id are fetched.
+Meal plan generation uses it to fill slots from existing meals before calling Gemini.
+"""
+import os
+import re
+import time
+import logging
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from app.utils.db import collection
+from app.utils.portion_solver import NUTRIENT_KEYS, ADJUSTMENT_NOTE
+
+logger = logging.getLogger(__name__)
+
+meals_collection = collection("meals")
+
+# Whether generation fills slots from existing meals before calling Gemini
+MEAL_REUSE_ENABLED = os.getenv("MEAL_REUSE_ENABLED", "true").lower() == "true"
+# Maximum relative deviation from the target for each (weighted) nutrient of a reused meal
+MEAL_REUSE_TOLERANCE = float(os.getenv("MEAL_REUSE_TOLERANCE", "0.1"))
+MEAL_INDEX_REFRESH_SECONDS = int(os.getenv("MEAL_INDEX_REFRESH_SECONDS", "60"))
+
+# Sugar and fiber are secondary targets, so they are allowed twice the deviation
+NUTRIENT_WEIGHTS = np.array([0.5 if key in ("fiber", "sugar") else 1.0 for key in NUTRIENT_KEYS], dtype=np.float32)
+
+_INDEX_PROJECTION = {"meal_id": 1, "meal_name": 1, "meal_type": 1, "dietary_type": 1, "macros": 1}
+
+
+def normalize_dietary_type(dietary_type: Optional[str]) -> str:
+    """Reduces a dietary preference string to its sorted, de-duplicated lowercase tokens."""
+    return " ".join(sorted(set(re.sub(r"[^a-z0-9]+", " ", (dietary_type or "").lower()).split())))
+
+
+def macro_vector(macros: dict) -> np.ndarray:
+    values = []
+    for key in NUTRIENT_KEYS:
+        try:
+            values.append(float((macros or {}).get(key, 0) or 0))
+        except (TypeError, ValueError):
+            values.append(0.0)
+    return np.array(values, dtype=np.float32)
+
+
+class MealMatch(NamedTuple):
+    meal_id: str
+    title: str
+    distance: float
+    macros: np.ndarray
+
+
+class _Bucket:
+    """
+    Meals of one (meal_type, dietary_type) group. Macros are stored nutrient-major in a
+    growable (nutrients, capacity) matrix so each query reduces over contiguous rows.
+    Queries work in preallocated scratch buffers instead of allocating per call.
+    """
+
+    def __init__(self):
+        self.macros = np.empty((len(NUTRIENT_KEYS), 16), dtype=np.float32)
+        self.meal_ids: List[str] = []
+        self.titles: List[str] = []
+        self.size = 0
+        self.query_lock = threading.Lock()
+        self._deviation = np.empty_like(self.macros)
+        self._worst = np.empty(self.macros.shape[1], dtype=np.float32)
+
+    def add(self, meal_id: str, title: str, vector: np.ndarray) -> None:
+        if self.size == self.macros.shape[1]:
+            grown = np.empty((len(NUTRIENT_KEYS), self.size * 2), dtype=np.float32)
+            grown[:, :self.size] = self.macros[:, :self.size]
+            with self.query_lock:
+                self.macros = grown
+                self._deviation = np.empty_like(grown)
+                self._worst = np.empty(grown.shape[1], dtype=np.float32)
+        self.macros[:, self.size] = vector
+        self.meal_ids.append(meal_id)
+        self.titles.append(title)
+        self.size += 1
+
+
+class MealIndex:
+    """Per-process macro index over the meals collection."""
+
+    def __init__(self, collection=meals_collection, refresh_seconds: int = MEAL_INDEX_REFRESH_SECONDS):
+        self.collection = collection
+        self.refresh_seconds = refresh_seconds
+        self._buckets: Dict[Tuple[str, str], _Bucket] = {}
+        self._meal_ids = set()
+        self._last_object_id = None
+        self._last_refresh = 0.0
+        self._loaded = False
+        self._lock = threading.Lock()
+        # Held for the whole of a refresh, so only one thread reads the collection at a time
+        self._refresh_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._meal_ids)
+
+    @staticmethod
+    def _index_meal(buckets: Dict[Tuple[str, str], _Bucket], meal_ids: set, meal: dict) -> bool:
+        meal_id = meal.get("meal_id")
+        if not meal_id or not meal.get("macros") or not meal.get("meal_type") or meal_id in meal_ids:
+            return False
+        key = (meal["meal_type"], normalize_dietary_type(meal.get("dietary_type")))
+        buckets.setdefault(key, _Bucket()).add(meal_id, meal.get("meal_name", ""), macro_vector(meal["macros"]))
+        meal_ids.add(meal_id)
+        return True
+
+    def add_meal(self, meal: dict) -> bool:
+        """Adds a stored meal document to the index. Returns False if it is already indexed or unusable."""
+        with self._lock:
+            return self._index_meal(self._buckets, self._meal_ids, meal)
+
+    def refresh(self) -> int:
+        """Indexes meals inserted since the last refresh. Returns the number of meals added."""
+        with self._refresh_lock:
+            return self._refresh()
+
+    def refresh_if_stale(self) -> None:
+        # Single flight: while another thread refreshes, queries use the index as it is,
+        # unless it has not been loaded yet
+        if time.monotonic() - self._last_refresh < self.refresh_seconds:
+            return
+        if not self._refresh_lock.acquire(blocking=not self._loaded):
+            return
+        try:
+            if time.monotonic() - self._last_refresh >= self.refresh_seconds:
+                self._refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self) -> int:
+        """
+        Runs a refresh; the caller holds _refresh_lock. The first load builds its buckets
+        aside and swaps them in at once, so queries never see a half-loaded index; later
+        refreshes only append the few new meals.
+        """
+        query = {"_id": {"$gt": self._last_object_id}} if self._last_object_id is not None else {}
+        try:
+            meals = list(self.collection.find(query, _INDEX_PROJECTION).sort("_id", 1))
+        except Exception as e:
+            logger.error(f"Failed to refresh meal index: {str(e)}")
+            self._last_refresh = time.monotonic()
+            return 0
+
+        if self._loaded:
+            added = sum(self.add_meal(meal) for meal in meals)
+        else:
+            buckets: Dict[Tuple[str, str], _Bucket] = {}
+            meal_ids = set()
+            added = sum(self._index_meal(buckets, meal_ids, meal) for meal in meals)
+            with self._lock:
+                # Keep meals passed to add_meal() before or during the load
+                for key, bucket in self._buckets.items():
+                    for i in range(bucket.size):
+                        if bucket.meal_ids[i] not in meal_ids:
+                            buckets.setdefault(key, _Bucket()).add(bucket.meal_ids[i], bucket.titles[i], bucket.macros[:, i].copy())
+                            meal_ids.add(bucket.meal_ids[i])
+                self._buckets, self._meal_ids = buckets, meal_ids
+            self._loaded = True
+
+        if meals:
+            self._last_object_id = meals[-1]["_id"]
+        self._last_refresh = time.monotonic()
+        if added:
+            logger.info(f"Meal index added {added} meals ({len(self)} total)")
+        return added
+
+    def nearest(
+        self,
+        meal_type: str,
+        dietary_type: Optional[str],
+        target_macros: dict,
+        k: int = 1,
+        tolerance: float = MEAL_REUSE_TOLERANCE,
+        exclude_titles: Iterable[str] = ()
+    ) -> List[MealMatch]:
+        """
+        Returns up to k meals of the given type and dietary type whose macros are all within
+        `tolerance` (relative, per weighted nutrient) of the target, closest first.
+        Meals with the same title are returned at most once.
+        """
+        self.refresh_if_stale()
+        bucket = self._buckets.get((meal_type, normalize_dietary_type(dietary_type)))
+        if bucket is None or bucket.size == 0 or k <= 0:
+            return []
+
+        target = macro_vector(target_macros)
+        scale = (NUTRIENT_WEIGHTS / np.maximum(target, 1.0))[:, None]
+        with bucket.query_lock:
+            size = bucket.size
+            deviation = bucket._deviation[:, :size]                               # (K, N)
+            worst = bucket._worst[:size]
+            np.subtract(bucket.macros[:, :size], target[:, None], out=deviation)
+            np.abs(deviation, out=deviation)
+            np.multiply(deviation, scale, out=deviation)
+            np.max(deviation, axis=0, out=worst)
+            candidates = np.flatnonzero(worst <= tolerance)
+            if candidates.size == 0:
+                return []
+            # Squared distance of every meal, reduced over contiguous rows; only candidates are kept
+            np.multiply(deviation, deviation, out=deviation)
+            distances = np.sqrt(np.add.reduce(deviation, axis=0)[candidates])
+        seen = {title.lower().strip() for title in exclude_titles}
+
+        # Only order the closest few candidates; fall back to a full sort if titles repeat too often
+        shortlist_size = min(candidates.size, 4 * k + len(seen))
+        if shortlist_size < candidates.size:
+            shortlist = np.argpartition(distances, shortlist_size - 1)[:shortlist_size]
+            order = shortlist[np.argsort(distances[shortlist], kind="stable")]
+        else:
+            order = np.argsort(distances, kind="stable")
+
+        matches = self._distinct_matches(bucket, candidates, distances, order, k, seen)
+        if len(matches) < k and order.size < candidates.size:
+            matches = self._distinct_matches(bucket, candidates, distances, np.argsort(distances, kind="stable"), k, seen)
+        return matches
+
+    @staticmethod
+    def _distinct_matches(bucket: "_Bucket", candidates: np.ndarray, distances: np.ndarray,
+                          order: np.ndarray, k: int, exclude_titles: set) -> List[MealMatch]:
+        seen = set(exclude_titles)
+        matches = []
+        for position in order:
+            idx = candidates[position]
+            title_key = bucket.titles[idx].lower().strip()
+            if title_key in seen:
+                continue
+            seen.add(title_key)
+            matches.append(MealMatch(
+                bucket.meal_ids[idx], bucket.titles[idx], float(distances[position]), bucket.macros[:, idx].copy()
+            ))
+            if len(matches) >= k:
+                break
+        return matches
+
+
+_index: Optional[MealIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_meal_index() -> MealIndex:
+    """Returns the process-wide meal index, loading it on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = MealIndex()
+    return _index
+
+
+def find_nearest_meals(meal_type: str, dietary_type: str, target_macros: dict, k: int = 1,
+                       exclude_titles: Iterable[str] = ()) -> List[dict]:
+    """Returns the stored meal documents of the k nearest meals, closest first."""
+    matches = get_meal_index().nearest(meal_type, dietary_type, target_macros, k, exclude_titles=exclude_titles)
+    if not matches:
+        return []
+    meals = {meal["meal_id"]: meal for meal in meals_collection.find({"meal_id": {"$in": [m.meal_id for m in matches]}})}
+    return [meals[m.meal_id] for m in matches if m.meal_id in meals]
+
+
+def plan_meals_filter(meal_plan_id: str) -> dict:
+    """Query for the meals of a plan: the ones generated for it and the stored ones it reused."""
+    return {"$or": [{"meal_plan_id": meal_plan_id}, {"reused_in_plans": meal_plan_id}]}
+
+
+def request_meals_filter(request_hash: str) -> dict:
+    """Query for the meals of a request hash, including stored meals reused for it."""
+    return {"$or": [{"request_hash": request_hash}, {"reused_in_requests": request_hash}]}
+
+
+def reuse_meals_for_slots(meal_generation_plan: List[str], meal_macros: Dict[str, dict], dietary_type: str) -> Dict[int, dict]:
+    """
+    Fills meal plan slots from existing meals that already match the slot's macro target.
+    Returns {slot index: meal} in the generated meal format for the slots that could be filled;
+    `reused_from` holds the stored meal's id, which the plan then references instead of a copy.
+    """
+    slots_by_type: Dict[str, List[int]] = {}
+    for i, meal_type in enumerate(meal_generation_plan):
+        slots_by_type.setdefault(meal_type, []).append(i)
+
+    reused: Dict[int, dict] = {}
+    used_titles: List[str] = []
+    for meal_type, slots in slots_by_type.items():
+        meals = find_nearest_meals(meal_type, dietary_type, meal_macros[meal_type], k=len(slots), exclude_titles=used_titles)
+        for slot, meal in zip(slots, meals):
+            instructions = meal.get("meal_text", "")
+            if instructions.endswith(ADJUSTMENT_NOTE):
+                instructions = instructions[:-len(ADJUSTMENT_NOTE)]
+            reused[slot] = {
+                "title": meal["meal_name"],
+                "meal_type": meal_type,
+                "nutrition": meal.get("macros", {}),
+                "ingredients": meal.get("ingredients", []),
+                "instructions": instructions,
+                "reused_from": meal["meal_id"]
+            }
+            used_titles.append(meal["meal_name"])
+
+    if reused:
+        logger.info(f"Reused {len(reused)} of {len(meal_generation_plan)} meal slots from existing meals")
+    return reused
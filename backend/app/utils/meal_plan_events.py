@@ -0,0 +1,142 @@
+"""
+Meal plan progress events.
+
+The generation pipeline publishes an event as each meal is generated, persisted and
+receives its image, and once the whole plan is ready. Events go to a per-plan Redis
+pub/sub channel and are also appended to a replay history, so a client that connects
+(or reconnects with Last-Event-ID) after some events were published still receives them.
+The SSE endpoint in app.api.meals consumes them through iter_meal_plan_events.
+"""
+import os
+import json
+import pickle
+import asyncio
+import logging
+import datetime
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from app.utils.redis_client import redis_client, async_redis_client, publish_event
+
+logger = logging.getLogger(__name__)
+
+# How long a stream stays open waiting for the plan to finish, and how often it sends keepalives
+MEAL_PLAN_STREAM_TIMEOUT = int(os.getenv("MEAL_PLAN_STREAM_TIMEOUT", "900"))
+MEAL_PLAN_STREAM_KEEPALIVE = int(os.getenv("MEAL_PLAN_STREAM_KEEPALIVE", "15"))
+
+MEAL_GENERATED = "meal_generated"
+MEAL_SAVED = "meal_saved"
+MEAL_IMAGE = "meal_image"
+MEAL_IMAGE_FAILED = "meal_image_failed"
+PLAN_STARTED = "plan_started"
+PLAN_QUEUED = "plan_queued"
+PLAN_READY = "plan_ready"
+PLAN_FAILED = "plan_failed"
+
+# Events after which nothing more is published for the plan
+TERMINAL_EVENTS = {PLAN_READY, PLAN_FAILED}
+
+
+def meal_plan_channel(meal_plan_id: str) -> str:
+    return f"meal_plan_events:{meal_plan_id}"
+
+
+def format_meal_event(meal: dict) -> Dict[str, Any]:
+    """Formats a stored meal document the same way the meal plan endpoints return it."""
+    return {
+        "id": meal.get("meal_id"),
+        "title": meal.get("meal_name", ""),
+        "meal_type": meal.get("meal_type", ""),
+        "nutrition": meal.get("macros", {}),
+        "ingredients": meal.get("ingredients", []),
+        "instructions": meal.get("meal_text", ""),
+        "imageUrl": meal.get("imageUrl", "")
+    }
+
+
+def publish_meal_plan_event(meal_plan_id: str, event_type: str, data: Optional[dict] = None) -> Optional[int]:
+    """Publishes a progress event for a meal plan. Failures are logged and never interrupt generation."""
+    event = {
+        "type": event_type,
+        "meal_plan_id": meal_plan_id,
+        "data": data or {},
+        "timestamp": datetime.datetime.now().isoformat()
+    }
+    return publish_event(meal_plan_channel(meal_plan_id), event)
+
+
+def reset_meal_plan_events(meal_plan_id: str) -> None:
+    """Clears the replay history and completion marker of a plan that is about to be (re)generated."""
+    try:
+        redis_client.delete(f"{meal_plan_channel(meal_plan_id)}:history", f"meal_plan_finalized:{meal_plan_id}")
+    except Exception as e:
+        logger.error(f"Failed to reset events for meal plan {meal_plan_id}: {str(e)}")
+
+
+def _decode_message(data: bytes) -> Tuple[int, dict]:
+    seq, payload = data.split(b":", 1)
+    return int(seq), json.loads(payload)
+
+
+async def _finished_plan_event(meal_plan_id: str) -> Optional[dict]:
+    """Builds a plan_ready event for a plan that finished before its history was available."""
+    if not await async_redis_client.exists(f"meal_plan_finalized:{meal_plan_id}"):
+        return None
+    cached_meals = await async_redis_client.get(f"meal_plan_id:{meal_plan_id}")
+    meals = pickle.loads(cached_meals) if cached_meals else []
+    return {
+        "type": PLAN_READY,
+        "meal_plan_id": meal_plan_id,
+        "data": {"meals": [format_meal_event(meal) for meal in meals]},
+        "timestamp": datetime.datetime.now().isoformat()
+    }
+
+
+async def iter_meal_plan_events(
+    meal_plan_id: str,
+    last_event_id: int = -1,
+    timeout: int = MEAL_PLAN_STREAM_TIMEOUT
+) -> AsyncIterator[Tuple[Optional[int], Optional[dict]]]:
+    """
+    Yields (seq, event) pairs for a meal plan, starting after `last_event_id`: first the
+    replayed history, then live events, until a terminal event or the timeout.
+    Yields (None, None) every MEAL_PLAN_STREAM_KEEPALIVE seconds without events.
+    """
+    channel = meal_plan_channel(meal_plan_id)
+    pubsub = async_redis_client.pubsub()
+    # Subscribe before reading the history so nothing published in between is missed
+    await pubsub.subscribe(channel)
+    try:
+        history = await async_redis_client.lrange(f"{channel}:history", last_event_id + 1, -1)
+        for raw_event in history:
+            last_event_id += 1
+            event = json.loads(raw_event)
+            yield last_event_id, event
+            if event.get("type") in TERMINAL_EVENTS:
+                return
+
+        if last_event_id < 0:
+            finished_event = await _finished_plan_event(meal_plan_id)
+            if finished_event:
+                yield None, finished_event
+                return
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=MEAL_PLAN_STREAM_KEEPALIVE)
+            if message is None:
+                yield None, None
+                continue
+
+            seq, event = _decode_message(message["data"])
+            if seq <= last_event_id:
+                continue
+            last_event_id = seq
+            yield seq, event
+            if event.get("type") in TERMINAL_EVENTS:
+                return
+
+        logger.info(f"Event stream for meal plan {meal_plan_id} timed out after {timeout}s")
+    finally:
+        await pubsub.unsubscribe(channel)
+        await pubsub.reset()
@@ -0,0 +1,172 @@
+"""
+Instant meal plan assembly from the existing meal pool.
+
+Full Day plans are assembled by picking one Breakfast, Lunch, Dinner and Snack from
+stored meals so that the day's totals hit the user's daily macro targets. For each
+meal type a candidate pool is drawn from the meal index; every combination of the
+pools is then scored in one broadcast NumPy pass, and days are picked greedily from
+the best remaining combination while meals already used on earlier days are masked
+out for variety. No LLM calls are made, so a plan returns in milliseconds whenever
+the pool is dense enough; otherwise the caller falls back to generation.
+"""
+import os
+import logging
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.utils.meal_index import (
+    get_meal_index, meals_collection, MealMatch, NUTRIENT_WEIGHTS, MEAL_REUSE_TOLERANCE, macro_vector
+)
+from app.utils.plan_requests import meal_counts_for
+
+logger = logging.getLogger(__name__)
+
+# Share of the daily macros each meal type is planned for
+MEAL_TYPE_CALORIE_RATIO = {
+    "Breakfast": 0.25,  # 25% of daily calories
+    "Lunch": 0.30,      # 30% of daily calories
+    "Dinner": 0.35,     # 35% of daily calories
+    "Snack": 0.10       # 10% of daily calories per snack
+}
+FULL_DAY_MEAL_TYPES = ("Breakfast", "Lunch", "Dinner", "Snack")
+
+# Candidates drawn per meal type; the search scores INSTANT_PLAN_POOL_SIZE ** 4 combinations
+INSTANT_PLAN_POOL_SIZE = int(os.getenv("INSTANT_PLAN_POOL_SIZE", "20"))
+# How far an individual candidate may be from its meal type's share of the day
+INSTANT_PLAN_CANDIDATE_TOLERANCE = float(os.getenv("INSTANT_PLAN_CANDIDATE_TOLERANCE", "0.35"))
+# How far the day's totals may be from the daily targets (relative, per weighted nutrient)
+INSTANT_PLAN_DAY_TOLERANCE = float(os.getenv("INSTANT_PLAN_DAY_TOLERANCE", "0.1"))
+
+
+def meal_type_targets(macros: dict, meal_type: str, count: int = 1) -> Dict[str, float]:
+    """
+    Returns the macro target of one meal of the given type: the type's share of the
+    requested macros, split over the `count` meals of that type in the plan. Generation
+    uses the same targets, so a request gets the same portions whichever path serves it.
+    """
+    ratio = MEAL_TYPE_CALORIE_RATIO.get(meal_type, 0)
+    return {key: float(value or 0) * ratio / max(count, 1) for key, value in macros.items()}
+
+
+def _mask_titles(scores: np.ndarray, pools: Sequence[List[MealMatch]], titles: set) -> None:
+    """Excludes every combination that contains a meal with one of the given titles."""
+    for axis, pool in enumerate(pools):
+        rows = [i for i, match in enumerate(pool) if match.title.lower().strip() in titles]
+        if rows:
+            index = [slice(None)] * len(pools)
+            index[axis] = rows
+            scores[tuple(index)] = np.inf
+
+
+def score_day_combinations(pools: Sequence[List[MealMatch]], daily_macros: dict,
+                           tolerance: float = INSTANT_PLAN_DAY_TOLERANCE) -> np.ndarray:
+    """
+    Scores every combination of one meal per pool against the daily targets.
+    Returns an array with one axis per pool holding the weighted relative distance of the
+    day's totals from the target, or inf where any nutrient is outside the tolerance.
+    """
+    target = macro_vector(daily_macros)
+    scale = NUTRIENT_WEIGHTS / np.maximum(target, 1.0)
+    n_pools = len(pools)
+    # (M_i, K) macro matrix of each pool, pre-scaled so deviations come out relative and weighted
+    scaled_pools = [np.stack([match.macros for match in pool]) * scale for pool in pools]
+    shape = tuple(len(pool) for pool in pools)
+
+    # One nutrient at a time: broadcast each pool's column onto its own axis, so the working
+    # set stays at one value per combination instead of one vector per combination
+    deviation = np.empty(shape, dtype=np.float32)
+    worst = np.zeros(shape, dtype=np.float32)
+    scores = np.zeros(shape, dtype=np.float32)
+    for k in range(len(target)):
+        deviation.fill(-target[k] * scale[k])
+        for axis, scaled in enumerate(scaled_pools):
+            column_shape = [1] * n_pools
+            column_shape[axis] = len(scaled)
+            deviation += scaled[:, k].reshape(column_shape)
+        np.abs(deviation, out=deviation)
+        np.maximum(worst, deviation, out=worst)
+        np.multiply(deviation, deviation, out=deviation)
+        scores += deviation
+
+    np.sqrt(scores, out=scores)
+    scores[worst > tolerance] = np.inf
+    return scores
+
+
+def assemble_full_day_plan(dietary_type: str, daily_macros: dict, num_days: int) -> Optional[List[List[MealMatch]]]:
+    """
+    Picks one meal per Full Day meal type for each day. No meal title is used twice in the plan.
+    Returns one [Breakfast, Lunch, Dinner, Snack] list per day, or None if the pool is too sparse.
+    """
+    index = get_meal_index()
+    meal_counts, _ = meal_counts_for("Full Day", num_days)
+    # Each day gets the sum of its meals' targets, as in a generated plan
+    day_macros = {key: float(value or 0) / max(num_days, 1) for key, value in daily_macros.items()}
+    pools = []
+    for meal_type in FULL_DAY_MEAL_TYPES:
+        pool = index.nearest(
+            meal_type, dietary_type, meal_type_targets(daily_macros, meal_type, meal_counts[meal_type]),
+            k=INSTANT_PLAN_POOL_SIZE, tolerance=INSTANT_PLAN_CANDIDATE_TOLERANCE
+        )
+        if len(pool) < num_days:
+            logger.info(f"Instant plan pool too sparse: {len(pool)} {meal_type} candidates for {num_days} days")
+            return None
+        pools.append(pool)
+
+    scores = score_day_combinations(pools, day_macros)
+    days = []
+    while len(days) < num_days:
+        best = np.unravel_index(np.argmin(scores), scores.shape)
+        if not np.isfinite(scores[best]):
+            logger.info(f"Instant plan found only {len(days)} of {num_days} days within tolerance")
+            return None
+
+        day = [pools[axis][i] for axis, i in enumerate(best)]
+        day_titles = {match.title.lower().strip() for match in day}
+        if len(day_titles) < len(day):
+            # The same dish was picked for two meal types; rule out this combination only
+            scores[best] = np.inf
+            continue
+
+        days.append(day)
+        _mask_titles(scores, pools, day_titles)
+
+    return days
+
+
+def assemble_single_type_plan(meal_type: str, dietary_type: str, daily_macros: dict, num_days: int) -> Optional[List[MealMatch]]:
+    """Picks a distinct stored meal of one type for each day, or None if there are not enough."""
+    meal_counts, _ = meal_counts_for(meal_type, num_days)
+    targets = meal_type_targets(daily_macros, meal_type, meal_counts[meal_type])
+    matches = get_meal_index().nearest(meal_type, dietary_type, targets, k=num_days, tolerance=MEAL_REUSE_TOLERANCE)
+    return matches if len(matches) >= num_days else None
+
+
+def build_instant_plan(meal_type: str, dietary_type: str, daily_macros: dict, num_days: int) -> Optional[List[dict]]:
+    """
+    Assembles a meal plan entirely from stored meals.
+    Returns the stored meal documents in plan order, with meal_type set to the slot they fill,
+    or None if the pool is not dense enough for the request.
+    """
+    if meal_type == "Full Day":
+        days = assemble_full_day_plan(dietary_type, daily_macros, num_days)
+        slots = [(match, slot_type) for day in days for match, slot_type in zip(day, FULL_DAY_MEAL_TYPES)] if days else None
+    else:
+        matches = assemble_single_type_plan(meal_type, dietary_type, daily_macros, num_days)
+        slots = [(match, meal_type) for match in matches] if matches else None
+
+    if not slots:
+        return None
+
+    meals = {meal["meal_id"]: meal for meal in meals_collection.find({"meal_id": {"$in": [m.meal_id for m, _ in slots]}})}
+    if len(meals) < len({m.meal_id for m, _ in slots}):
+        logger.warning("Instant plan referenced meals that are no longer stored")
+        return None
+
+    plan = []
+    for match, slot_type in slots:
+        meal = dict(meals[match.meal_id])
+        meal["meal_type"] = slot_type
+        plan.append(meal)
+    return plan
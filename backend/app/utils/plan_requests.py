@@ -0,0 +1,190 @@
+"""
+Meal plan request shapes.
+
+A request shape is everything that determines which meals a plan gets: meal type,
+dietary preferences, macro targets and algorithm. POST /mealplan/ derives the
+request hash (the cache key of the plan) from its canonical form, so requests that
+only differ in wording or by a few calories share one plan, and records how often
+each shape is requested, so the prewarm_popular_plans beat task can generate the most
+popular shapes ahead of time and keep their `meal_plan:` cache entries warm.
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import redis
+
+from app.utils.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Define the expected number of meals based on Meal Type
+MEAL_TYPE_COUNTS = {
+    "Full Day": 4,
+    "Breakfast": 1,
+    "Lunch": 1,
+    "Dinner": 1,
+    "Snack": 1,
+}
+
+# Request fields that make up a shape
+SHAPE_FIELDS = ("meal_type", "dietary_preferences", "calories", "protein", "carbs", "fat", "fiber", "sugar", "meal_algorithm")
+
+# Macro targets are snapped to buckets of this width before hashing, so requests within
+# half a bucket of each other share a plan. Set a width to 1 to hash exact values.
+CALORIE_BUCKET_SIZE = int(os.getenv("REQUEST_HASH_CALORIE_BUCKET", "50"))
+MACRO_BUCKET_SIZE = int(os.getenv("REQUEST_HASH_MACRO_BUCKET", "5"))
+MACRO_BUCKET_SIZES = {
+    "calories": CALORIE_BUCKET_SIZE,
+    "protein": MACRO_BUCKET_SIZE,
+    "carbs": MACRO_BUCKET_SIZE,
+    "fat": MACRO_BUCKET_SIZE,
+    "fiber": MACRO_BUCKET_SIZE,
+    "sugar": MACRO_BUCKET_SIZE,
+}
+
+# Dietary preferences are compared as a set of phrases: "Gluten-Free, Vegan" == "vegan; gluten free"
+_DIETARY_SEPARATOR_RE = re.compile(r"\s*(?:[,;/&+|]|\band\b)\s*")
+_DIETARY_NOISE_RE = re.compile(r"[^a-z0-9 ]+")
+
+# Sorted set of request hashes scored by request count, with the shape of each hash alongside
+SHAPE_POPULARITY_KEY = "meal_plan_shapes:popularity"
+SHAPE_PARAMS_KEY = "meal_plan_shapes:params"
+# Largest number of days requested per shape, so a prewarmed plan covers every request of it
+SHAPE_DAYS_KEY = "meal_plan_shapes:days"
+
+
+def meal_counts_for(meal_type: str, num_days: int) -> Tuple[Dict[str, int], int]:
+    """Returns the number of meals needed per meal type, and in total, for a plan."""
+    if meal_type == "Full Day":
+        meal_counts = {
+            "Breakfast": num_days,
+            "Lunch": num_days,
+            "Dinner": num_days,
+            "Snack": num_days
+        }
+    else:
+        meal_counts = {meal_type: MEAL_TYPE_COUNTS.get(meal_type, 1) * num_days}
+    return meal_counts, sum(meal_counts.values())
+
+
+def bucket_macro(nutrient: str, value) -> int:
+    """Rounds a macro target to the nearest multiple of its bucket width."""
+    size = max(1, MACRO_BUCKET_SIZES.get(nutrient, 1))
+    try:
+        value = float(value or 0)
+    except (TypeError, ValueError):
+        value = 0.0
+    return int((value + size / 2) // size) * size
+
+
+def dietary_tokens(dietary_preferences: str) -> List[str]:
+    """Splits free-text dietary preferences into sorted, de-duplicated, normalized phrases."""
+    phrases = set()
+    for phrase in _DIETARY_SEPARATOR_RE.split((dietary_preferences or "").lower()):
+        phrase = " ".join(_DIETARY_NOISE_RE.sub(" ", phrase).split())
+        if phrase:
+            phrases.add(phrase)
+    return sorted(phrases)
+
+
+def pantry_digest(pantry_ingredients: List[str]) -> str:
+    """Digest of the full, normalized set of pantry ingredients."""
+    items = sorted({" ".join(item.lower().split()) for item in pantry_ingredients or [] if item and item.strip()})
+    return hashlib.sha256("\n".join(items).encode()).hexdigest()[:16] if items else ""
+
+
+def canonical_request(request_dict: dict) -> dict:
+    """
+    The canonical form of a request: what decides whether two requests can share a plan.
+    The pantry only counts for pantry requests, since no other algorithm reads it.
+    """
+    canonical = {
+        "meal_type": request_dict.get("meal_type", ""),
+        "dietary": dietary_tokens(request_dict.get("dietary_preferences", "")),
+        "macros": {nutrient: bucket_macro(nutrient, request_dict.get(nutrient)) for nutrient in MACRO_BUCKET_SIZES},
+        "meal_algorithm": request_dict.get("meal_algorithm") or "experimental",
+    }
+    if canonical["meal_algorithm"] == "pantry":
+        canonical["pantry"] = pantry_digest(request_dict.get("pantry_ingredients"))
+    return canonical
+
+
+def build_request_hash(request_dict: dict) -> str:
+    """Builds the request hash that identifies a plan's meals in Redis and MongoDB."""
+    canonical = json.dumps(canonical_request(request_dict), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+def record_request_shape(request_hash: str, request_dict: dict, num_days: int) -> None:
+    """
+    Counts one request of a shape. Pantry requests depend on one user's pantry and are
+    never prewarmed, so they are not counted.
+    """
+    if request_dict.get("meal_algorithm") == "pantry":
+        return
+    shape = {field: request_dict.get(field) for field in SHAPE_FIELDS}
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zincrby(SHAPE_POPULARITY_KEY, 1, request_hash)
+        pipe.hset(SHAPE_PARAMS_KEY, request_hash, json.dumps(shape))
+        pipe.zadd(SHAPE_DAYS_KEY, {request_hash: num_days}, gt=True)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"Failed to record request shape {request_hash}: {str(e)}")
+
+
+def top_request_shapes(limit: int, min_requests: float = 1) -> List[dict]:
+    """
+    Returns the most requested shapes, most popular first, as dicts with the shape's
+    request fields plus request_hash, num_days and requests.
+    """
+    try:
+        ranked = redis_client.zrevrangebyscore(
+            SHAPE_POPULARITY_KEY, "+inf", min_requests, start=0, num=limit, withscores=True
+        )
+        if not ranked:
+            return []
+        hashes = [member for member, _ in ranked]
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hmget(SHAPE_PARAMS_KEY, hashes)
+        for member in hashes:
+            pipe.zscore(SHAPE_DAYS_KEY, member)
+        params, *days = pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"Failed to read popular request shapes: {str(e)}")
+        return []
+
+    shapes = []
+    for (member, score), raw_shape, num_days in zip(ranked, params, days):
+        if not raw_shape:
+            continue
+        shape = json.loads(raw_shape)
+        shape["request_hash"] = member.decode() if isinstance(member, bytes) else member
+        shape["num_days"] = int(num_days or 1)
+        shape["requests"] = score
+        shapes.append(shape)
+    return shapes
+
+
+def decay_request_shapes(factor: float, min_requests: float = 0.5) -> Optional[int]:
+    """
+    Scales every shape's count by `factor` so popularity follows recent demand, and
+    forgets shapes whose count fell below `min_requests`. Returns the number forgotten.
+    """
+    try:
+        redis_client.zunionstore(SHAPE_POPULARITY_KEY, {SHAPE_POPULARITY_KEY: factor})
+        stale = redis_client.zrangebyscore(SHAPE_POPULARITY_KEY, "-inf", f"({min_requests}")
+        if stale:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.zrem(SHAPE_POPULARITY_KEY, *stale)
+            pipe.hdel(SHAPE_PARAMS_KEY, *stale)
+            pipe.zrem(SHAPE_DAYS_KEY, *stale)
+            pipe.execute()
+        return len(stale)
+    except redis.RedisError as e:
+        logger.error(f"Failed to decay request shape popularity: {str(e)}")
+        return None
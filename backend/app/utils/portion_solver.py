@@ -0,0 +1,204 @@
+"""
+Multi-nutrient portion solver.
+
+Builds an ingredients x nutrients matrix from the per-ingredient macros of each
+meal and solves a bounded least-squares problem for per-ingredient portion
+multipliers that bring all six nutrients as close as possible to the meal's
+targets. All meals of a plan are solved together in one vectorized call.
+"""
+import logging
+from typing import List, Sequence
+
+import numpy as np
+
+from app.utils.quantity_parser import scale_quantity
+
+logger = logging.getLogger(__name__)
+
+NUTRIENT_KEYS = ("calories", "protein", "carbs", "fat", "fiber", "sugar")
+
+# Allowed range for each ingredient's portion multiplier
+MIN_PORTION_SCALE = 0.25
+MAX_PORTION_SCALE = 3.0
+
+# Pull towards the original recipe so portions only move as much as the targets require
+PORTION_REGULARIZATION = 0.01
+SOLVER_ITERATIONS = 300
+
+# Tolerances within which a meal is left untouched (calories in kcal, others in grams)
+MACRO_TOLERANCES = {"calories": 5, "protein": 1, "carbs": 1, "fat": 1, "fiber": 1, "sugar": 1}
+
+ADJUSTMENT_NOTE = "\n\n**Note: Portions have been precisely adjusted to match the nutritional targets.**"
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def needs_adjustment(meal: dict, target_macros: dict) -> bool:
+    """Checks whether a meal's macros are off target by more than the allowed tolerance."""
+    current_macros = meal.get("nutrition", {})
+    return any(
+        abs(_to_float(current_macros.get(key, 0)) - _to_float(target_macros.get(key, 0))) > tolerance
+        for key, tolerance in MACRO_TOLERANCES.items()
+    )
+
+
+def _has_ingredient_macros(ingredient) -> bool:
+    return isinstance(ingredient, dict) and isinstance(ingredient.get("macros"), dict)
+
+
+def solve_portion_multipliers(
+    nutrient_matrix: np.ndarray,
+    targets: np.ndarray,
+    mask: np.ndarray,
+    min_scale: float = MIN_PORTION_SCALE,
+    max_scale: float = MAX_PORTION_SCALE,
+    iterations: int = SOLVER_ITERATIONS,
+) -> np.ndarray:
+    """
+    Solves min ||W (A^T x - t)||^2 + lambda ||x - 1||^2 subject to min_scale <= x <= max_scale
+    for a batch of meals with accelerated projected gradient descent.
+
+    nutrient_matrix: (B, N, K) nutrient contribution of each ingredient at its current portion
+    targets:         (B, K) target nutrient totals
+    mask:            (B, N) True for real ingredients; padded slots stay at 1.0
+    Returns the (B, N) portion multipliers.
+    """
+    batch, n_ingredients, _ = nutrient_matrix.shape
+    # Weight each nutrient by its target so errors are relative and comparable across nutrients
+    weights = 1.0 / np.maximum(targets, 1.0)                                   # (B, K)
+    weighted = nutrient_matrix * weights[:, None, :] * mask[:, :, None]       # (B, N, K)
+    weighted_targets = targets * weights                                      # (B, K)
+
+    gram = weighted @ weighted.transpose(0, 2, 1)                             # (B, N, N)
+    gram += PORTION_REGULARIZATION * np.eye(n_ingredients)[None, :, :]
+    rhs = (weighted @ weighted_targets[:, :, None])[:, :, 0] + PORTION_REGULARIZATION  # (B, N)
+
+    # Per-meal Lipschitz constant of the gradient gives a safe step size
+    lipschitz = 2.0 * np.linalg.eigvalsh(gram)[:, -1]
+    step = 1.0 / np.maximum(lipschitz, 1e-9)
+
+    x = np.ones((batch, n_ingredients))
+    y = x.copy()
+    momentum = 1.0
+    for _ in range(iterations):
+        gradient = 2.0 * ((gram @ y[:, :, None])[:, :, 0] - rhs)
+        x_next = np.clip(y - step[:, None] * gradient, min_scale, max_scale)
+        x_next = np.where(mask, x_next, 1.0)
+        momentum_next = (1.0 + np.sqrt(1.0 + 4.0 * momentum * momentum)) / 2.0
+        y = x_next + ((momentum - 1.0) / momentum_next) * (x_next - x)
+        x, momentum = x_next, momentum_next
+
+    return x
+
+
+def _apply_multipliers(meal: dict, multipliers: Sequence[float]) -> dict:
+    """Scales each ingredient's quantity and macros and recomputes the meal totals from them."""
+    adjusted_ingredients = []
+    totals = {key: 0.0 for key in NUTRIENT_KEYS}
+    solved = iter(multipliers)
+
+    for ingredient in meal.get("ingredients", []):
+        if not _has_ingredient_macros(ingredient):
+            adjusted_ingredients.append(ingredient)
+            continue
+
+        factor = float(next(solved))
+        ingredient = dict(ingredient)
+        if "quantity" in ingredient and isinstance(ingredient["quantity"], str):
+            ingredient["quantity"] = scale_quantity(ingredient["quantity"], factor)
+        ingredient["macros"] = {
+            key: round(_to_float(value) * factor, 1) for key, value in ingredient["macros"].items()
+        }
+        for key in NUTRIENT_KEYS:
+            totals[key] += ingredient["macros"].get(key, 0.0)
+        adjusted_ingredients.append(ingredient)
+
+    adjusted_meal = dict(meal)
+    adjusted_meal["ingredients"] = adjusted_ingredients
+    # Displayed totals are the sum of the adjusted ingredients, so they always match the recipe
+    adjusted_meal["nutrition"] = {
+        key: int(round(totals[key])) if key == "calories" else round(totals[key], 1)
+        for key in NUTRIENT_KEYS
+    }
+    adjusted_meal["instructions"] = meal.get("instructions", "") + ADJUSTMENT_NOTE
+    return adjusted_meal
+
+
+def _scale_by_calories(meal: dict, target_macros: dict) -> dict:
+    """Fallback for meals without per-ingredient macros: scale every portion by the calorie ratio."""
+    current_macros = meal.get("nutrition", {})
+    calorie_scaling = _to_float(target_macros.get("calories", 1)) / max(_to_float(current_macros.get("calories", 1)), 1)
+
+    adjusted_ingredients = []
+    for ingredient in meal.get("ingredients", []):
+        if isinstance(ingredient, dict) and isinstance(ingredient.get("quantity"), str):
+            ingredient = dict(ingredient)
+            ingredient["quantity"] = scale_quantity(ingredient["quantity"], calorie_scaling)
+        adjusted_ingredients.append(ingredient)
+
+    adjusted_meal = dict(meal)
+    adjusted_meal["ingredients"] = adjusted_ingredients
+    adjusted_meal["nutrition"] = {
+        key: round(_to_float(current_macros.get(key, 0)) * calorie_scaling, 1) for key in NUTRIENT_KEYS
+    }
+    adjusted_meal["instructions"] = meal.get("instructions", "") + ADJUSTMENT_NOTE
+    return adjusted_meal
+
+
+def adjust_meal_portions(meals: List[dict], targets: List[dict]) -> List[dict]:
+    """
+    Validates a batch of meals against their macro targets and adjusts the portions of
+    the ones that are off target. Meals are solved together in a single vectorized call.
+    Returns the adjusted meals in the same order.
+    """
+    adjusted = list(meals)
+    to_solve: List[int] = []
+    for idx, (meal, target) in enumerate(zip(meals, targets)):
+        if not needs_adjustment(meal, target):
+            continue
+        if any(_has_ingredient_macros(ingredient) for ingredient in meal.get("ingredients", [])):
+            to_solve.append(idx)
+        else:
+            adjusted[idx] = _scale_by_calories(meal, target)
+
+    if not to_solve:
+        return adjusted
+
+    rows: List[List[List[float]]] = []
+    for idx in to_solve:
+        rows.append([
+            [_to_float(ingredient["macros"].get(key, 0)) for key in NUTRIENT_KEYS]
+            for ingredient in meals[idx].get("ingredients", [])
+            if _has_ingredient_macros(ingredient)
+        ])
+
+    max_ingredients = max(len(r) for r in rows)
+    nutrient_matrix = np.zeros((len(rows), max_ingredients, len(NUTRIENT_KEYS)))
+    mask = np.zeros((len(rows), max_ingredients), dtype=bool)
+    for b, r in enumerate(rows):
+        nutrient_matrix[b, :len(r)] = r
+        mask[b, :len(r)] = True
+    target_matrix = np.array([
+        [_to_float(targets[idx].get(key, 0)) for key in NUTRIENT_KEYS] for idx in to_solve
+    ])
+
+    multipliers = solve_portion_multipliers(nutrient_matrix, target_matrix, mask)
+
+    for b, idx in enumerate(to_solve):
+        adjusted[idx] = _apply_multipliers(meals[idx], multipliers[b, :len(rows[b])])
+
+    logger.info(f"Solved portions for {len(to_solve)} of {len(meals)} meals")
+    return adjusted
+
+
+def validate_and_adjust_macros(meal: dict, target_macros: dict) -> dict:
+    """
+    Validates if the meal's macros match target macros and adjusts portions if needed.
+    Returns the adjusted meal with corrected portions and macros.
+    """
+    return adjust_meal_portions([meal], [target_macros])[0]
@@ -0,0 +1,303 @@
+"""
+Ingredient quantity parsing.
+
+Parses free-text quantities such as "1 1/2 cups", "½ tbsp", "2-3 cloves" or
+"6 oz" with a precompiled grammar, resolves units through a unit registry and
+converts volumes and counts to grams with an ingredient density / item weight
+table. Parsed strings are memoized, so the hot loops in macro adjustment and
+USDA gram conversion only pay for each distinct quantity string once.
+"""
+import re
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+# ===================== GRAMMAR =====================
+
+UNICODE_FRACTIONS = {
+    "½": "1/2", "⅓": "1/3", "⅔": "2/3", "¼": "1/4", "¾": "3/4",
+    "⅕": "1/5", "⅖": "2/5", "⅗": "3/5", "⅘": "4/5", "⅙": "1/6",
+    "⅚": "5/6", "⅛": "1/8", "⅜": "3/8", "⅝": "5/8", "⅞": "7/8",
+}
+
+_UNICODE_FRACTION_RE = re.compile(rf"(\d)?\s*([{''.join(UNICODE_FRACTIONS)}])")
+_NUMBER = r"(?:\d+\s+\d+\s*/\s*\d+|\d+\s*/\s*\d+|\d+(?:\.\d+)?|\.\d+)"
+_UNIT = r"fl\.?\s*oz\.?|fluid\s+ounces?|[a-zA-Z]+\.?"
+_QUANTITY_RE = re.compile(
+    rf"^\s*(?:about\s+|approx\.?\s+|~\s*)?"
+    rf"(?P<amount>{_NUMBER})"
+    rf"(?:\s*(?:-|–|to)\s*(?P<amount_max>{_NUMBER}))?"
+    rf"\s*(?P<unit>{_UNIT})?",
+    re.IGNORECASE,
+)
+# Quantities without a number, e.g. "a pinch" or "pinch"
+_ARTICLE_UNIT_RE = re.compile(rf"^\s*(?:a|an|one)?\s*(?P<unit>{_UNIT})", re.IGNORECASE)
+_FRACTION_RE = re.compile(r"^(?:(\d+)\s+)?(\d+)\s*/\s*(\d+)$")
+_NAME_TOKEN_RE = re.compile(r"[a-z]+")
+
+# ===================== UNIT REGISTRY =====================
+
+MASS, VOLUME, COUNT = "mass", "volume", "count"
+
+# canonical unit -> (kind, grams per unit for mass / millilitres per unit for volume / default grams per item for count)
+UNITS = {
+    "g": (MASS, 1.0),
+    "kg": (MASS, 1000.0),
+    "mg": (MASS, 0.001),
+    "oz": (MASS, 28.3495),
+    "lb": (MASS, 453.592),
+    "ml": (VOLUME, 1.0),
+    "cl": (VOLUME, 10.0),
+    "dl": (VOLUME, 100.0),
+    "l": (VOLUME, 1000.0),
+    "tsp": (VOLUME, 4.92892),
+    "tbsp": (VOLUME, 14.7868),
+    "cup": (VOLUME, 236.588),
+    "fl oz": (VOLUME, 29.5735),
+    "pint": (VOLUME, 473.176),
+    "quart": (VOLUME, 946.353),
+    "clove": (COUNT, 5.0),
+    "slice": (COUNT, 28.0),
+    "piece": (COUNT, 50.0),
+    "pinch": (COUNT, 0.36),
+    "dash": (COUNT, 0.6),
+    "sprig": (COUNT, 1.0),
+    "leaf": (COUNT, 0.5),
+    "stalk": (COUNT, 40.0),
+    "handful": (COUNT, 30.0),
+    "can": (COUNT, 400.0),
+    "scoop": (COUNT, 30.0),
+    "large": (COUNT, None),
+    "medium": (COUNT, None),
+    "small": (COUNT, None),
+    "whole": (COUNT, None),
+}
+
+UNIT_ALIASES = {
+    "g": "g", "gr": "g", "gram": "g", "grams": "g", "gm": "g",
+    "kg": "kg", "kilogram": "kg", "kilograms": "kg",
+    "mg": "mg", "milligram": "mg", "milligrams": "mg",
+    "oz": "oz", "ounce": "oz", "ounces": "oz",
+    "lb": "lb", "lbs": "lb", "pound": "lb", "pounds": "lb",
+    "ml": "ml", "milliliter": "ml", "milliliters": "ml", "millilitre": "ml", "millilitres": "ml",
+    "cl": "cl", "dl": "dl",
+    "l": "l", "liter": "l", "liters": "l", "litre": "l", "litres": "l",
+    "tsp": "tsp", "tsps": "tsp", "teaspoon": "tsp", "teaspoons": "tsp",
+    "tbsp": "tbsp", "tbsps": "tbsp", "tbs": "tbsp", "tbl": "tbsp", "tablespoon": "tbsp", "tablespoons": "tbsp",
+    "cup": "cup", "cups": "cup", "c": "cup",
+    "fl oz": "fl oz", "floz": "fl oz", "fluid ounce": "fl oz", "fluid ounces": "fl oz",
+    "pint": "pint", "pints": "pint", "pt": "pint",
+    "quart": "quart", "quarts": "quart", "qt": "quart",
+    "clove": "clove", "cloves": "clove",
+    "slice": "slice", "slices": "slice",
+    "piece": "piece", "pieces": "piece", "pc": "piece", "pcs": "piece",
+    "pinch": "pinch", "pinches": "pinch",
+    "dash": "dash", "dashes": "dash",
+    "sprig": "sprig", "sprigs": "sprig",
+    "leaf": "leaf", "leaves": "leaf",
+    "stalk": "stalk", "stalks": "stalk",
+    "handful": "handful", "handfuls": "handful",
+    "can": "can", "cans": "can",
+    "scoop": "scoop", "scoops": "scoop",
+    "large": "large", "medium": "medium", "small": "small", "whole": "whole",
+}
+
+SIZE_FACTORS = {"large": 1.25, "medium": 1.0, "small": 0.75, "whole": 1.0}
+
+# ===================== DENSITY TABLE =====================
+
+# Grams per millilitre, matched against ingredient name keywords (longest keyword wins)
+DENSITIES = {
+    "water": 1.0, "broth": 1.0, "stock": 1.0, "vinegar": 1.01, "juice": 1.04,
+    "milk": 1.03, "almond milk": 1.02, "coconut milk": 0.97, "cream": 1.0, "yogurt": 1.03,
+    "greek yogurt": 1.1, "cottage cheese": 0.95, "ricotta": 1.03, "sour cream": 1.0,
+    "oil": 0.92, "olive oil": 0.91, "butter": 0.96, "ghee": 0.91,
+    "honey": 1.42, "maple syrup": 1.32, "syrup": 1.33, "soy sauce": 1.15, "tahini": 1.07,
+    "peanut butter": 1.08, "almond butter": 1.08, "mayonnaise": 0.91, "ketchup": 1.15, "mustard": 1.05,
+    "salsa": 1.0, "hummus": 1.02, "pesto": 0.97,
+    "flour": 0.53, "almond flour": 0.41, "sugar": 0.85, "brown sugar": 0.93, "powdered sugar": 0.51,
+    "cocoa": 0.42, "salt": 1.22, "baking powder": 0.9, "baking soda": 0.92,
+    "oats": 0.34, "rolled oats": 0.34, "granola": 0.45, "cereal": 0.15,
+    "rice": 0.85, "cooked rice": 0.67, "quinoa": 0.72, "cooked quinoa": 0.78, "couscous": 0.73,
+    "lentils": 0.81, "beans": 0.75, "chickpeas": 0.69, "pasta": 0.45, "cooked pasta": 0.59,
+    "spinach": 0.13, "kale": 0.28, "lettuce": 0.2, "arugula": 0.08, "greens": 0.15,
+    "broccoli": 0.37, "cauliflower": 0.45, "carrot": 0.54, "peas": 0.61, "corn": 0.69,
+    "onion": 0.68, "bell pepper": 0.63, "tomato": 0.76, "cherry tomatoes": 0.63, "cucumber": 0.55,
+    "mushrooms": 0.3, "zucchini": 0.53,
+    "berries": 0.6, "blueberries": 0.63, "strawberries": 0.64, "raspberries": 0.52, "banana": 0.95,
+    "nuts": 0.6, "almonds": 0.6, "walnuts": 0.42, "pecans": 0.42, "peanuts": 0.61,
+    "seeds": 0.6, "chia seeds": 0.68, "flax": 0.55, "hemp seeds": 0.68,
+    "cheese": 0.45, "parmesan": 0.42, "feta": 0.64, "shredded cheese": 0.45,
+    "protein powder": 0.4, "herbs": 0.1, "parsley": 0.1, "cilantro": 0.07, "basil": 0.09,
+    "spice": 0.5, "cinnamon": 0.53, "cumin": 0.48, "paprika": 0.46, "pepper": 0.49,
+}
+
+# Grams per whole item for count quantities with no unit or a size unit, e.g. "2 large eggs"
+ITEM_WEIGHTS = {
+    "egg": 50.0, "egg white": 33.0, "egg yolk": 17.0,
+    "banana": 118.0, "apple": 182.0, "pear": 178.0, "orange": 131.0, "peach": 150.0,
+    "avocado": 150.0, "lemon": 58.0, "lime": 67.0, "onion": 110.0, "shallot": 25.0,
+    "tomato": 123.0, "potato": 213.0, "sweet potato": 130.0, "carrot": 61.0,
+    "bell pepper": 119.0, "zucchini": 196.0, "cucumber": 301.0, "garlic": 5.0,
+    "tortilla": 45.0, "pita": 60.0, "bagel": 105.0, "english muffin": 57.0, "bread": 28.0,
+    "chicken breast": 174.0, "chicken thigh": 116.0, "salmon fillet": 170.0, "date": 24.0,
+}
+
+# Bare numbers for unknown ingredients were historically treated as grams
+DEFAULT_GRAMS_PER_BARE_NUMBER = 1.0
+
+
+class ParsedQuantity(NamedTuple):
+    amount: float
+    amount_max: Optional[float]
+    unit: Optional[str]
+    kind: Optional[str]
+    unit_text: str
+    span: Tuple[int, int]
+
+    @property
+    def value(self) -> float:
+        """Midpoint of a range, or the amount itself."""
+        if self.amount_max is None:
+            return self.amount
+        return (self.amount + self.amount_max) / 2.0
+
+
+def _normalize_unicode_fractions(text: str) -> str:
+    def replace(match):
+        whole = f"{match.group(1)} " if match.group(1) else ""
+        return f"{whole}{UNICODE_FRACTIONS[match.group(2)]}"
+    return _UNICODE_FRACTION_RE.sub(replace, text)
+
+
+def _parse_number(text: str) -> float:
+    """Evaluates a number matched by the grammar: "2", "0.5", "1/2" or "1 1/2"."""
+    match = _FRACTION_RE.match(text)
+    if not match:
+        return float(text)
+    whole, numerator, denominator = match.groups()
+    if int(denominator) == 0:
+        raise ValueError(f"Invalid fraction: {text}")
+    return float(whole or 0) + int(numerator) / int(denominator)
+
+
+def resolve_unit(unit_text: Optional[str]) -> Optional[str]:
+    """Maps a unit as written ("Tbsp.", "cups", "fl oz") to its canonical registry name."""
+    if not unit_text:
+        return None
+    key = " ".join(unit_text.lower().replace(".", " ").split())
+    if key in UNIT_ALIASES:
+        return UNIT_ALIASES[key]
+    # Case matters for the common "T" (tablespoon) vs "t" (teaspoon) shorthand
+    if unit_text.rstrip(".") == "T":
+        return "tbsp"
+    if unit_text.rstrip(".") == "t":
+        return "tsp"
+    return None
+
+
+@lru_cache(maxsize=8192)
+def parse_quantity(text: str) -> Optional[ParsedQuantity]:
+    """Parses a quantity string. Returns None if it does not start with a recognizable quantity."""
+    if not text:
+        return None
+    normalized = _normalize_unicode_fractions(text)
+    match = _QUANTITY_RE.match(normalized)
+    if match:
+        try:
+            amount = _parse_number(match.group("amount"))
+            amount_max = _parse_number(match.group("amount_max")) if match.group("amount_max") else None
+        except (ValueError, ZeroDivisionError):
+            return None
+        unit_text = match.group("unit") or ""
+        unit = resolve_unit(unit_text)
+        if unit is None:
+            # The word after the number is part of the ingredient, not a unit ("2 eggs")
+            unit_text = ""
+            end = match.end("amount_max") if match.group("amount_max") else match.end("amount")
+        else:
+            end = match.end("unit")
+        kind = UNITS[unit][0] if unit else None
+        return ParsedQuantity(amount, amount_max, unit, kind, unit_text.strip(), (match.start("amount"), end))
+
+    match = _ARTICLE_UNIT_RE.match(normalized)
+    if match:
+        unit = resolve_unit(match.group("unit"))
+        if unit:
+            return ParsedQuantity(1.0, None, unit, UNITS[unit][0], match.group("unit").strip(), (match.start(), match.end()))
+    return None
+
+
+def _longest_keyword(table: dict, ingredient_name: str) -> Optional[str]:
+    """Finds the longest table keyword contained in the ingredient name as whole words."""
+    padded = f" {' '.join(_NAME_TOKEN_RE.findall(ingredient_name.lower()))} "
+    best = None
+    for keyword in table:
+        # Allow a plural on the last word ("tomatoes", "eggs")
+        if f" {keyword} " in padded or f" {keyword}s " in padded or f" {keyword}es " in padded:
+            if best is None or len(keyword) > len(best):
+                best = keyword
+    return best
+
+
+@lru_cache(maxsize=4096)
+def density_for(ingredient_name: str) -> float:
+    """Grams per millilitre for an ingredient, defaulting to water."""
+    keyword = _longest_keyword(DENSITIES, ingredient_name)
+    return DENSITIES[keyword] if keyword else 1.0
+
+
+@lru_cache(maxsize=4096)
+def item_weight_for(ingredient_name: str) -> Optional[float]:
+    """Grams per whole item for countable ingredients, or None."""
+    keyword = _longest_keyword(ITEM_WEIGHTS, ingredient_name)
+    return ITEM_WEIGHTS[keyword] if keyword else None
+
+
+def to_grams(quantity: str, ingredient_name: str = "") -> Optional[float]:
+    """
+    Converts a quantity string to grams for the given ingredient.
+    Returns None if the quantity cannot be parsed.
+    """
+    parsed = parse_quantity(quantity)
+    if parsed is None:
+        return None
+
+    value = parsed.value
+    if parsed.kind == MASS:
+        return value * UNITS[parsed.unit][1]
+    if parsed.kind == VOLUME:
+        return value * UNITS[parsed.unit][1] * density_for(ingredient_name)
+
+    item_weight = item_weight_for(ingredient_name)
+    if parsed.kind == COUNT:
+        default_weight = UNITS[parsed.unit][1]
+        if parsed.unit in SIZE_FACTORS:
+            return value * (item_weight or 50.0) * SIZE_FACTORS[parsed.unit]
+        # A clove of garlic or a slice of bread is better described by the unit itself
+        return value * (default_weight if default_weight is not None else (item_weight or 50.0))
+
+    # Bare number: a whole item if the ingredient is countable, otherwise grams
+    if item_weight is not None and value < 20:
+        return value * item_weight
+    return value * DEFAULT_GRAMS_PER_BARE_NUMBER
+
+
+def format_amount(value: float) -> str:
+    """Formats an amount with at most one decimal place."""
+    return f"{value:.1f}".rstrip("0").rstrip(".") or "0"
+
+
+def scale_quantity(quantity: str, factor: float) -> str:
+    """Scales the amount (or range) of a quantity string by `factor`, keeping its unit and any trailing text."""
+    parsed = parse_quantity(quantity)
+    if parsed is None:
+        return quantity
+
+    amount_text = format_amount(parsed.amount * factor)
+    if parsed.amount_max is not None:
+        amount_text = f"{amount_text}-{format_amount(parsed.amount_max * factor)}"
+
+    normalized = _normalize_unicode_fractions(quantity)
+    rest = normalized[parsed.span[1]:]
+    unit = f" {parsed.unit_text}" if parsed.unit_text else ""
+    return f"{amount_text}{unit}{rest}".strip()
@@ -1,21 +1,29 @@
 import os
 import json
 import redis
+import redis.asyncio as aioredis
+import time
+import uuid
+import random
 import logging
-from typing import Any, Optional, Dict, List, Union
+import threading
+from typing import Any, Optional, Dict, List, Tuple, Union
 import pickle
-from redis.connection import ConnectionPool
+from redis.connection import BlockingConnectionPool
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Connection pool for better performance
-redis_pool = ConnectionPool(
+# Connection pool for better performance. It is blocking, so when every connection is in use
+# (as with dozens of greenlets in a gevent worker) callers wait up to REDIS_POOL_TIMEOUT for one
+# instead of failing with "Too many connections"
+redis_pool = BlockingConnectionPool(
     host=os.getenv("REDIS_HOST", "redis"),
     port=int(os.getenv("REDIS_PORT", "6379")),
     db=int(os.getenv("CULTURAL_REDIS_DB", "1")),  # Different DB for cultural info
     password=os.getenv("REDIS_PASSWORD", None),
-    max_connections=20,
+    max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "50")),
+    timeout=float(os.getenv("REDIS_POOL_TIMEOUT", "10")),
     decode_responses=False,
     health_check_interval=30,
     socket_keepalive=True
@@ -24,12 +32,98 @@ redis_pool = ConnectionPool(
 # Redis client using connection pool
 redis_client = redis.Redis(connection_pool=redis_pool)
 
+# Async client for endpoints that wait on Redis, such as pub/sub event streams
+async_redis_pool = aioredis.ConnectionPool(
+    host=os.getenv("REDIS_HOST", "redis"),
+    port=int(os.getenv("REDIS_PORT", "6379")),
+    db=int(os.getenv("CULTURAL_REDIS_DB", "1")),
+    password=os.getenv("REDIS_PASSWORD", None),
+    max_connections=int(os.getenv("ASYNC_REDIS_MAX_CONNECTIONS", "100")),
+    decode_responses=False,
+    health_check_interval=30,
+    socket_keepalive=True
+)
+async_redis_client = aioredis.Redis(connection_pool=async_redis_pool)
+
 # Default TTLs in seconds
 DEFAULT_CACHE_TTL = 3600  # 1 hour
 MEAL_CACHE_TTL = 86400  # 24 hours
 PROFILE_CACHE_TTL = 3600 * 24 * 7  # 1 week
 USDA_CACHE_TTL = 3600 * 24 * 30  # 30 days
 AUTH_CACHE_TTL = 300  # 5 minutes
+EVENT_HISTORY_TTL = 3600  # 1 hour
+
+# One fencing counter for every RedisLock rather than one key per lock name. It never expires:
+# a counter that restarted would hand out tokens lower than ones already stored with results
+LOCK_FENCE_KEY = "lock_fence"
+
+# Appends an event to a channel's replay history and publishes it in one atomic step, so the
+# event's position in the history doubles as its sequence number for subscribers
+_PUBLISH_EVENT_SCRIPT = redis_client.register_script("""
+local seq = redis.call('RPUSH', KEYS[1], ARGV[1]) - 1
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('PUBLISH', KEYS[2], seq .. ':' .. ARGV[1])
+return seq
+""")
+
+# Takes a lock and its fencing token in one atomic step, so tokens follow the order in which
+# the lock was acquired. Returns the token, or nil if the lock is held
+_ACQUIRE_LOCK_SCRIPT = redis_client.register_script("""
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return redis.call('INCR', KEYS[2])
+end
+return false
+""")
+
+# Deletes / extends a lock only while it still holds the caller's token
+_RELEASE_LOCK_SCRIPT = redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+_EXTEND_LOCK_SCRIPT = redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+""")
+
+# Token buckets refilled continuously at capacity per minute, checked and debited together.
+# ARGV holds (capacity, cost) per bucket, then the mode: 0 peeks, 1 takes the cost only if
+# every bucket can pay it, 2 always takes it (used to settle estimates, may go negative).
+# Returns the milliseconds until every bucket could pay, followed by each bucket's level.
+_TOKEN_BUCKET_SCRIPT = redis_client.register_script("""
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local mode = tonumber(ARGV[#ARGV])
+local levels = {}
+local wait = 0
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local cost = math.min(tonumber(ARGV[2 * i]), capacity)
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * capacity / 60000)
+    levels[i] = tokens
+    if cost > tokens then
+        wait = math.max(wait, (cost - tokens) * 60000 / capacity)
+    end
+end
+if mode == 2 or (mode == 1 and wait == 0) then
+    for i = 1, #KEYS do
+        levels[i] = levels[i] - tonumber(ARGV[2 * i])
+        redis.call('HSET', KEYS[i], 'tokens', tostring(levels[i]), 'ts', now)
+        redis.call('PEXPIRE', KEYS[i], 120000)
+    end
+end
+local result = {math.ceil(wait)}
+for i = 1, #KEYS do
+    result[i + 1] = tostring(levels[i])
+end
+return result
+""")
 
 def get_cache(key: str) -> Optional[Any]:
     """Get a value from Redis cache, handling serialization."""
@@ -61,6 +155,38 @@ def set_cache(key: str, value: Any, ttl: int = DEFAULT_CACHE_TTL) -> bool:
         logger.error(f"Unexpected error setting cache for key {key}: {str(e)}", exc_info=True)
         return False
 
+def get_many_cache(keys: List[str]) -> List[Optional[Any]]:
+    """Get several values from Redis cache in one round trip, with None for every miss."""
+    if not keys:
+        return []
+    try:
+        values = redis_client.mget(keys)
+    except redis.RedisError as e:
+        logger.error(f"Redis mget error for {len(keys)} keys: {str(e)}", exc_info=True)
+        return [None] * len(keys)
+    results = []
+    for key, data in zip(keys, values):
+        try:
+            results.append(pickle.loads(data) if data else None)
+        except pickle.UnpicklingError:
+            logger.error(f"Failed to unpickle data for key {key}")
+            results.append(None)
+    return results
+
+def set_many_cache(mapping: Dict[str, Any], ttl: int = DEFAULT_CACHE_TTL) -> bool:
+    """Set several values in Redis cache with one TTL in a single round trip."""
+    if not mapping:
+        return True
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.setex(key, ttl, pickle.dumps(value))
+        pipe.execute()
+        return True
+    except (redis.RedisError, pickle.PicklingError) as e:
+        logger.error(f"Redis pipelined set error for {len(mapping)} keys: {str(e)}", exc_info=True)
+        return False
+
 def delete_cache(key: str) -> bool:
     """Delete a key from Redis cache."""
     try:
@@ -69,6 +195,254 @@ def delete_cache(key: str) -> bool:
         logger.error(f"Redis delete error for key {key}: {str(e)}", exc_info=True)
         return False
 
+def set_cache_if_absent(key: str, value: Any, ttl: int = DEFAULT_CACHE_TTL) -> bool:
+    """Atomically set a value only if the key does not exist yet. Returns True if it was set."""
+    try:
+        serialized = pickle.dumps(value)
+        return bool(redis_client.set(key, serialized, ex=ttl, nx=True))
+    except (redis.RedisError, pickle.PicklingError) as e:
+        logger.error(f"Redis set-if-absent error for key {key}: {str(e)}", exc_info=True)
+        return False
+
+def set_hash_field(key: str, field: str, value: Any, ttl: int = DEFAULT_CACHE_TTL) -> bool:
+    """Set one field of a Redis hash and refresh the hash TTL, handling serialization."""
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(key, field, pickle.dumps(value))
+        pipe.expire(key, ttl)
+        pipe.execute()
+        return True
+    except (redis.RedisError, pickle.PicklingError) as e:
+        logger.error(f"Redis hset error for key {key}: {str(e)}", exc_info=True)
+        return False
+
+def get_hash(key: str) -> Dict[str, Any]:
+    """Get all fields of a Redis hash, handling deserialization."""
+    try:
+        data = redis_client.hgetall(key)
+        return {
+            field.decode() if isinstance(field, bytes) else field: pickle.loads(value)
+            for field, value in data.items()
+        }
+    except (redis.RedisError, pickle.UnpicklingError) as e:
+        logger.error(f"Redis hgetall error for key {key}: {str(e)}", exc_info=True)
+        return {}
+
+# Async variants for FastAPI handlers, on the redis.asyncio pool, so a slow Redis call
+# only suspends the request that made it
+
+async def aget_cache(key: str) -> Optional[Any]:
+    """Async get_cache."""
+    try:
+        data = await async_redis_client.get(key)
+        return pickle.loads(data) if data else None
+    except pickle.UnpicklingError:
+        logger.error(f"Failed to unpickle data for key {key}")
+        return None
+    except redis.RedisError as e:
+        logger.error(f"Redis get error for key {key}: {str(e)}", exc_info=True)
+        return None
+
+async def aset_cache(key: str, value: Any, ttl: int = DEFAULT_CACHE_TTL) -> bool:
+    """Async set_cache."""
+    try:
+        return bool(await async_redis_client.setex(key, ttl, pickle.dumps(value)))
+    except (redis.RedisError, pickle.PicklingError) as e:
+        logger.error(f"Redis set error for key {key}: {str(e)}", exc_info=True)
+        return False
+
+async def adelete_cache(key: str) -> bool:
+    """Async delete_cache."""
+    try:
+        return await async_redis_client.delete(key) > 0
+    except redis.RedisError as e:
+        logger.error(f"Redis delete error for key {key}: {str(e)}", exc_info=True)
+        return False
+
+async def aflush_pattern(pattern: str) -> int:
+    """Async flush_pattern; iterates with SCAN so Redis is never blocked by KEYS."""
+    try:
+        keys = [key async for key in async_redis_client.scan_iter(match=pattern, count=500)]
+        return await async_redis_client.delete(*keys) if keys else 0
+    except redis.RedisError as e:
+        logger.error(f"Redis flush error for pattern {pattern}: {str(e)}", exc_info=True)
+        return 0
+
+def publish_event(channel: str, event: Dict[str, Any], history_ttl: int = EVENT_HISTORY_TTL) -> Optional[int]:
+    """
+    Publish a JSON event on a pub/sub channel and append it to the channel's history list
+    (`{channel}:history`) so late subscribers can replay it. Published messages have the
+    form `<seq>:<json>`. Returns the event's sequence number, or None on failure.
+    """
+    try:
+        payload = json.dumps(event, default=str)
+        return int(_PUBLISH_EVENT_SCRIPT(keys=[f"{channel}:history", channel], args=[payload, history_ttl]))
+    except (redis.RedisError, TypeError, ValueError) as e:
+        logger.error(f"Redis publish error for channel {channel}: {str(e)}", exc_info=True)
+        return None
+
+class RedisLock:
+    """
+    Distributed lock backed by a single Redis key.
+
+    Acquired with SET NX PX and a unique token, released with a Lua compare-and-delete
+    so a holder whose lease expired can never delete a lock that another worker has
+    since acquired. The same script that sets the key takes a monotonically increasing
+    fencing token from the counter shared by all locks (LOCK_FENCE_KEY), which callers
+    can attach to their writes so results from a stale holder can be recognized and
+    discarded.
+
+    With auto_renew=True a background thread extends the lease every third of its TTL
+    for as long as the lock is held, so long tasks can use a short lease. If an
+    extension fails the lock is marked as lost.
+
+        with RedisLock("meal_generation_lock:abc", ttl_ms=120000, auto_renew=True) as lock:
+            if lock.acquired:
+                ...
+    """
+
+    def __init__(self, name: str, ttl_ms: int = 60000, auto_renew: bool = False):
+        self.name = name
+        self.ttl_ms = ttl_ms
+        self.auto_renew = auto_renew
+        self.token = uuid.uuid4().hex
+        self.fencing_token: Optional[int] = None
+        self.acquired = False
+        self.lost = False
+        self._stop_renewal = threading.Event()
+        self._renewal_thread: Optional[threading.Thread] = None
+
+    def acquire(self) -> bool:
+        """Try to take the lock without blocking. Returns True if it was acquired."""
+        try:
+            fencing_token = _ACQUIRE_LOCK_SCRIPT(keys=[self.name, LOCK_FENCE_KEY], args=[self.token, self.ttl_ms])
+        except redis.RedisError as e:
+            logger.error(f"Redis lock acquire error for {self.name}: {str(e)}", exc_info=True)
+            return False
+        if fencing_token is None:
+            return False
+
+        self.fencing_token = int(fencing_token)
+        self.acquired = True
+        self.lost = False
+        if self.auto_renew:
+            self._stop_renewal.clear()
+            self._renewal_thread = threading.Thread(
+                target=self._renew, name=f"lock-renewal:{self.name}", daemon=True
+            )
+            self._renewal_thread.start()
+        return True
+
+    def extend(self, ttl_ms: Optional[int] = None) -> bool:
+        """Reset the lease to ttl_ms if the lock is still held by this instance. Returns False if it was lost."""
+        if not self.acquired:
+            return False
+        try:
+            extended = bool(_EXTEND_LOCK_SCRIPT(keys=[self.name], args=[self.token, ttl_ms or self.ttl_ms]))
+        except redis.RedisError as e:
+            logger.error(f"Redis lock extend error for {self.name}: {str(e)}", exc_info=True)
+            return False
+        if not extended:
+            self.lost = True
+            logger.warning(f"Lock {self.name} was lost before it could be extended")
+        return extended
+
+    def release(self) -> bool:
+        """Release the lock if this instance still holds it. Returns True if it was deleted."""
+        self._stop_renewal.set()
+        if not self.acquired:
+            return False
+        self.acquired = False
+        try:
+            return bool(_RELEASE_LOCK_SCRIPT(keys=[self.name], args=[self.token]))
+        except redis.RedisError as e:
+            logger.error(f"Redis lock release error for {self.name}: {str(e)}", exc_info=True)
+            return False
+
+    def _renew(self) -> None:
+        interval = self.ttl_ms / 3000.0
+        while not self._stop_renewal.wait(interval):
+            if not self.extend():
+                return
+
+    def __enter__(self) -> "RedisLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.release()
+
+class RateLimiter:
+    """
+    Cluster-wide requests-per-minute and tokens-per-minute limiter.
+
+    Each budget is a token bucket in Redis holding at most one minute of capacity and
+    refilling continuously, so every process shares it and short bursts are absorbed.
+    A call takes one request and its estimated token count from both buckets in one
+    atomic step, or neither if either is short. Once the real token count is known,
+    settle() corrects the estimate. A limit of 0 disables that budget. If Redis is
+    unavailable the limiter lets calls through.
+
+        limiter = RateLimiter("llm_rate", requests_per_minute=1000, tokens_per_minute=1000000)
+        if limiter.acquire(tokens=1500, max_wait=30) == 0:
+            ...
+    """
+
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int):
+        self.name = name
+        self.buckets = [
+            (f"{name}:{budget}", limit)
+            for budget, limit in (("requests", requests_per_minute), ("tokens", tokens_per_minute))
+            if limit > 0
+        ]
+
+    def _call(self, requests: float, tokens: float, mode: int) -> Tuple[float, List[float]]:
+        if not self.buckets:
+            return 0.0, []
+        costs = {f"{self.name}:requests": requests, f"{self.name}:tokens": tokens}
+        args = []
+        for key, limit in self.buckets:
+            args += [limit, costs[key]]
+        try:
+            result = _TOKEN_BUCKET_SCRIPT(keys=[key for key, _ in self.buckets], args=args + [mode])
+        except redis.RedisError as e:
+            logger.error(f"Redis rate limiter error for {self.name}: {str(e)}", exc_info=True)
+            return 0.0, []
+        return int(result[0]) / 1000.0, [float(level) for level in result[1:]]
+
+    def try_acquire(self, tokens: float = 0) -> float:
+        """Takes one request and `tokens` if both are available. Returns 0, or the seconds to wait before retrying."""
+        wait, _ = self._call(1, tokens, 1)
+        return wait
+
+    def acquire(self, tokens: float = 0, max_wait: float = 30) -> float:
+        """
+        Blocks until one request and `tokens` are taken. Returns 0 once they are, or the
+        remaining wait without waiting further if it would exceed `max_wait` seconds in total.
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return 0.0
+            if time.monotonic() + wait > deadline:
+                return wait
+            # Spread waiters out so they don't all retry at the same instant
+            time.sleep(wait * random.uniform(1.0, 1.2))
+
+    def settle(self, tokens: float) -> None:
+        """Takes (or, if negative, returns) tokens to correct an estimate once the actual usage is known."""
+        if tokens:
+            self._call(0, tokens, 2)
+
+    def available(self) -> Dict[str, float]:
+        """Current level of each enabled budget, e.g. {"requests": 812.5, "tokens": 640000.0}."""
+        _, levels = self._call(0, 0, 0)
+        return {key.rsplit(":", 1)[1]: level for (key, _), level in zip(self.buckets, levels)}
+
+    def limits(self) -> Dict[str, int]:
+        return {key.rsplit(":", 1)[1]: limit for key, limit in self.buckets}
+
 def flush_pattern(pattern: str) -> int:
     """Delete all keys matching a pattern."""
     try:
@@ -86,4 +460,28 @@ def health_check() -> bool:
         return redis_client.ping()
     except redis.RedisError as e:
         logger.error(f"Redis health check failed: {str(e)}", exc_info=True)
-        return False
\ No newline at end of file
+        return False
+
+def get_redis_pool_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Connection counts of this process's Redis pools. redis-py has no public API for them,
+    so they are read from the pools' internals; if those differ (another redis-py
+    version), only the pool size is reported.
+    """
+    sync_stats: Dict[str, int] = {"max_pool_size": redis_pool.max_connections}
+    async_stats: Dict[str, int] = {"max_pool_size": async_redis_pool.max_connections}
+    try:
+        # The blocking pool's queue holds idle connections plus None for slots not connected yet
+        idle = sum(1 for connection in list(redis_pool.pool.queue) if connection is not None)
+        created = len(redis_pool._connections)
+        sync_stats.update(open=created, in_use=created - idle)
+    except (AttributeError, TypeError) as e:
+        logger.debug(f"Redis pool internals unavailable: {str(e)}")
+    try:
+        async_stats.update(
+            open=async_redis_pool._created_connections,
+            in_use=len(async_redis_pool._in_use_connections),
+        )
+    except (AttributeError, TypeError) as e:
+        logger.debug(f"Async Redis pool internals unavailable: {str(e)}")
+    return {"sync": sync_stats, "async": async_stats}
@@ -1,19 +1,36 @@
-from app.utils.celery_config import celery_app
+from app.utils.celery_config import celery_app, GENERATION_PRIORITY_BACKGROUND
+from celery.exceptions import Retry
 import logging
-import google.generativeai as genai
 import datetime
 import os
 import json
+import math
 import random
 import re
-from pymongo import MongoClient
+from pymongo import InsertOne, UpdateOne, UpdateMany
 from vertexai.preview.vision_models import ImageGenerationModel
 from vertexai import init as vertex_init
 from google.oauth2 import service_account
 import tempfile
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from google.cloud import storage
-from app.utils.redis_client import get_cache, set_cache, delete_cache, MEAL_CACHE_TTL
+from app.utils.llm_json import parse_llm_json, json_generation_config, MEAL_LIST_SCHEMA
+from app.utils.llm import generate, LLMRateLimited, add_llm_backlog, complete_llm_backlog, clear_llm_backlog
+from app.utils.db import collection
+from app.utils.usda_client import fetch_many_ingredient_macros
+from app.utils.portion_solver import adjust_meal_portions
+from app.utils.quantity_parser import to_grams
+from app.utils.meal_index import get_meal_index, reuse_meals_for_slots, request_meals_filter, MEAL_REUSE_ENABLED
+from app.utils.plan_assembler import meal_type_targets
+from app.utils.plan_requests import SHAPE_FIELDS, meal_counts_for, top_request_shapes, decay_request_shapes
+from app.utils.meal_plan_events import (
+    publish_meal_plan_event, format_meal_event, reset_meal_plan_events,
+    MEAL_GENERATED, MEAL_SAVED, MEAL_IMAGE, MEAL_IMAGE_FAILED, PLAN_STARTED, PLAN_QUEUED, PLAN_READY, PLAN_FAILED
+)
+from app.utils.redis_client import (
+    get_cache, set_cache, get_many_cache, set_many_cache, delete_cache, set_cache_if_absent, set_hash_field, get_hash, MEAL_CACHE_TTL, RedisLock
+)
 
 
 # Configure logging
@@ -23,11 +40,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# MongoDB connection (synchronous for Celery tasks)
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["grovli"]
-chat_collection = db["chat_sessions"]
-meals_collection = db["meals"]
+# MongoDB collections (synchronous for Celery tasks)
+chat_collection = collection("chat_sessions")
+meals_collection = collection("meals")
+user_settings_collection = collection("user_settings")
 
 # Initialize Google Cloud credentials if provided
 credentials_json = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
@@ -52,6 +68,36 @@ if credentials_json:
     except Exception as e:
         logger.error(f"Error initializing Google Cloud credentials: {str(e)}")
 
+# Maximum number of meal slots generated concurrently within a single meal plan task
+MEAL_GENERATION_CONCURRENCY = int(os.getenv("MEAL_GENERATION_CONCURRENCY", "8"))
+
+# "single" sends one prompt per meal slot, "batched" asks for up to MEAL_BATCH_SIZE meals
+# of the same type and macro target per prompt and re-requests only the slots that fail
+MEAL_GENERATION_MODE = os.getenv("MEAL_GENERATION_MODE", "single").lower()
+MEAL_BATCH_SIZE = max(1, int(os.getenv("MEAL_BATCH_SIZE", "4")))
+
+# Lease of the per-request generation lock; it is renewed in the background while generation runs
+MEAL_GENERATION_LOCK_TTL_MS = int(os.getenv("MEAL_GENERATION_LOCK_TTL_MS", "120000"))
+
+# How long an in-flight generation absorbs identical requests if it never reports back
+INFLIGHT_GENERATION_TTL = int(os.getenv("INFLIGHT_GENERATION_TTL", "900"))
+
+# Meal prompts are answered in JSON mode, constrained to the meal list schema
+MEAL_JSON_CONFIG = json_generation_config(MEAL_LIST_SCHEMA)
+
+# How often a plan is requeued while the shared Gemini quota is exhausted before it is failed
+MEAL_PLAN_MAX_REQUEUES = int(os.getenv("MEAL_PLAN_MAX_REQUEUES", "5"))
+
+# Off-peak pre-generation of the most requested plan shapes (see prewarm_popular_plans)
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", "20"))
+PREWARM_MIN_REQUESTS = float(os.getenv("PREWARM_MIN_REQUESTS", "3"))
+# Gemini tokens a run may spend on new plans, and the estimated cost of generating one meal
+PREWARM_TOKEN_BUDGET = int(os.getenv("PREWARM_TOKEN_BUDGET", "100000"))
+PREWARM_TOKENS_PER_MEAL = int(os.getenv("PREWARM_TOKENS_PER_MEAL", "1500"))
+# Share of each shape's request count carried over to the next run
+PREWARM_POPULARITY_DECAY = float(os.getenv("PREWARM_POPULARITY_DECAY", "0.5"))
+# Prewarmed plans outlive the daily run so they never expire just before being refreshed
+PREWARMED_PLAN_TTL = 2 * MEAL_CACHE_TTL
 
 import hashlib
 
@@ -75,8 +121,6 @@ def generate_chat_response(session_id, dietary_preferences, meal_type, existing_
             logger.error("GEMINI_API_KEY environment variable not set")
             return {"status": "error", "message": "API key not set"}
 
-        genai.configure(api_key=gemini_api_key)
-        
         # Prepare context based on latest message
         latest_message = next((msg for msg in reversed(existing_messages) 
                              if msg["role"] == "user"), None)
@@ -109,8 +153,8 @@ def generate_chat_response(session_id, dietary_preferences, meal_type, existing_
                 if cached_settings and cached_settings.get("dietaryPhilosophy"):
                     user_dietary_philosophy = cached_settings.get("dietaryPhilosophy")
                 else:
-                    # If not in Redis, check MongoDB using the db connection that's already available
-                    user_settings = db["user_settings"].find_one({"user_id": user_id})
+                    # If not in Redis, check MongoDB
+                    user_settings = user_settings_collection.find_one({"user_id": user_id})
                     if user_settings and user_settings.get("dietaryPhilosophy"):
                         user_dietary_philosophy = user_settings.get("dietaryPhilosophy")
             except Exception as e:
@@ -124,10 +168,6 @@ def generate_chat_response(session_id, dietary_preferences, meal_type, existing_
             else:
                 combined_preferences = user_dietary_philosophy
         
-        # Create fresh model instance
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        chat = model.start_chat(history=conversation_history)
-        
         # Create nutrition context
         nutrition_context = f"""
         You are a nutrition assistant chatting with a user while their {meal_type} meal plan generates.
@@ -144,7 +184,9 @@ def generate_chat_response(session_id, dietary_preferences, meal_type, existing_
 
         # Generate response
         try:
-            response = chat.send_message(nutrition_context)
+            response = generate(
+                conversation_history + [{"role": "user", "parts": [nutrition_context]}], caller="chat_response"
+            )
             
             assistant_message = {
                 "role": "assistant",
@@ -172,8 +214,241 @@ def generate_chat_response(session_id, dietary_preferences, meal_type, existing_
 
 # ===================== MEAL PLAN TASKS =====================
 
-@celery_app.task(name="generate_meal_plan")
+def build_meal_prompt(current_meal_type, macros, dietary_preferences, meal_plan_id, meal_algorithm, pantry_ingredients, count=1):
+    """
+    Builds the Gemini prompt for generating `count` meals of the given type and macro target.
+    With count > 1 the static instruction block is sent once for the whole batch.
+    """
+    # Create base prompt with enhanced emphasis on macro accuracy
+    if count == 1:
+        prompt = f"""
+    Generate EXACTLY 1 complete, **single-serving** {current_meal_type.lower()} meal for a {dietary_preferences} diet.
+    The meal **must have exactly** {macros['calories']} kcal AND precisely match the following macronutrient targets:"""
+    else:
+        prompt = f"""
+    Generate EXACTLY {count} different, complete, **single-serving** {current_meal_type.lower()} meals for a {dietary_preferences} diet.
+    Every meal must be a distinct recipe with its own title. Return all {count} meals together in ONE JSON array.
+    EACH meal **must have exactly** {macros['calories']} kcal AND precisely match the following macronutrient targets:"""
+
+    prompt += f"""
+    - Protein: {macros['protein']}g (±1g)
+    - Carbs: {macros['carbs']}g (±1g)
+    - Fat: {macros['fat']}g (±1g)
+    - Fiber: {macros['fiber']}g (±1g)
+    - Sugar: {macros['sugar']}g (±1g)
+    
+    Prioritize recipes inspired by **Food & Wine, Bon Appétit, and Serious Eats**. Create an authentic, realistic recipe
+    that could appear in these publications, with proper culinary techniques and flavor combinations.
+    """
+
+    # Add a clear instruction about macro accuracy
+    prompt += f"""
+    ### **CRITICAL REQUIREMENT FOR MACRO ACCURACY**:
+    1. You MUST calculate the macros for EACH ingredient separately and ensure they add up to the exact target values
+    2. Adjust ingredient portions precisely to achieve the macro targets
+    3. Every macro value (protein, carbs, fat, fiber, sugar) must be within ±1g of the target
+    4. Calories must be within ±5 kcal of the target
+    5. DO NOT compromise nutrition accuracy for recipe simplicity
+    """
+
+    if meal_algorithm == "pantry" and pantry_ingredients:
+        pantry_ingredients_text = ", ".join(pantry_ingredients[:30])  # Limit to 30 ingredients to avoid token issues
+        prompt += f"""
+        **IMPORTANT: Prioritize using ingredients from the user's pantry.**
+        
+        Available pantry ingredients: {pantry_ingredients_text}
+        
+        This meal should use as many of these pantry ingredients as possible, but may include some additional ingredients 
+        if necessary for a complete meal. The recipe should seem designed to make use of what's available.
+        """
+    
+    prompt += f"""
+    The meal must be balanced and meet these nutritional targets:
+    - Be **a single-serving portion**, accurately scaled
+    - Include **all** ingredients needed for **one serving** (oils, spices, pantry staples)
+    - Match these **macros** (±1% of target values):
+    • Calories: {macros['calories']} kcal
+    • Protein: {macros['protein']} g
+    • Carbs: {macros['carbs']} g
+    • Fat: {macros['fat']} g
+    • Fiber: {macros['fiber']} g
+    • Sugar: {macros['sugar']} g
+    
+    ### **Mandatory Requirements**:
+    1. **The meal must be a {current_meal_type} meal**
+    2. **All portions must be for a single serving** (e.g., "6 oz chicken," not "2 lbs chicken")
+    3. **Each ingredient must list exact quantities** (e.g., "1 tbsp olive oil," not "olive oil")
+    4. **Calculate macros per ingredient and ensure total macros match per serving**
+    5. **List all essential ingredients** (cooking fats, seasonings, and garnishes)
+    6. **Validate meal totals against individual ingredient macros**
+    7. **The meal must use** meal_plan_id: `{meal_plan_id}`
+    8. **The recipe must feel like an authentic recipe from Food & Wine, Bon Appétit, or Serious Eats**
+    ---
+    ### **Instructions Formatting Requirements**:
+    - **Each instruction step must be detailed, clear, and structured for ease of use**
+    - **Use precise cooking techniques** (e.g., "sear over medium-high heat for 3 minutes per side until golden brown")
+    - **Include prep instructions** (e.g., "Finely mince garlic," "Dice bell peppers into ½-inch cubes")
+    - **Specify temperatures, times, and sensory indicators** (e.g., "Roast at 400°F for 20 minutes until caramelized")
+    - **Use line breaks for readability**
+    - **Include plating instructions** (e.g., "Transfer to a warm plate, drizzle with sauce, and garnish with fresh herbs")
+    ---
+    ### **Strict JSON Formatting Requirements**:
+    - Escape all double quotes inside strings with a backslash (e.g., \\"example\\")
+    - Represent newlines in instructions as \\n
+    - Ensure all strings use double quotes
+    - No trailing commas in JSON arrays/objects
+    ### **Example Response Format**:
+    ```json
+    [
+    {{
+    "title": "Herb-Roasted Chicken with Vegetables",
+    "meal_type": "{current_meal_type}",
+    "meal_plan_id": "{meal_plan_id}",
+    "nutrition": {{
+    "calories": {macros['calories']},
+    "protein": {macros['protein']},
+    "carbs": {macros['carbs']},
+    "fat": {macros['fat']},
+    "fiber": {macros['fiber']},
+    "sugar": {macros['sugar']}
+    }},
+    "ingredients": [
+    {{
+    "name": "Boneless chicken breast",
+    "quantity": "6 oz",
+    "macros": {{
+    "calories": 280,
+    "protein": 38,
+    "carbs": 0,
+    "fat": 12,
+    "fiber": 0,
+    "sugar": 0
+    }}
+    }}
+    ],
+    "instructions": "### **Step 1: Prepare Ingredients**\\n..."
+    }}
+    ]
+    ```
+    **Strictly return only JSON with no extra text.**
+    """
+
+    if count > 1:
+        prompt += f"""
+    The JSON array must contain EXACTLY {count} meal objects in the format above, one per distinct recipe.
+    """
+    return prompt
+
+def generate_single_meal(i, current_meal_type, macros, request_hash, dietary_preferences, meal_plan_id, meal_algorithm, pantry_ingredients):
+    """
+    Generates the meal for slot `i` of a meal plan, honoring the per-slot
+    `meal_prompt:{type}:{hash}:{i}` cache. Returns the list of generated meals
+    for the slot, or None if generation failed.
+    """
+    # Create a cache key for this specific meal
+    single_meal_cache_key = f"meal_prompt:{current_meal_type}:{request_hash}:{i}"
+    cached_meal = get_cache(single_meal_cache_key)
+    
+    if cached_meal:
+        logger.info(f"Using cached meal {i+1} of type {current_meal_type}")
+        return cached_meal
+    
+    prompt = build_meal_prompt(
+        current_meal_type, macros, dietary_preferences, meal_plan_id, meal_algorithm, pantry_ingredients
+    )
+
+    try:
+        # Use Google Gemini to generate a single meal
+        response = generate(prompt, caller="meal_generation", generation_config=MEAL_JSON_CONFIG)
+
+        single_meal = parse_llm_json(response.text, expect=list)
+        if not single_meal or not all(is_valid_generated_meal(meal) for meal in single_meal):
+            raise ValueError(f"AI response for {current_meal_type} meal {i+1} is not a valid meal list.")
+        
+        # Ensure the meal has the correct type; portions are adjusted for the whole plan at once
+        for meal in single_meal:
+            meal["meal_type"] = current_meal_type
+        
+        # Cache this individual meal
+        set_cache(single_meal_cache_key, single_meal, MEAL_CACHE_TTL)
+        logger.info(f"Generated and cached meal {i+1} of type {current_meal_type}")
+        
+        return single_meal
+        
+    except LLMRateLimited:
+        # Left to the plan task, which requeues itself instead of dropping the meal
+        raise
+    except Exception as e:
+        logger.error(f"⚠️ Error generating meal {i+1} of type {current_meal_type}: {str(e)}")
+        return None
+
+def is_valid_generated_meal(meal):
+    """Checks that a generated meal has the fields required to save it."""
+    return (
+        isinstance(meal, dict)
+        and isinstance(meal.get("title"), str) and meal["title"].strip() != ""
+        and isinstance(meal.get("ingredients"), list) and len(meal["ingredients"]) > 0
+        and isinstance(meal.get("instructions"), str)
+        and isinstance(meal.get("nutrition"), dict)
+    )
+
+def generate_meal_batch(slot_indices, current_meal_type, macros, request_hash, dietary_preferences, meal_plan_id, meal_algorithm, pantry_ingredients):
+    """
+    Generates the meals for several slots of the same type and macro target with one Gemini call.
+    Each returned meal is validated on its own and cached under its slot's
+    `meal_prompt:{type}:{hash}:{i}` key. Returns a dict of slot index -> list of meals,
+    with None for every slot that still needs to be re-requested.
+    """
+    results = {}
+    pending_slots = []
+    for i in slot_indices:
+        cached_meal = get_cache(f"meal_prompt:{current_meal_type}:{request_hash}:{i}")
+        if cached_meal:
+            logger.info(f"Using cached meal {i+1} of type {current_meal_type}")
+            results[i] = cached_meal
+        else:
+            pending_slots.append(i)
+
+    if not pending_slots:
+        return results
+
+    prompt = build_meal_prompt(
+        current_meal_type, macros, dietary_preferences, meal_plan_id, meal_algorithm, pantry_ingredients,
+        count=len(pending_slots)
+    )
+
+    generated_meals = []
+    try:
+        response = generate(prompt, caller="meal_batch_generation", generation_config=MEAL_JSON_CONFIG)
+
+        generated_meals = parse_llm_json(response.text, expect=list)
+        if not isinstance(generated_meals, list):
+            raise ValueError(f"AI response for {current_meal_type} batch is not a valid list.")
+    except LLMRateLimited:
+        raise
+    except Exception as e:
+        logger.error(f"⚠️ Error generating batch of {len(pending_slots)} {current_meal_type} meals: {str(e)}")
+        generated_meals = []
+
+    # Hand out valid meals to slots in order; anything missing or malformed is left for a retry
+    valid_meals = [meal for meal in generated_meals if is_valid_generated_meal(meal)]
+    for i in pending_slots:
+        if not valid_meals:
+            results[i] = None
+            continue
+        meal = valid_meals.pop(0)
+        meal["meal_type"] = current_meal_type
+        slot_meal = [meal]
+        set_cache(f"meal_prompt:{current_meal_type}:{request_hash}:{i}", slot_meal, MEAL_CACHE_TTL)
+        results[i] = slot_meal
+
+    failed_count = sum(1 for i in pending_slots if results[i] is None)
+    logger.info(f"Generated batch of {len(pending_slots) - failed_count}/{len(pending_slots)} {current_meal_type} meals")
+    return results
+
+@celery_app.task(name="generate_meal_plan", bind=True, max_retries=MEAL_PLAN_MAX_REQUEUES)
 def generate_meal_plan(
+    self,
     request_dict, 
     user_id, 
     meal_counts, 
@@ -182,18 +457,18 @@ def generate_meal_plan(
     request_hash
 ):
     """Celery task to generate a meal plan without blocking the main thread."""
+    requeued = False
     try:
         logger.info(f"Starting background meal plan generation for user: {user_id}")
         
         # Add a lock to prevent multiple workers from generating the same meal plan
-        generation_lock_key = f"meal_generation_lock:{request_hash}"
+        generation_lock = RedisLock(
+            f"meal_generation_lock:{request_hash}", ttl_ms=MEAL_GENERATION_LOCK_TTL_MS, auto_renew=True
+        )
         
         # Try to acquire the lock
-        lock_acquired = False
-        if not get_cache(generation_lock_key):
-            set_cache(generation_lock_key, True, 600)  # 10-minute lock
-            lock_acquired = True
-            logger.info(f"Acquired generation lock for meal plan: {request_hash}")
+        if generation_lock.acquire():
+            logger.info(f"Acquired generation lock for meal plan: {request_hash} (fencing token {generation_lock.fencing_token})")
         else:
             logger.info(f"Another worker is already generating meal plan: {request_hash}, skipping")
             return {"status": "skipped", "message": "Another worker is handling this generation"}
@@ -215,9 +490,8 @@ def generate_meal_plan(
         if not gemini_api_key:
             logger.error("GEMINI_API_KEY environment variable is not set")
             return {"status": "error", "message": "API key not set"}
-        
-        # Initialize Gemini API with the key
-        genai.configure(api_key=gemini_api_key)
+
+        publish_meal_plan_event(meal_plan_id, PLAN_STARTED, {"total_meals": total_meals_needed})
         
         # Get session_id before intensive processing
         session_id = None
@@ -244,124 +518,16 @@ def generate_meal_plan(
         except Exception as e:
             logger.error(f"Error getting session_id: {str(e)}")
         
-        # Calculate the macronutrient distribution per meal type
-        meal_type_calorie_ratio = {
-            "Breakfast": 0.25,  # 25% of daily calories
-            "Lunch": 0.30,      # 30% of daily calories
-            "Dinner": 0.35,     # 35% of daily calories
-            "Snack": 0.10       # 10% of daily calories per snack
+        # Per-meal macro targets of each meal type, the same ones the instant plan path uses
+        requested_macros = {"calories": calories, "protein": protein, "carbs": carbs, "fat": fat, "fiber": fiber, "sugar": sugar}
+        meal_macros = {
+            m_type: {key: int(value) for key, value in meal_type_targets(requested_macros, m_type, count).items()}
+            for m_type, count in meal_counts.items() if count > 0
         }
 
-        # Prepare the meal macros for each type of meal
-        if meal_type != "Full Day":
-            ratio = meal_type_calorie_ratio.get(meal_type, 0)
-            # For a single meal type, the macros are the same for each meal
-            per_meal_macros = {
-                "calories": int(calories * ratio / meal_counts[meal_type]),
-                "protein": int(protein * ratio / meal_counts[meal_type]),
-                "carbs": int(carbs * ratio / meal_counts[meal_type]),
-                "fat": int(fat * ratio / meal_counts[meal_type]),
-                "fiber": int(fiber * ratio / meal_counts[meal_type]),
-                "sugar": int(sugar * ratio / meal_counts[meal_type])
-            }
-            meal_macros = {meal_type: per_meal_macros}
-        else:
-            # For "Full Day" meal type, distribute macros proportionally
-            meal_macros = {}
-            for m_type, ratio in meal_type_calorie_ratio.items():
-                count = meal_counts.get(m_type, 0)
-                if count > 0:
-                    per_meal_macros = {
-                        "calories": int(calories * ratio / count),
-                        "protein": int(protein * ratio / count),
-                        "carbs": int(carbs * ratio / count),
-                        "fat": int(fat * ratio / count),
-                        "fiber": int(fiber * ratio / count),
-                        "sugar": int(sugar * ratio / count)
-                    }
-                    meal_macros[m_type] = per_meal_macros
-
-        # Check if we already have a cached response
+        # Check if we already have the complete set of meals cached
         prompt_cache_key = f"meal_prompt:{request_hash}"
         cached_response = get_cache(prompt_cache_key)
-        if cached_response:
-            logger.info(f"Found partial cache with {len(cached_response)}/{total_meals_needed} meals - generating remaining meals")
-            all_generated_meals = cached_response.copy()
-        else:
-            # Generate meals ONE AT A TIME instead of in batches
-            all_generated_meals = []
-            
-        # Function for validating and adjusting macros
-        def validate_and_adjust_macros(meal, target_macros):
-            """
-            Validates if the meal's macros match target macros and adjusts portions if needed.
-            Returns the adjusted meal with corrected portions and macros.
-            """
-            # Extract current meal macros
-            current_macros = meal.get("nutrition", {})
-            
-            # Check if we need to adjust (macro values are off by more than the allowed tolerance)
-            needs_adjustment = (
-                abs(current_macros.get("calories", 0) - target_macros.get("calories", 0)) > 5 or
-                abs(current_macros.get("protein", 0) - target_macros.get("protein", 0)) > 1 or
-                abs(current_macros.get("carbs", 0) - target_macros.get("carbs", 0)) > 1 or
-                abs(current_macros.get("fat", 0) - target_macros.get("fat", 0)) > 1 or
-                abs(current_macros.get("fiber", 0) - target_macros.get("fiber", 0)) > 1 or
-                abs(current_macros.get("sugar", 0) - target_macros.get("sugar", 0)) > 1
-            )
-            
-            if not needs_adjustment:
-                return meal  # Macros are already accurate
-            
-            # Calculate scaling factor based on calories (primary adjustment factor)
-            calorie_scaling = target_macros.get("calories", 1) / max(current_macros.get("calories", 1), 1)
-            
-            # Create scaled macros
-            adjusted_macros = {
-                "calories": target_macros.get("calories", 0),
-                "protein": target_macros.get("protein", 0),
-                "carbs": target_macros.get("carbs", 0),
-                "fat": target_macros.get("fat", 0),
-                "fiber": target_macros.get("fiber", 0),
-                "sugar": target_macros.get("sugar", 0)
-            }
-            
-            # Adjust ingredient portions proportionally
-            adjusted_ingredients = []
-            for ingredient in meal.get("ingredients", []):
-                if isinstance(ingredient, dict) and "quantity" in ingredient:
-                    # Parse quantity to find the numeric value
-                    quantity_str = ingredient["quantity"]
-                    quantity_match = re.search(r'([\d.]+)', quantity_str)
-                    
-                    if quantity_match:
-                        original_value = float(quantity_match.group(1))
-                        new_value = original_value * calorie_scaling
-                        
-                        # Format back to string, maintaining the original unit
-                        unit_match = re.search(r'[^\d.]+', quantity_str)
-                        unit = unit_match.group(0).strip() if unit_match else ""
-                        
-                        # Update quantity
-                        ingredient["quantity"] = f"{new_value:.1f} {unit}".strip()
-                        
-                        # Update ingredient macros if present
-                        if "macros" in ingredient:
-                            for key in ingredient["macros"]:
-                                ingredient["macros"][key] = round(ingredient["macros"][key] * calorie_scaling, 1)
-                    
-                adjusted_ingredients.append(ingredient)
-            
-            # Update the meal with adjusted values
-            adjusted_meal = meal.copy()
-            adjusted_meal["nutrition"] = adjusted_macros
-            adjusted_meal["ingredients"] = adjusted_ingredients
-            
-            # Add note about adjustment in instructions
-            adjustment_note = "\n\n**Note: Portions have been precisely adjusted to match the nutritional targets.**"
-            adjusted_meal["instructions"] = meal.get("instructions", "") + adjustment_note
-            
-            return adjusted_meal
             
         # Create a structured plan for meal generation
         meal_generation_plan = []
@@ -371,305 +537,174 @@ def generate_meal_plan(
         
         logger.info(f"Meal generation plan: {meal_generation_plan}, total meals needed: {total_meals_needed}")
         
-        # Generate each meal individually
-        for i, current_meal_type in enumerate(meal_generation_plan):
-            # Create a cache key for this specific meal
-            single_meal_cache_key = f"meal_prompt:{current_meal_type}:{request_hash}:{i}"
-            cached_meal = get_cache(single_meal_cache_key)
-            
-            if cached_meal:
-                logger.info(f"Using cached meal {i+1} of type {current_meal_type}")
-                all_generated_meals.extend(cached_meal)
-                continue
-            
-            # Get the macros for this meal type
-            macros = meal_macros[current_meal_type]
-            
-            # Generate a single meal with a modified prompt
-            # Create base prompt with enhanced emphasis on macro accuracy
-            prompt = f"""
-            Generate EXACTLY 1 complete, **single-serving** {current_meal_type.lower()} meal for a {dietary_preferences} diet.
-            The meal **must have exactly** {macros['calories']} kcal AND precisely match the following macronutrient targets:
-            - Protein: {macros['protein']}g (±1g)
-            - Carbs: {macros['carbs']}g (±1g)
-            - Fat: {macros['fat']}g (±1g)
-            - Fiber: {macros['fiber']}g (±1g)
-            - Sugar: {macros['sugar']}g (±1g)
-            
-            Prioritize recipes inspired by **Food & Wine, Bon Appétit, and Serious Eats**. Create an authentic, realistic recipe
-            that could appear in these publications, with proper culinary techniques and flavor combinations.
-            """
-
-            # Add a clear instruction about macro accuracy
-            prompt += f"""
-            ### **CRITICAL REQUIREMENT FOR MACRO ACCURACY**:
-            1. You MUST calculate the macros for EACH ingredient separately and ensure they add up to the exact target values
-            2. Adjust ingredient portions precisely to achieve the macro targets
-            3. Every macro value (protein, carbs, fat, fiber, sugar) must be within ±1g of the target
-            4. Calories must be within ±5 kcal of the target
-            5. DO NOT compromise nutrition accuracy for recipe simplicity
-            """
-
-            if meal_algorithm == "pantry" and pantry_ingredients:
-                pantry_ingredients_text = ", ".join(pantry_ingredients[:30])  # Limit to 30 ingredients to avoid token issues
-                prompt += f"""
-                **IMPORTANT: Prioritize using ingredients from the user's pantry.**
-                
-                Available pantry ingredients: {pantry_ingredients_text}
-                
-                This meal should use as many of these pantry ingredients as possible, but may include some additional ingredients 
-                if necessary for a complete meal. The recipe should seem designed to make use of what's available.
-                """
-            
-            prompt += f"""
-            The meal must be balanced and meet these nutritional targets:
-            - Be **a single-serving portion**, accurately scaled
-            - Include **all** ingredients needed for **one serving** (oils, spices, pantry staples)
-            - Match these **macros** (±1% of target values):
-            • Calories: {macros['calories']} kcal
-            • Protein: {macros['protein']} g
-            • Carbs: {macros['carbs']} g
-            • Fat: {macros['fat']} g
-            • Fiber: {macros['fiber']} g
-            • Sugar: {macros['sugar']} g
-            
-            ### **Mandatory Requirements**:
-            1. **The meal must be a {current_meal_type} meal**
-            2. **All portions must be for a single serving** (e.g., "6 oz chicken," not "2 lbs chicken")
-            3. **Each ingredient must list exact quantities** (e.g., "1 tbsp olive oil," not "olive oil")
-            4. **Calculate macros per ingredient and ensure total macros match per serving**
-            5. **List all essential ingredients** (cooking fats, seasonings, and garnishes)
-            6. **Validate meal totals against individual ingredient macros**
-            7. **The meal must use** meal_plan_id: `{meal_plan_id}`
-            8. **The recipe must feel like an authentic recipe from Food & Wine, Bon Appétit, or Serious Eats**
-            ---
-            ### **Instructions Formatting Requirements**:
-            - **Each instruction step must be detailed, clear, and structured for ease of use**
-            - **Use precise cooking techniques** (e.g., "sear over medium-high heat for 3 minutes per side until golden brown")
-            - **Include prep instructions** (e.g., "Finely mince garlic," "Dice bell peppers into ½-inch cubes")
-            - **Specify temperatures, times, and sensory indicators** (e.g., "Roast at 400°F for 20 minutes until caramelized")
-            - **Use line breaks for readability**
-            - **Include plating instructions** (e.g., "Transfer to a warm plate, drizzle with sauce, and garnish with fresh herbs")
-            ---
-            ### **Strict JSON Formatting Requirements**:
-            - Escape all double quotes inside strings with a backslash (e.g., \\"example\\")
-            - Represent newlines in instructions as \\n
-            - Ensure all strings use double quotes
-            - No trailing commas in JSON arrays/objects
-            ### **Example Response Format**:
-            ```json
-            [
-            {{
-            "title": "Herb-Roasted Chicken with Vegetables",
-            "meal_type": "{current_meal_type}",
-            "meal_plan_id": "{meal_plan_id}",
-            "nutrition": {{
-            "calories": {macros['calories']},
-            "protein": {macros['protein']},
-            "carbs": {macros['carbs']},
-            "fat": {macros['fat']},
-            "fiber": {macros['fiber']},
-            "sugar": {macros['sugar']}
-            }},
-            "ingredients": [
-            {{
-            "name": "Boneless chicken breast",
-            "quantity": "6 oz",
-            "macros": {{
-            "calories": 280,
-            "protein": 38,
-            "carbs": 0,
-            "fat": 12,
-            "fiber": 0,
-            "sugar": 0
-            }}
-            }}
-            ],
-            "instructions": "### **Step 1: Prepare Ingredients**\\n..."
-            }}
-            ]
-            ```
-            **Strictly return only JSON with no extra text.**
-            """
+        if cached_response and len(cached_response) >= total_meals_needed:
+            logger.info(f"Found complete cache with {len(cached_response)}/{total_meals_needed} meals - skipping generation")
+            all_generated_meals = cached_response.copy()
+        else:
+            # Fan out one unit of work per meal slot so plan latency is bounded by the slowest meal.
+            # Slots already generated by a previous attempt are served from their per-slot cache.
+            slot_results = [None] * len(meal_generation_plan)
+
+            # Existing meals that already hit a slot's macro target are reused without calling Gemini.
+            # Pantry plans must be built from the user's ingredients, so they are always generated.
+            if MEAL_REUSE_ENABLED and meal_algorithm != "pantry":
+                reused_meals = reuse_meals_for_slots(meal_generation_plan, meal_macros, dietary_preferences)
+                for i, reused_meal in reused_meals.items():
+                    slot_results[i] = [reused_meal]
+                    publish_generated_meals(meal_plan_id, i, slot_results[i])
+                complete_llm_backlog(meal_plan_id, len(reused_meals))
+
+            # Slots that could not get Gemini quota; the task is requeued for them rather than dropping them
+            rate_limited_for = 0.0
+            pending_slots = [i for i, slot_meals in enumerate(slot_results) if not slot_meals]
+            max_workers = max(1, min(MEAL_GENERATION_CONCURRENCY, len(pending_slots)))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                if MEAL_GENERATION_MODE == "batched" and pending_slots:
+                    # Group slots of the same meal type (and therefore the same macro target) into batches
+                    slots_by_type = {}
+                    for i in pending_slots:
+                        slots_by_type.setdefault(meal_generation_plan[i], []).append(i)
+
+                    batch_futures = []
+                    for current_meal_type, type_slots in slots_by_type.items():
+                        for start in range(0, len(type_slots), MEAL_BATCH_SIZE):
+                            batch_futures.append(executor.submit(
+                                generate_meal_batch,
+                                type_slots[start:start + MEAL_BATCH_SIZE],
+                                current_meal_type,
+                                meal_macros[current_meal_type],
+                                request_hash,
+                                dietary_preferences,
+                                meal_plan_id,
+                                meal_algorithm,
+                                pantry_ingredients
+                            ))
+                    for future in as_completed(batch_futures):
+                        try:
+                            batch_results = future.result()
+                        except LLMRateLimited as e:
+                            rate_limited_for = max(rate_limited_for, e.retry_after)
+                            continue
+                        for i, slot_meals in batch_results.items():
+                            slot_results[i] = slot_meals
+                            publish_generated_meals(meal_plan_id, i, slot_meals)
+                        complete_llm_backlog(meal_plan_id, sum(1 for slot_meals in batch_results.values() if slot_meals))
+
+                    # Only the slots whose meals were missing or invalid are re-requested individually
+                    pending_slots = [i for i, slot_meals in enumerate(slot_results) if not slot_meals]
+                    if rate_limited_for:
+                        # Re-requesting individually would only hit the same exhausted quota
+                        pending_slots = []
+                    elif pending_slots:
+                        logger.info(f"Re-requesting {len(pending_slots)} failed slots individually")
+
+                futures = {
+                    executor.submit(
+                        generate_single_meal,
+                        i,
+                        meal_generation_plan[i],
+                        meal_macros[meal_generation_plan[i]],
+                        request_hash,
+                        dietary_preferences,
+                        meal_plan_id,
+                        meal_algorithm,
+                        pantry_ingredients
+                    ): i
+                    for i in pending_slots
+                }
+                for future in as_completed(futures):
+                    try:
+                        slot_results[futures[future]] = future.result()
+                    except LLMRateLimited as e:
+                        rate_limited_for = max(rate_limited_for, e.retry_after)
+                        continue
+                    publish_generated_meals(meal_plan_id, futures[future], slot_results[futures[future]])
+                    complete_llm_backlog(meal_plan_id)
+
+            # Generated slots are cached per slot, so the requeued run only asks Gemini for the rest
+            if rate_limited_for and self.request.retries < self.max_retries:
+                missing = sum(1 for slot_meals in slot_results if not slot_meals)
+                countdown = math.ceil(rate_limited_for)
+                logger.warning(f"Gemini quota exhausted with {missing} meals missing, requeueing meal plan {meal_plan_id} in {countdown}s")
+                publish_meal_plan_event(meal_plan_id, PLAN_QUEUED, {"missing_meals": missing, "retry_in": countdown})
+                requeued = True
+                raise self.retry(countdown=countdown)
             
-            try:
-                # Use Google Gemini to generate a single meal
-                model = genai.GenerativeModel("gemini-1.5-flash")
-                response = model.generate_content(prompt)
-                response_text = response.text.strip()
-                
-                # Improved JSON extraction with robust regex
-                json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL | re.IGNORECASE)
-                if json_match:
-                    cleaned_response_text = json_match.group(1).strip()
-                else:
-                    cleaned_response_text = response_text.strip()
-                
-                single_meal = json.loads(cleaned_response_text)
-                if not isinstance(single_meal, list):
-                    raise ValueError(f"AI response for {current_meal_type} meal {i+1} is not a valid list.")
-                
-                # Ensure the meal has the correct type
-                for j, meal in enumerate(single_meal):
-                    meal["meal_type"] = current_meal_type
-                    # Apply the macro validation and adjustment
-                    single_meal[j] = validate_and_adjust_macros(meal, macros)
-                
-                # Cache this individual meal
-                set_cache(single_meal_cache_key, single_meal, MEAL_CACHE_TTL)
-                logger.info(f"Generated and cached meal {i+1} of type {current_meal_type}")
-                
-                # Add to the collection of all meals
-                all_generated_meals.extend(single_meal)
-                
-            except Exception as e:
-                logger.error(f"⚠️ Error generating meal {i+1} of type {current_meal_type}: {str(e)}")
-                continue
+            # Keep meals in plan order regardless of completion order
+            all_generated_meals = []
+            for slot_meals in slot_results:
+                if slot_meals:
+                    all_generated_meals.extend(slot_meals)
+
+            # Solve portions for every generated meal against its macro target in one batched call;
+            # reused meals were picked for being within tolerance and are stored as they are
+            to_adjust = [i for i, meal in enumerate(all_generated_meals) if not meal.get("reused_from")]
+            adjusted_meals = adjust_meal_portions(
+                [all_generated_meals[i] for i in to_adjust],
+                [meal_macros[all_generated_meals[i]["meal_type"]] for i in to_adjust]
+            )
+            for i, meal in zip(to_adjust, adjusted_meals):
+                all_generated_meals[i] = meal
         
         # Cache the complete set of meals if we have any
         if all_generated_meals:
             set_cache(prompt_cache_key, all_generated_meals, MEAL_CACHE_TTL)
             logger.info(f"Cached all {len(all_generated_meals)} generated meals for request hash: {request_hash}")
         
-        # Verify we have the correct number of meals
-        if len(all_generated_meals) != total_meals_needed:
-            logger.warning(f"⚠️ Warning: Generated {len(all_generated_meals)} meals but needed {total_meals_needed}")
-        
-        # Format generated meals and save to DB
-        formatted_meals = []
-        for index, meal in enumerate(all_generated_meals):
-            # Generate a unique ID for this meal
-            unique_id = generate_meal_id(meal["title"], request_hash, index)
-            
-            # Save the meal to the database with the unique ID
-            saved_meal = save_meal_with_hash(
-                meal["title"],
-                meal["instructions"],
-                meal["ingredients"],
-                dietary_preferences,
-                meal["nutrition"],
-                meal_plan_id,
-                meal["meal_type"],
-                request_hash,
-                unique_id
-            )
-            
-            # Cache the individual meal
-            meal_cache_key = f"meal:{unique_id}"
-            set_cache(meal_cache_key, saved_meal, MEAL_CACHE_TTL)
-            logger.info(f"Cached individual meal in Redis: {meal['title']} with ID {unique_id}")
-            
-            # Generate the image URL
-            image_url = generate_and_cache_meal_image(meal["title"], unique_id)
-            logger.info(f"📋 Generated meal: {meal['title']} - Image URL: {image_url}")
-            
-            # Add to the formatted meals list
-            formatted_meals.append({
-                "id": unique_id,
-                "title": meal["title"],
-                "meal_type": meal["meal_type"],
-                "nutrition": meal["nutrition"],
-                "ingredients": meal["ingredients"],
-                "instructions": meal["instructions"],
-                "imageUrl": image_url  # Fixed: Use camelCase
-            })
+        all_meals_generated = len(all_generated_meals) >= total_meals_needed
 
-        # Cache the complete meal plan in Redis by both request hash and meal plan ID
-        meal_plan_cache_key = f"meal_plan:{request_hash}"
-        plan_id_cache_key = f"meal_plan_id:{meal_plan_id}"
+        # Don't persist anything if the lease expired and another worker may have taken over
+        if not generation_lock.extend():
+            logger.warning(f"Lost generation lock for meal plan: {request_hash}, discarding results")
+            return {"status": "skipped", "message": "Generation lock was lost"}
         
-        # Extract all meals from MongoDB for consistent cache format
-        saved_meals = list(meals_collection.find({"meal_plan_id": meal_plan_id}))
-        
-        # Cache both by request hash and by meal plan ID
-        set_cache(meal_plan_cache_key, saved_meals, MEAL_CACHE_TTL)
-        set_cache(plan_id_cache_key, saved_meals, MEAL_CACHE_TTL)
-        logger.info(f"Cached complete meal plan in Redis under keys: {meal_plan_cache_key} and {plan_id_cache_key}")
-
-        # Only mark as ready and send notification if we have all the meals needed
-        if len(all_generated_meals) >= total_meals_needed:
-            # NEW CHANGE: Check if all meal images are ready
-            all_images_ready = all(meal.get("imageUrl") for meal in formatted_meals)
+        # Persist the whole plan in bulk, then index each meal and hand it to the image queue
+        saved_meals = persist_generated_meals(all_generated_meals, dietary_preferences, meal_plan_id, request_hash)
+        saved_meal_ids = list(dict.fromkeys(saved_meal["meal_id"] for saved_meal in saved_meals))
+
+        # Cache the individual meals and make them available for reuse by later plans
+        set_many_cache({f"meal:{saved_meal['meal_id']}": saved_meal for saved_meal in saved_meals}, MEAL_CACHE_TTL)
+        meal_index = get_meal_index()
+        queued_images = set()
+        for index, saved_meal in enumerate(saved_meals):
+            saved_meal_id = saved_meal["meal_id"]
+            meal_index.add_meal(saved_meal)
+            publish_meal_plan_event(meal_plan_id, MEAL_SAVED, {"index": index, "meal": format_meal_event(saved_meal)})
             
-            if not all_images_ready:
-                logger.warning(f"⚠️ Not marking meal plan as ready - only {len([m for m in formatted_meals if m.get('imageUrl')])} of {len(formatted_meals)} meals have images")
-                # Mark as still processing
-                try:
-                    if session_id:
-                        chat_collection.update_one(
-                            {"session_id": session_id},
-                            {
-                                "$set": {
-                                    "meal_plan_ready": False,
-                                    "meal_plan_processing": True,
-                                    "meal_plan_id": meal_plan_id,
-                                    "updated_at": datetime.datetime.now()
-                                }
-                            }
-                        )
-                        logger.info(f"Updated chat session {session_id} to mark meal plan as still processing (waiting for images)")
-                except Exception as e:
-                    logger.error(f"Failed to update chat session status for incomplete image generation: {str(e)}")
-                return
-                
-            # All meals and images are ready, continue with notification
-            try:
-                # We already have session_id from earlier
-                if session_id:
-                    # First, update the chat session status to mark meal plan as ready
-                    chat_collection.update_one(
-                        {"session_id": session_id},
-                        {
-                            "$set": {
-                                "meal_plan_ready": True,
-                                "meal_plan_processing": False,
-                                "meal_plan_id": meal_plan_id,
-                                "updated_at": datetime.datetime.now()
-                            }
-                        }
-                    )
-                    logger.info(f"Updated chat session {session_id} to mark meal plan as ready")
-                    
-                    # Then, send the notification message using a helper task
-                    notify_meal_plan_ready_task.delay(session_id, user_id, meal_plan_id)
-                else:
-                    # If we don't have session_id yet, try to get it again
-                    if user_id:
-                        recent_chat = chat_collection.find_one(
-                            {"user_id": user_id},
-                            sort=[("created_at", -1)]
-                        )
-                        
-                        if recent_chat:
-                            session_id = recent_chat.get("session_id")
-                            if session_id:
-                                # Update chat session
-                                chat_collection.update_one(
-                                    {"session_id": session_id},
-                                    {
-                                        "$set": {
-                                            "meal_plan_ready": True,
-                                            "meal_plan_processing": False,
-                                            "meal_plan_id": meal_plan_id,
-                                            "updated_at": datetime.datetime.now()
-                                        }
-                                    }
-                                )
-                                
-                                # Send notification
-                                notify_meal_plan_ready_task.delay(session_id, user_id, meal_plan_id)
-                                logger.info(f"Scheduled notification for meal plan ready, session: {session_id}")
-                            else:
-                                logger.warning(f"Found chat session but no session_id for user_id: {user_id}")
-                        else:
-                            logger.warning(f"No chat session found for user_id: {user_id}")
-                    else:
-                        logger.warning("No user_id available to find chat session")
-            except Exception as e:
-                # Log but don't fail if notification fails
-                logger.error(f"⚠️ Non-critical error sending notification: {str(e)}")
-        else:
+            if saved_meal.get("imageUrl"):
+                record_meal_image(meal_plan_id, saved_meal_id, saved_meal["imageUrl"])
+            elif saved_meal_id not in queued_images:
+                queued_images.add(saved_meal_id)
+                generate_meal_image_task.delay(saved_meal["meal_name"], saved_meal_id, meal_plan_id)
+                logger.info(f"📋 Queued image generation for meal: {saved_meal['meal_name']} ({saved_meal_id})")
+
+        # Register the plan with the image stage; image tasks that already finished are picked up below.
+        # A run holding an older fencing token never overwrites the progress of a newer one.
+        progress_key = f"meal_plan_progress:{meal_plan_id}"
+        existing_progress = get_cache(progress_key) or {}
+        if existing_progress.get("fencing_token", 0) > generation_lock.fencing_token:
+            logger.warning(f"Newer generation already registered for meal plan: {meal_plan_id}, skipping registration")
+            return {"status": "skipped", "message": "Superseded by a newer generation"}
+
+        delete_cache(f"meal_plan_finalized:{meal_plan_id}")
+        set_cache(progress_key, {
+            "user_id": user_id,
+            "session_id": session_id,
+            "request_hash": request_hash,
+            "meal_ids": saved_meal_ids,
+            "all_meals_generated": all_meals_generated,
+            "fencing_token": generation_lock.fencing_token
+        }, MEAL_CACHE_TTL)
+
+        if not all_meals_generated:
             logger.warning(f"⚠️ Not marking meal plan as ready - only generated {len(all_generated_meals)}/{total_meals_needed} meals")
+            clear_inflight_generation(request_hash)
+            publish_meal_plan_event(meal_plan_id, PLAN_FAILED, {
+                "message": f"Only generated {len(all_generated_meals)} of {total_meals_needed} meals"
+            })
+
+        # Only mark as ready and send notification once all meals and all images are ready
+        if not finalize_meal_plan_if_ready(meal_plan_id):
             # Mark as still processing
             try:
                 if session_id:
@@ -684,18 +719,218 @@ def generate_meal_plan(
                             }
                         }
                     )
-                    logger.info(f"Updated chat session {session_id} to mark meal plan as still processing (incomplete)")
+                    logger.info(f"Updated chat session {session_id} to mark meal plan as still processing")
             except Exception as e:
                 logger.error(f"Failed to update chat session status for incomplete meal plan: {str(e)}")
                 
+    except Retry:
+        raise
     except Exception as e:
         logger.error(f"Error in generate_meal_plan task: {str(e)}")
+        publish_meal_plan_event(meal_plan_id, PLAN_FAILED, {"message": "Meal plan generation failed"})
+        clear_inflight_generation(request_hash)
         return {"status": "error", "message": str(e)}
     finally:
         # Release the lock when done
-        if 'lock_acquired' in locals() and lock_acquired:
-            delete_cache(generation_lock_key)
+        if 'generation_lock' in locals() and generation_lock.release():
             logger.info(f"Released generation lock for meal plan: {request_hash}")
+        # Runs that never took the lock leave the backlog of the run that holds it alone
+        if 'generation_lock' in locals() and generation_lock.fencing_token is not None and not requeued:
+            clear_llm_backlog(meal_plan_id)
+
+# ===================== IMAGE TASKS =====================
+
+@celery_app.task(name="generate_meal_image_task", bind=True, max_retries=2, default_retry_delay=30)
+def generate_meal_image_task(self, meal_name, meal_id, meal_plan_id, deferrals=0):
+    """
+    Generates the image for a single persisted meal on the dedicated image queue,
+    records its completion for the meal plan and finalizes the plan once every image is ready.
+    Waiting for another worker that is generating the same dish does not use up a retry.
+    """
+    image_url = generate_and_cache_meal_image(meal_name, meal_id)
+    if image_url == IMAGE_GENERATION_DEFERRED:
+        if deferrals < MEAL_IMAGE_MAX_DEFERRALS:
+            logger.info(f"Waiting {MEAL_IMAGE_DEFER_COUNTDOWN}s for the image of '{meal_name}' from another worker")
+            raise self.retry(
+                kwargs={"deferrals": deferrals + 1}, countdown=MEAL_IMAGE_DEFER_COUNTDOWN, max_retries=None
+            )
+        image_url = None
+    if not image_url:
+        if self.request.retries - deferrals >= self.max_retries:
+            logger.error(f"❌ Image generation failed for meal {meal_id} after {self.request.retries - deferrals} retries")
+            # The meal is done without an image, so the plan is still cached and the user notified
+            record_meal_image(meal_plan_id, meal_id, None)
+            finalize_meal_plan_if_ready(meal_plan_id)
+            return {"status": "error", "meal_id": meal_id, "message": "Image generation failed"}
+        logger.warning(f"⚠️ Image generation failed for meal {meal_id}, retrying")
+        # Deferrals count as Celery retries too, so the limit is raised by their number
+        raise self.retry(max_retries=self.max_retries + deferrals)
+
+    logger.info(f"📋 Generated image for meal: {meal_name} - Image URL: {image_url}")
+
+    # Keep the individual meal cache in sync with the new image
+    cached_meal = get_cache(f"meal:{meal_id}")
+    if cached_meal:
+        cached_meal["imageUrl"] = image_url
+        set_cache(f"meal:{meal_id}", cached_meal, MEAL_CACHE_TTL)
+
+    record_meal_image(meal_plan_id, meal_id, image_url)
+    finalize_meal_plan_if_ready(meal_plan_id)
+    return {"status": "success", "meal_id": meal_id, "imageUrl": image_url}
+
+def claim_inflight_generation(request_hash, meal_plan_id):
+    """
+    Registers a generation for request_hash unless an identical one is already in flight.
+    Returns None if this caller should queue the generation, otherwise the in-flight entry
+    ({"meal_plan_id", "started_at"}) the caller should attach to.
+    """
+    inflight_key = f"inflight:{request_hash}"
+    entry = {"meal_plan_id": meal_plan_id, "started_at": datetime.datetime.now().timestamp()}
+    if set_cache_if_absent(inflight_key, entry, INFLIGHT_GENERATION_TTL):
+        return None
+    # None here means the entry expired in between or Redis failed; queue the generation then
+    return get_cache(inflight_key)
+
+def register_meal_plan_waiter(meal_plan_id, session_id, user_id):
+    """Records a chat session that attached to an in-flight generation so it is notified too."""
+    set_hash_field(f"meal_plan_waiters:{meal_plan_id}", session_id, user_id, MEAL_CACHE_TTL)
+
+def clear_inflight_generation(request_hash):
+    """Lets the next identical request start a new generation."""
+    delete_cache(f"inflight:{request_hash}")
+
+def record_meal_image(meal_plan_id, meal_id, image_url):
+    """
+    Tracks per-meal image completion for a meal plan in Redis. An image_url of None
+    records a meal whose image generation gave up, which still counts as complete.
+    """
+    set_hash_field(f"meal_plan_images:{meal_plan_id}", meal_id, image_url, MEAL_CACHE_TTL)
+    if image_url:
+        publish_meal_plan_event(meal_plan_id, MEAL_IMAGE, {"meal_id": meal_id, "imageUrl": image_url})
+    else:
+        publish_meal_plan_event(meal_plan_id, MEAL_IMAGE_FAILED, {"meal_id": meal_id})
+
+def publish_generated_meals(meal_plan_id, slot, slot_meals):
+    """Publishes the meals of a generation slot as soon as they come back from the model."""
+    for meal in slot_meals or []:
+        publish_meal_plan_event(meal_plan_id, MEAL_GENERATED, {
+            "slot": slot,
+            "title": meal.get("title"),
+            "meal_type": meal.get("meal_type"),
+            "nutrition": meal.get("nutrition", {}),
+            "reused": bool(meal.get("reused_from"))
+        })
+
+def finalize_meal_plan_if_ready(meal_plan_id):
+    """
+    Marks a meal plan as ready and sends the notification once every meal has been
+    generated and every meal image has been recorded. Readiness is computed from the
+    Redis progress tracking, so the meals collection is not polled.
+    Returns True if the plan is ready.
+    """
+    progress = get_cache(f"meal_plan_progress:{meal_plan_id}")
+    if not progress or not progress.get("all_meals_generated"):
+        return False
+
+    images = get_hash(f"meal_plan_images:{meal_plan_id}")
+    missing_images = [meal_id for meal_id in progress["meal_ids"] if meal_id not in images]
+    if missing_images:
+        logger.info(f"Meal plan {meal_plan_id} waiting for {len(missing_images)} of {len(progress['meal_ids'])} images")
+        return False
+
+    # Only one caller finalizes the plan
+    if not set_cache_if_absent(f"meal_plan_finalized:{meal_plan_id}", True, MEAL_CACHE_TTL):
+        return True
+
+    user_id = progress.get("user_id")
+    session_id = progress.get("session_id")
+    request_hash = progress.get("request_hash")
+
+    # Cache the complete meal plan in Redis by both request hash and meal plan ID
+    meal_plan_cache_key = f"meal_plan:{request_hash}"
+    plan_id_cache_key = f"meal_plan_id:{meal_plan_id}"
+    
+    # Assemble the plan from the meal documents cached when they were persisted, with their
+    # recorded images; MongoDB is only read for meals that have dropped out of the cache
+    meal_ids = progress["meal_ids"]
+    saved_meals = get_many_cache([f"meal:{meal_id}" for meal_id in meal_ids])
+    uncached_ids = [meal_id for meal_id, meal in zip(meal_ids, saved_meals) if meal is None]
+    if uncached_ids:
+        stored_meals = {meal["meal_id"]: meal for meal in meals_collection.find({"meal_id": {"$in": uncached_ids}})}
+        saved_meals = [meal or stored_meals.get(meal_id) for meal_id, meal in zip(meal_ids, saved_meals)]
+    saved_meals = [meal for meal in saved_meals if meal]
+    for meal in saved_meals:
+        meal["imageUrl"] = images.get(meal["meal_id"]) or meal.get("imageUrl")
+    
+    # Cache both by request hash and by meal plan ID
+    set_cache(meal_plan_cache_key, saved_meals, MEAL_CACHE_TTL)
+    set_cache(plan_id_cache_key, saved_meals, MEAL_CACHE_TTL)
+    logger.info(f"Cached complete meal plan in Redis under keys: {meal_plan_cache_key} and {plan_id_cache_key}")
+    publish_meal_plan_event(meal_plan_id, PLAN_READY, {"meals": [format_meal_event(meal) for meal in saved_meals]})
+
+    # The plan is now served from cache, so identical requests no longer need to attach to it
+    clear_inflight_generation(request_hash)
+
+    # All meals and images are ready, continue with notification
+    try:
+        # If we don't have session_id yet, try to get it again
+        if not session_id and user_id:
+            recent_chat = chat_collection.find_one(
+                {"user_id": user_id},
+                sort=[("created_at", -1)]
+            )
+            if recent_chat:
+                session_id = recent_chat.get("session_id")
+                if not session_id:
+                    logger.warning(f"Found chat session but no session_id for user_id: {user_id}")
+            else:
+                logger.warning(f"No chat session found for user_id: {user_id}")
+        elif not user_id:
+            logger.warning("No user_id available to find chat session")
+
+        if session_id:
+            # First, update the chat session status to mark meal plan as ready
+            chat_collection.update_one(
+                {"session_id": session_id},
+                {
+                    "$set": {
+                        "meal_plan_ready": True,
+                        "meal_plan_processing": False,
+                        "meal_plan_id": meal_plan_id,
+                        "updated_at": datetime.datetime.now()
+                    }
+                }
+            )
+            logger.info(f"Updated chat session {session_id} to mark meal plan as ready")
+            
+            # Then, send the notification message using a helper task
+            notify_meal_plan_ready_task.delay(session_id, user_id, meal_plan_id)
+            logger.info(f"Scheduled notification for meal plan ready, session: {session_id}")
+
+        # Notify the sessions whose identical requests attached to this generation
+        waiters_key = f"meal_plan_waiters:{meal_plan_id}"
+        for waiter_session_id, waiter_user_id in get_hash(waiters_key).items():
+            if waiter_session_id == session_id:
+                continue
+            chat_collection.update_one(
+                {"session_id": waiter_session_id},
+                {
+                    "$set": {
+                        "meal_plan_ready": True,
+                        "meal_plan_processing": False,
+                        "meal_plan_id": meal_plan_id,
+                        "updated_at": datetime.datetime.now()
+                    }
+                }
+            )
+            notify_meal_plan_ready_task.delay(waiter_session_id, waiter_user_id, meal_plan_id)
+            logger.info(f"Scheduled notification for attached session: {waiter_session_id}")
+        delete_cache(waiters_key)
+    except Exception as e:
+        # Log but don't fail if notification fails
+        logger.error(f"⚠️ Non-critical error sending notification: {str(e)}")
+
+    return True
 
 @celery_app.task(name="notify_meal_plan_ready_task", max_retries=1)
 def notify_meal_plan_ready_task(session_id, user_id, meal_plan_id):
@@ -707,11 +942,8 @@ def notify_meal_plan_ready_task(session_id, user_id, meal_plan_id):
         logger.info(f"Starting notification task for session {session_id}, meal plan {meal_plan_id}")
         
         # Use a consistent notification lock key in Redis with longer timeout (5 minutes)
-        notification_lock_key = f"notification_lock:{session_id}:{meal_plan_id}"
-        
-        # Try to acquire a lock using Redis SETNX operation (atomic)
-        # This ensures only one process can send the notification
-        lock_acquired = False
+        # Acquired atomically with SET NX so only one process can send the notification
+        notification_lock = RedisLock(f"notification_lock:{session_id}:{meal_plan_id}", ttl_ms=300000)
         
         try:
             # Check if notification was already sent using a dedicated flag in Redis
@@ -722,12 +954,8 @@ def notify_meal_plan_ready_task(session_id, user_id, meal_plan_id):
                 logger.info(f"Notification for meal plan {meal_plan_id} already sent, skipping (Redis)")
                 return {"status": "already_notified", "source": "redis_cache"}
                 
-            # Create a Redis lock with 5 minute expiry to prevent concurrent notifications
-            # Use your Redis client to set the key only if it doesn't exist
-            if not get_cache(notification_lock_key):
-                set_cache(notification_lock_key, True, 300)  # 300 second TTL for the lock (5 minutes)
-                lock_acquired = True
-            else:
+            # Take the lock to prevent concurrent notifications
+            if not notification_lock.acquire():
                 logger.info(f"Another process is already sending notification for {meal_plan_id}, skipping")
                 return {"status": "locked", "message": "Another process is handling this notification"}
                 
@@ -820,9 +1048,8 @@ def notify_meal_plan_ready_task(session_id, user_id, meal_plan_id):
             logger.info(f"✅ Successfully sent meal plan ready notification to chat session {session_id}")
             return {"status": "success"}
         finally:
-            # Release the lock if we acquired it
-            if lock_acquired:
-                delete_cache(notification_lock_key)
+            # Release the lock if we still hold it
+            if notification_lock.release():
                 logger.info(f"Released notification lock for {meal_plan_id}")
         
     except Exception as e:
@@ -900,6 +1127,66 @@ def notify_frontend_webhook(user_id, meal_plan_id, session_id):
         logger.error(f"❌ Error sending frontend webhook notification: {str(e)}")
         return False
 
+# ===================== PREWARM TASKS =====================
+
+@celery_app.task(name="prewarm_popular_plans")
+def prewarm_popular_plans():
+    """
+    Keeps the `meal_plan:` cache warm for the most requested plan shapes. Shapes whose
+    meals are already stored only have their cache entry refreshed; the rest are queued
+    for generation, most popular first, until PREWARM_TOKEN_BUDGET is spent.
+    Runs off-peak from Celery beat.
+    """
+    # Every container runs beat, so the first run of the hour claims it and the others skip
+    if not set_cache_if_absent("prewarm_popular_plans_run", True, 3600):
+        logger.info("Popular meal plans were already prewarmed this hour, skipping")
+        return {"status": "skipped"}
+
+    shapes = top_request_shapes(PREWARM_TOP_N, PREWARM_MIN_REQUESTS)
+    token_budget = PREWARM_TOKEN_BUDGET
+    refreshed, queued, over_budget = 0, 0, 0
+
+    for shape in shapes:
+        request_hash = shape["request_hash"]
+        meal_counts, total_meals_needed = meal_counts_for(shape["meal_type"], shape["num_days"])
+        cache_key = f"meal_plan:{request_hash}"
+
+        stored_meals = get_cache(cache_key)
+        if not stored_meals or len(stored_meals) < total_meals_needed:
+            stored_meals = list(meals_collection.find(request_meals_filter(request_hash)).limit(total_meals_needed))
+        if len(stored_meals) >= total_meals_needed:
+            set_cache(cache_key, stored_meals, PREWARMED_PLAN_TTL)
+            refreshed += 1
+            continue
+
+        estimated_tokens = total_meals_needed * PREWARM_TOKENS_PER_MEAL
+        if estimated_tokens > token_budget:
+            over_budget += 1
+            continue
+        # The plan id matches what POST /mealplan/ uses, so users arriving meanwhile attach to it
+        if claim_inflight_generation(request_hash, request_hash):
+            continue
+
+        token_budget -= estimated_tokens
+        request_dict = {field: shape[field] for field in SHAPE_FIELDS}
+        request_dict["pantry_ingredients"] = []
+        reset_meal_plan_events(request_hash)
+        add_llm_backlog(request_hash, total_meals_needed, INFLIGHT_GENERATION_TTL)
+        generate_meal_plan.apply_async(
+            (request_dict, None, meal_counts, total_meals_needed, request_hash, request_hash),
+            priority=GENERATION_PRIORITY_BACKGROUND
+        )
+        queued += 1
+        logger.info(f"Queued prewarm of popular meal plan {request_hash} ({shape['requests']:.1f} requests)")
+
+    decay_request_shapes(PREWARM_POPULARITY_DECAY)
+
+    logger.info(
+        f"Prewarmed {len(shapes)} popular meal plan shapes: {refreshed} refreshed, {queued} queued, "
+        f"{over_budget} over budget, {PREWARM_TOKEN_BUDGET - token_budget} tokens estimated"
+    )
+    return {"status": "success", "refreshed": refreshed, "queued": queued, "over_budget": over_budget}
+
 # ===================== HELPER FUNCTIONS =====================
 
 def update_chat_messages_sync(session_id, message, is_error=False):
@@ -927,78 +1214,13 @@ def store_error_message_sync(session_id, error_text):
     
     update_chat_messages_sync(session_id, error_message, is_error=True)
 
-def fetch_ingredient_macros(ingredient):
-    """Fetches macros for a given ingredient using the USDA API."""
-    api_key = os.getenv("USDA_API_KEY")
-    if not api_key:
-        logger.error("USDA API key not configured")
-        return None
-    
-    import requests
-    USDA_API_URL = "https://api.nal.usda.gov/fdc/v1/foods/search"
-
-    params = {"query": ingredient, "api_key": api_key}
-    response = requests.get(USDA_API_URL, params=params)
-
-    if response.status_code != 200:
-        return None
-
-    data = response.json()
-    if not data.get("foods"):
-        return None
-
-    food_item = data["foods"][0]
-
-    nutrient_mapping = {
-        208: "calories",
-        203: "protein",
-        205: "carbs",
-        204: "fat",
-        269: "sugar",
-        291: "fiber"
-    }
-
-    macros = {nutrient_mapping[nutrient["nutrientId"]]: nutrient["value"]
-              for nutrient in food_item["foodNutrients"] if nutrient["nutrientId"] in nutrient_mapping}
-
-    return macros
-
-def save_meal_with_hash(meal_name, meal_text, ingredients, dietary_type, macros, meal_plan_id, meal_type, request_hash, meal_id):
-    """Save meal with request hashing for caching and USDA validation for nutrition accuracy."""
-    # Check for duplicate before saving
-    existing_meal = meals_collection.find_one({
-        "meal_name": meal_name,
-        "request_hash": request_hash
-    })
-    
-    if existing_meal:
-        # ALWAYS update meal_plan_id to ensure consistency
-        if existing_meal.get("meal_plan_id") != meal_plan_id:
-            meals_collection.update_one(
-                {"_id": existing_meal["_id"]},
-                {"$set": {"meal_plan_id": meal_plan_id, "updated_at": datetime.datetime.now()}}
-            )
-            # Update the local copy
-            existing_meal["meal_plan_id"] = meal_plan_id
-            
-            # UPDATE BOTH CACHE KEYS
-            meal_id_cache_key = f"meal:{existing_meal['meal_id']}"
-            set_cache(meal_id_cache_key, existing_meal, MEAL_CACHE_TTL)
-            
-            # Also update the meal plan cache
-            plan_id_cache_key = f"meal_plan_id:{meal_plan_id}"
-            cached_plan = get_cache(plan_id_cache_key) or []
-            
-            # Replace the meal in the cached plan or add it
-            updated_plan = [m for m in cached_plan if m.get("meal_id") != existing_meal["meal_id"]]
-            updated_plan.append(existing_meal)
-            set_cache(plan_id_cache_key, updated_plan, MEAL_CACHE_TTL)
-            
-            logger.info(f"Updated meal_plan_id for duplicate meal: {meal_name} to {meal_plan_id}")
-        
-        return existing_meal
-    
-    # USDA validation
+def validate_meal_nutrition(ingredients, macros, usda_results):
+    """
+    Validates a meal's ingredients against USDA data (per-100g macros keyed by ingredient name).
+    Returns the ingredients annotated with their USDA data, the macros to store (the USDA totals
+    if at least half the ingredients validated, otherwise the model's) and the model's macros
+    when they were replaced.
+    """
     validated_ingredients = []
     usda_macros = {
         "calories": 0,
@@ -1018,13 +1240,8 @@ def save_meal_with_hash(meal_name, meal_text, ingredients, dietary_type, macros,
                 continue
             
             try:
-                # Clean ingredient name for better USDA matching
-                clean_name = re.sub(r'^\d+\s*[\d/]*\s*(?:cup|tbsp|tsp|oz|g|lb|ml|l)s?\s*', '', ingredient["name"], flags=re.IGNORECASE)
-                clean_name = re.sub(r'diced|chopped|minced|sliced|cooked|raw|fresh|frozen|canned', '', clean_name, flags=re.IGNORECASE)
-                clean_name = clean_name.strip()
-                
                 # Get USDA data
-                usda_data = fetch_ingredient_macros(clean_name)
+                usda_data = usda_results.get(ingredient["name"])
                 
                 if usda_data:
                     # Keep track of USDA validation and attach data to ingredient
@@ -1032,35 +1249,11 @@ def save_meal_with_hash(meal_name, meal_text, ingredients, dietary_type, macros,
                     ingredient["usda_macros"] = usda_data
                     validation_count += 1
                     
-                    # Try to extract quantity
-                    quantity_str = ingredient.get("quantity", "")
-                    grams = 0
-                    
-                    # Simple quantity extraction
-                    if "g" in quantity_str:
-                        match = re.search(r'(\d+(?:\.\d+)?)\s*g', quantity_str)
-                        if match:
-                            grams = float(match.group(1))
-                    elif "cup" in quantity_str.lower():
-                        match = re.search(r'(\d+(?:\.\d+)?)', quantity_str)
-                        if match:
-                            grams = float(match.group(1)) * 240  # ~240g per cup
-                    elif "tbsp" in quantity_str.lower() or "tablespoon" in quantity_str.lower():
-                        match = re.search(r'(\d+(?:\.\d+)?)', quantity_str)
-                        if match:
-                            grams = float(match.group(1)) * 15  # ~15g per tbsp  
-                    elif "oz" in quantity_str.lower():
-                        match = re.search(r'(\d+(?:\.\d+)?)', quantity_str)
-                        if match:
-                            grams = float(match.group(1)) * 28.35  # ~28.35g per oz
-                    else:
-                        # Try to extract just the number
-                        match = re.search(r'^(\d+(?:\.\d+)?)', quantity_str)
-                        if match:
-                            grams = float(match.group(1))
-                        else:
-                            grams = 100  # Default if no quantity found
-                    
+                    # Convert the quantity to grams using the unit registry and density table
+                    grams = to_grams(str(ingredient.get("quantity", "")), ingredient["name"])
+                    if grams is None:
+                        grams = 100  # Default if no quantity found
+
                     # Calculate nutrition based on quantity
                     factor = grams / 100.0  # USDA data is per 100g
                     for key in usda_macros:
@@ -1083,8 +1276,6 @@ def save_meal_with_hash(meal_name, meal_text, ingredients, dietary_type, macros,
         usda_macros = {k: round(v, 1) for k, v in usda_macros.items()}
         validation_success = True
         logger.info(f"✅ USDA validation successful: {validation_count}/{len(ingredients)} ingredients validated")
-        logger.info(f"Original macros: {macros}")
-        logger.info(f"USDA macros: {usda_macros}")
     
     # Use the appropriate macros
     final_macros = usda_macros if validation_success else macros
@@ -1092,54 +1283,233 @@ def save_meal_with_hash(meal_name, meal_text, ingredients, dietary_type, macros,
     # Add validation metadata
     final_macros["usda_validated"] = validation_success
     
-    # Generate image URL if not already present
-    image_url = generate_and_cache_meal_image(meal_name, meal_id)
-    
-    # Build meal data
-    meal_data = {
-        "meal_id": meal_id,  # Use the provided meal_id directly
-        "meal_plan_id": meal_plan_id,
-        "meal_name": meal_name,
-        "meal_text": meal_text,
-        "ingredients": validated_ingredients,
-        "dietary_type": dietary_type,
-        "meal_type": meal_type,
-        "macros": final_macros,
-        "original_macros": macros if validation_success else None,
-        "request_hash": request_hash,
-        "created_at": datetime.datetime.now(),
-        "imageUrl": image_url  # Ensure imageUrl is always present
-    }
+    return validated_ingredients, final_macros, macros if validation_success else None
 
-    meals_collection.insert_one(meal_data)
-    
-    # Cache the meal in Redis
-    meal_cache_key = f"meal:{meal_id}"
-    set_cache(meal_cache_key, meal_data, MEAL_CACHE_TTL)
-    
-    return meal_data
+def persist_generated_meals(meals, dietary_type, meal_plan_id, request_hash):
+    """
+    Saves the meals of a plan with a fixed number of MongoDB round trips, whatever the plan size:
+    one $in query resolves meals already stored under the same title and request hash, a single
+    ordered bulk_write inserts the new meals and moves those duplicates to this plan, and catalogued
+    images are applied with one more bulk update. Ingredients of all new meals are USDA-validated
+    in one batch. Meals reused from the pool (`reused_from`) are not copied: the stored document
+    is tagged with this plan and request, and is neither re-validated nor re-imaged. Returns the
+    stored meal documents in plan order; a title repeated within the plan maps to the same document.
+    """
+    if not meals:
+        return []
+
+    now = datetime.datetime.now()
+    operations = []
+    reused_ids = list(dict.fromkeys(meal["reused_from"] for meal in meals if meal.get("reused_from")))
+    reused = {}
+    if reused_ids:
+        reused = {meal["meal_id"]: meal for meal in meals_collection.find({"meal_id": {"$in": reused_ids}})}
+    if reused:
+        operations.append(UpdateMany(
+            {"meal_id": {"$in": list(reused)}},
+            {"$addToSet": {"reused_in_plans": meal_plan_id, "reused_in_requests": request_hash}}
+        ))
+    # A reused meal that has since been deleted is stored like a generated one
+    generated = [meal for meal in meals if meal.get("reused_from") not in reused]
+
+    titles = list(dict.fromkeys(meal["title"] for meal in generated))
+    stored = {}
+    for existing_meal in meals_collection.find({"request_hash": request_hash, "meal_name": {"$in": titles}}):
+        stored.setdefault(existing_meal["meal_name"], existing_meal)
+
+    # ALWAYS update meal_plan_id of duplicates to ensure consistency
+    moved_meals = []
+    for existing_meal in stored.values():
+        if existing_meal.get("meal_plan_id") != meal_plan_id:
+            operations.append(UpdateOne(
+                {"_id": existing_meal["_id"]},
+                {"$set": {"meal_plan_id": meal_plan_id, "updated_at": now}}
+            ))
+            existing_meal["meal_plan_id"] = meal_plan_id
+            moved_meals.append(existing_meal)
+
+    new_meals = {}
+    for index, meal in enumerate(meals):
+        if meal.get("reused_from") in reused:
+            continue
+        if meal["title"] not in stored and meal["title"] not in new_meals:
+            new_meals[meal["title"]] = (index, meal)
+
+    # Look up every ingredient of every new meal in one parallel batch
+    usda_results = fetch_many_ingredient_macros(
+        ingredient["name"]
+        for _, meal in new_meals.values() if isinstance(meal.get("ingredients"), list)
+        for ingredient in meal["ingredients"] if isinstance(ingredient, dict) and "name" in ingredient
+    )
+
+    for title, (index, meal) in new_meals.items():
+        validated_ingredients, final_macros, original_macros = validate_meal_nutrition(
+            meal["ingredients"], meal["nutrition"], usda_results
+        )
+        meal_data = {
+            "meal_id": generate_meal_id(title, request_hash, index),
+            "meal_plan_id": meal_plan_id,
+            "meal_name": title,
+            "meal_text": meal["instructions"],
+            "ingredients": validated_ingredients,
+            "dietary_type": dietary_type,
+            "meal_type": meal["meal_type"],
+            "macros": final_macros,
+            "original_macros": original_macros,
+            "request_hash": request_hash,
+            "created_at": now,
+            "imageUrl": None  # Filled in from the catalog below or by generate_meal_image_task
+        }
+        operations.append(InsertOne(meal_data))
+        stored[title] = meal_data
+
+    if operations:
+        meals_collection.bulk_write(operations, ordered=True)
+    logger.info(f"Persisted meal plan {meal_plan_id}: {len(new_meals)} new meals, {len(reused)} reused, {len(moved_meals)} moved duplicates, {len(titles) - len(new_meals) - len(moved_meals)} already in plan")
+
+    apply_catalog_images(list(stored.values()) + list(reused.values()))
+
+    if moved_meals:
+        # Replace the moved meals in the cached plan or add them
+        plan_id_cache_key = f"meal_plan_id:{meal_plan_id}"
+        moved_ids = {meal["meal_id"] for meal in moved_meals}
+        cached_plan = get_cache(plan_id_cache_key) or []
+        updated_plan = [m for m in cached_plan if m.get("meal_id") not in moved_ids] + moved_meals
+        set_cache(plan_id_cache_key, updated_plan, MEAL_CACHE_TTL)
+
+    return [reused.get(meal.get("reused_from")) or stored[meal["title"]] for meal in meals]
+
+def apply_catalog_images(meal_docs):
+    """
+    Gives stored meals without an image the catalogued image of their dish, resolving all
+    fingerprints with one Redis MGET, one MongoDB $in query for the Redis misses and one bulk
+    update. Updates the documents in place and returns the number of meals that got an image.
+    """
+    pending = [meal for meal in meal_docs if not meal.get("imageUrl")]
+    if not pending:
+        return 0
+
+    fingerprints = {meal["meal_id"]: meal_image_fingerprint(meal["meal_name"]) for meal in pending}
+    unique_fingerprints = list(dict.fromkeys(fingerprints.values()))
+    cached_urls = get_many_cache([f"meal_image:{fingerprint}" for fingerprint in unique_fingerprints])
+    image_urls = {fingerprint: url for fingerprint, url in zip(unique_fingerprints, cached_urls) if url}
+
+    missing = [fingerprint for fingerprint in unique_fingerprints if fingerprint not in image_urls]
+    if missing:
+        catalog_urls = {
+            entry["fingerprint"]: entry["imageUrl"]
+            for entry in meal_images_collection.find({"fingerprint": {"$in": missing}}, {"fingerprint": 1, "imageUrl": 1})
+            if entry.get("imageUrl")
+        }
+        set_many_cache({f"meal_image:{fingerprint}": url for fingerprint, url in catalog_urls.items()}, MEAL_CACHE_TTL)
+        image_urls.update(catalog_urls)
+
+    now = datetime.datetime.now()
+    operations = []
+    for meal in pending:
+        image_url = image_urls.get(fingerprints[meal["meal_id"]])
+        if not image_url:
+            continue
+        update = {"imageUrl": image_url, "image_updated_at": now, "image_source": "catalog"}
+        meal.update(update)
+        operations.append(UpdateOne({"meal_id": meal["meal_id"]}, {"$set": update}))
+
+    if operations:
+        meals_collection.bulk_write(operations, ordered=False)
+        logger.info(f"Reused {len(operations)} catalog images")
+    return len(operations)
+
+# Meal images are deterministic for a given model, prompt and seed, so they are catalogued
+# by a fingerprint of those inputs and reused across meal_ids
+IMAGE_MODEL_NAME = "imagegeneration@002"
+MEAL_IMAGE_PROMPT_TEMPLATE = (
+    "Highly photorealistic food photography of {meal_name} without any AI artifacts. "
+    "Professional food styling with realistic textures, natural lighting from the side, "
+    "and detailed texture. Shot on a Canon 5D Mark IV with 100mm macro lens, f/2.8, natural window light. "
+    "Include realistic imperfections, proper food shadows and reflections. "
+    "A photo that could be published in Bon Appetit magazine."
+)
+meal_images_collection = collection("meal_images")
+
+# How long a worker's claim on generating a dish lasts. Image tasks for the same dish wait for
+# it in steps of MEAL_IMAGE_DEFER_COUNTDOWN, for a little longer than the claim can last
+MEAL_IMAGE_CLAIM_TTL = 120
+MEAL_IMAGE_DEFER_COUNTDOWN = 15
+MEAL_IMAGE_MAX_DEFERRALS = MEAL_IMAGE_CLAIM_TTL // MEAL_IMAGE_DEFER_COUNTDOWN + 2
+# Returned by generate_and_cache_meal_image while another worker holds the claim on the dish
+IMAGE_GENERATION_DEFERRED = "deferred"
+
+def normalize_meal_title(meal_name):
+    """Normalizes a meal title so trivially different spellings of a dish share one image."""
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", meal_name.lower()).split())
+
+def meal_image_fingerprint(meal_name):
+    """Returns the catalog key for a meal image: a hash of the model, prompt template and normalized title."""
+    base = f"{IMAGE_MODEL_NAME}|{MEAL_IMAGE_PROMPT_TEMPLATE}|{normalize_meal_title(meal_name)}"
+    return hashlib.sha1(base.encode()).hexdigest()
+
+def lookup_catalog_image(fingerprint):
+    """Looks up a previously generated image URL by fingerprint in Redis, then MongoDB."""
+    cache_key = f"meal_image:{fingerprint}"
+    cached_url = get_cache(cache_key)
+    if cached_url:
+        return cached_url
+
+    catalog_entry = meal_images_collection.find_one({"fingerprint": fingerprint}, {"imageUrl": 1})
+    if catalog_entry and catalog_entry.get("imageUrl"):
+        set_cache(cache_key, catalog_entry["imageUrl"], MEAL_CACHE_TTL)
+        return catalog_entry["imageUrl"]
+    return None
+
+def store_catalog_image(fingerprint, meal_name, image_url):
+    """Registers a generated image in the catalog so later meals with the same dish reuse it."""
+    meal_images_collection.update_one(
+        {"fingerprint": fingerprint},
+        {
+            "$set": {"imageUrl": image_url, "title": normalize_meal_title(meal_name)},
+            "$setOnInsert": {"created_at": datetime.datetime.now()}
+        },
+        upsert=True
+    )
+    set_cache(f"meal_image:{fingerprint}", image_url, MEAL_CACHE_TTL)
 
 def generate_and_cache_meal_image(meal_name, meal_id):
     """
     Generates a realistic food image for a meal using Google Cloud's Vertex AI.
     Uploads it to Google Cloud Storage, and returns a persistent URL.
-    If an image exists in the database, return that instead of generating a new one.
+    If an image exists in the database or the image catalog, return that instead of generating a new one.
+    Returns IMAGE_GENERATION_DEFERRED if another worker is generating the same dish, None on failure.
     """
     
     # Check if image already exists in MongoDB
     existing_meal = meals_collection.find_one({"meal_id": meal_id}, {"imageUrl": 1})
     if existing_meal and existing_meal.get("imageUrl"):
         return existing_meal["imageUrl"]
+
+    # Reuse the catalogued image if this dish has been generated before
+    fingerprint = meal_image_fingerprint(meal_name)
+    catalog_url = lookup_catalog_image(fingerprint)
+    if catalog_url:
+        meals_collection.update_one(
+            {"meal_id": meal_id},
+            {"$set": {
+                "imageUrl": catalog_url,
+                "image_updated_at": datetime.datetime.now(),
+                "image_source": "catalog"
+            }},
+            upsert=True
+        )
+        logger.info(f"Reused catalog image for meal {meal_id} ({meal_name})")
+        return catalog_url
+
+    # Only one worker generates a given dish; the others retry and pick it up from the catalog
+    if not set_cache_if_absent(f"meal_image_generating:{fingerprint}", True, MEAL_IMAGE_CLAIM_TTL):
+        logger.info(f"Image for '{meal_name}' is already being generated, deferring meal {meal_id}")
+        return IMAGE_GENERATION_DEFERRED
     
     try:
         # Enhanced prompt for realistic food photography
-        prompt = (
-            f"Highly photorealistic food photography of {meal_name} without any AI artifacts. "
-            "Professional food styling with realistic textures, natural lighting from the side, "
-            "and detailed texture. Shot on a Canon 5D Mark IV with 100mm macro lens, f/2.8, natural window light. "
-            "Include realistic imperfections, proper food shadows and reflections. "
-            "A photo that could be published in Bon Appetit magazine."
-        )
+        prompt = MEAL_IMAGE_PROMPT_TEMPLATE.format(meal_name=meal_name)
         
 # Check if Vertex AI is initialized
         if not project_id:
@@ -1147,7 +1517,7 @@ def generate_and_cache_meal_image(meal_name, meal_id):
             
         # Load the pre-trained image generation model
         try:
-            model = ImageGenerationModel.from_pretrained("imagegeneration@002")
+            model = ImageGenerationModel.from_pretrained(IMAGE_MODEL_NAME)
             
             # Generate the image
             images = model.generate_images(
@@ -1209,8 +1579,8 @@ def generate_and_cache_meal_image(meal_name, meal_id):
                 try:
                     bucket = storage_client.bucket(bucket_name)
                     
-                    # Generate a unique filename for the image in GCS
-                    filename = f"meal_images/{meal_id}_{uuid.uuid4()}.jpg"
+                    # Content-addressed filename so each dish is stored once in GCS
+                    filename = f"meal_images/{fingerprint}.jpg"
                     blob = bucket.blob(filename)
                     
                     # Upload the image to Google Cloud Storage
@@ -1232,6 +1602,8 @@ def generate_and_cache_meal_image(meal_name, meal_id):
                         }},
                         upsert=True
                     )
+
+                    store_catalog_image(fingerprint, meal_name, gcs_image_url)
                     
                     return gcs_image_url
                 except Exception as storage_error:
@@ -1243,4 +1615,7 @@ def generate_and_cache_meal_image(meal_name, meal_id):
             logger.error(f"Error with Vertex AI: {str(vertex_error)}")
             
     except Exception as e:
-        logger.error(f"Error generating image: {str(e)}")
\ No newline at end of file
+        logger.error(f"Error generating image: {str(e)}")
+    finally:
+        # Release the generation claim so deferred meals can pick up the catalog entry or retry
+        delete_cache(f"meal_image_generating:{fingerprint}")
@@ -0,0 +1,214 @@
+"""
+Pooled, memoized and concurrent USDA nutrient lookups.
+
+Lookups are resolved in order from an in-process memo, the offline FDC store
+(app.utils.usda_local), Redis and finally the USDA search API over a persistent
+pooled HTTP session. Concurrent lookups of the same ingredient share one
+in-flight request, and fetch_many resolves all ingredients of a meal in parallel.
+"""
+import os
+import re
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app.utils.redis_client import get_cache, set_cache, DEFAULT_CACHE_TTL, USDA_CACHE_TTL
+from app.utils.usda_local import lookup_local_macros
+
+logger = logging.getLogger(__name__)
+
+USDA_API_URL = "https://api.nal.usda.gov/fdc/v1/foods/search"
+
+# Whether ingredients missing from the offline USDA store are looked up through the USDA API
+USDA_API_FALLBACK = os.getenv("USDA_API_FALLBACK", "true").lower() == "true"
+USDA_TIMEOUT = float(os.getenv("USDA_TIMEOUT", "5"))
+USDA_MAX_CONCURRENCY = int(os.getenv("USDA_MAX_CONCURRENCY", "10"))
+USDA_MEMO_SIZE = int(os.getenv("USDA_MEMO_SIZE", "5000"))
+
+NUTRIENT_MAPPING = {
+    208: "calories",
+    203: "protein",
+    205: "carbs",
+    204: "fat",
+    269: "sugar",
+    291: "fiber"
+}
+
+# Sentinel cached for ingredients USDA has no match for, so misses are not re-requested
+_NOT_FOUND = {}
+
+
+def clean_ingredient_name(name: str) -> str:
+    """Strips leading quantities and preparation words from an ingredient name for better USDA matching."""
+    clean_name = re.sub(r'^\d+\s*[\d/]*\s*(?:cup|tbsp|tsp|oz|g|lb|ml|l)s?\s*', '', name, flags=re.IGNORECASE)
+    clean_name = re.sub(r'diced|chopped|minced|sliced|cooked|raw|fresh|frozen|canned', '', clean_name, flags=re.IGNORECASE)
+    return " ".join(clean_name.split()).lower()
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    retries = Retry(
+        total=2,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"]
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=USDA_MAX_CONCURRENCY,
+        max_retries=retries
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+class USDAClient:
+    """Thread-safe USDA lookup client shared by all tasks in a worker process."""
+
+    def __init__(self):
+        self._session = _build_session()
+        self._memo: "OrderedDict[str, dict]" = OrderedDict()
+        self._memo_lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=USDA_MAX_CONCURRENCY, thread_name_prefix="usda")
+
+    # --- in-process memo ---
+
+    def _memo_get(self, key: str) -> Optional[dict]:
+        with self._memo_lock:
+            value = self._memo.get(key)
+            if value is not None:
+                self._memo.move_to_end(key)
+            return value
+
+    def _memo_set(self, key: str, value: dict) -> None:
+        with self._memo_lock:
+            self._memo[key] = value
+            self._memo.move_to_end(key)
+            while len(self._memo) > USDA_MEMO_SIZE:
+                self._memo.popitem(last=False)
+
+    # --- lookups ---
+
+    def _fetch_remote(self, key: str) -> Optional[dict]:
+        """
+        Resolves an ingredient from Redis or the USDA API. Returns _NOT_FOUND on a confirmed
+        miss and None when the lookup failed, so the failure is not remembered.
+        """
+        cache_key = f"usda:{key}"
+        cached = get_cache(cache_key)
+        if cached is not None:
+            return cached
+
+        if not USDA_API_FALLBACK:
+            return _NOT_FOUND
+
+        api_key = os.getenv("USDA_API_KEY")
+        if not api_key:
+            logger.error("USDA API key not configured")
+            return None
+
+        try:
+            response = self._session.get(
+                USDA_API_URL,
+                params={"query": key, "api_key": api_key, "pageSize": 1},
+                timeout=USDA_TIMEOUT
+            )
+        except requests.RequestException as e:
+            logger.error(f"USDA request failed for '{key}': {str(e)}")
+            return None
+
+        if response.status_code != 200:
+            logger.warning(f"USDA API returned {response.status_code} for '{key}'")
+            return None
+
+        foods = response.json().get("foods")
+        if not foods:
+            set_cache(cache_key, _NOT_FOUND, DEFAULT_CACHE_TTL)
+            return _NOT_FOUND
+
+        macros = {NUTRIENT_MAPPING[nutrient["nutrientId"]]: nutrient["value"]
+                  for nutrient in foods[0].get("foodNutrients", []) if nutrient.get("nutrientId") in NUTRIENT_MAPPING}
+        set_cache(cache_key, macros, USDA_CACHE_TTL)
+        return macros
+
+    def _fetch_coalesced(self, key: str) -> Optional[dict]:
+        """Runs _fetch_remote once per key even when several callers need it at the same time."""
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._fetch_remote(key)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def fetch(self, ingredient: str) -> Optional[Dict[str, float]]:
+        """Returns per-100g macros for an ingredient name, or None if it cannot be resolved."""
+        key = clean_ingredient_name(ingredient)
+        if not key:
+            return None
+
+        memoized = self._memo_get(key)
+        if memoized is None:
+            memoized = lookup_local_macros(key) or self._fetch_coalesced(key)
+            # Only hits and confirmed misses are memoized; a failed lookup is retried next time
+            if memoized is not None:
+                self._memo_set(key, memoized)
+        return dict(memoized) if memoized else None
+
+    def fetch_many(self, ingredients: Iterable[str]) -> Dict[str, Optional[Dict[str, float]]]:
+        """Resolves several ingredient names in one parallel batch. Returns a dict keyed by input name."""
+        names = list(dict.fromkeys(ingredients))
+        futures = {name: self._executor.submit(self.fetch, name) for name in names}
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logger.error(f"Error fetching USDA data for '{name}': {str(e)}")
+                results[name] = None
+        return results
+
+
+_client: Optional[USDAClient] = None
+_client_lock = threading.Lock()
+
+
+def get_usda_client() -> USDAClient:
+    """Returns the process-wide USDA client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = USDAClient()
+    return _client
+
+
+def fetch_ingredient_macros(ingredient: str) -> Optional[Dict[str, float]]:
+    """Fetches per-100g macros for a given ingredient."""
+    return get_usda_client().fetch(ingredient)
+
+
+def fetch_many_ingredient_macros(ingredients: Iterable[str]) -> Dict[str, Optional[Dict[str, float]]]:
+    """Fetches per-100g macros for several ingredients concurrently."""
+    return get_usda_client().fetch_many(ingredients)
@@ -0,0 +1,303 @@
+"""
+Offline USDA FoodData Central store.
+
+The importer loads an FDC CSV download (food.csv, nutrient.csv, food_nutrient.csv)
+into a compact SQLite file holding one row of per-100g macros per food. At lookup
+time the rows are loaded once per process into an in-memory trigram/token index,
+so resolving an ingredient name to its macros is a local query instead of a call
+to the USDA search API.
+
+Usage:
+    python -m app.utils.usda_local import /path/to/FoodData_Central_csv [--db PATH] [--include-branded]
+    python -m app.utils.usda_local search "chicken breast"
+"""
+import os
+import re
+import csv
+import sqlite3
+import logging
+import argparse
+import threading
+from array import array
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+USDA_LOCAL_DB_PATH = os.getenv(
+    "USDA_LOCAL_DB_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "..", "data", "usda_fdc.sqlite3")
+)
+# Minimum match score (0-1) for a local hit to be trusted over the HTTP fallback
+USDA_LOCAL_MIN_SCORE = float(os.getenv("USDA_LOCAL_MIN_SCORE", "0.55"))
+
+MACRO_KEYS = ("calories", "protein", "carbs", "fat", "sugar", "fiber")
+
+# FDC nutrient numbers (nutrient.csv "nutrient_nbr", as returned by the search API)
+NUTRIENT_NBR_MAPPING = {
+    "208": "calories",
+    "203": "protein",
+    "205": "carbs",
+    "204": "fat",
+    "269": "sugar",
+    "291": "fiber",
+    # Atwater energy values, used by Foundation foods that lack 208
+    "957": "calories_atwater",
+    "958": "calories_atwater",
+}
+
+# FDC nutrient ids, used when nutrient.csv is not part of the download
+NUTRIENT_ID_MAPPING = {
+    "1008": "calories",
+    "1003": "protein",
+    "1005": "carbs",
+    "1004": "fat",
+    "2000": "sugar",
+    "1079": "fiber",
+    "2047": "calories_atwater",
+    "2048": "calories_atwater",
+}
+
+# Generic food datasets; branded foods are opt-in because they are large and noisy
+DEFAULT_DATA_TYPES = {"foundation_food", "sr_legacy_food", "survey_fndds_food"}
+
+# Preferred datasets win ties between equally good matches
+DATA_TYPE_PRIORITY = {
+    "foundation_food": 0.03,
+    "sr_legacy_food": 0.02,
+    "survey_fndds_food": 0.01,
+}
+
+
+def normalize_food_name(name: str) -> str:
+    """Lowercases a food name and reduces it to space-separated alphanumeric tokens."""
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", name.lower()).split())
+
+
+def _trigrams(normalized: str) -> set:
+    padded = f" {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# ===================== IMPORTER =====================
+
+def _read_nutrient_mapping(nutrient_csv: str) -> Dict[str, str]:
+    """Maps nutrient ids in food_nutrient.csv to macro keys using nutrient.csv."""
+    if not os.path.exists(nutrient_csv):
+        return dict(NUTRIENT_ID_MAPPING)
+
+    mapping = {}
+    with open(nutrient_csv, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            nbr = (row.get("nutrient_nbr") or "").split(".")[0]
+            if nbr in NUTRIENT_NBR_MAPPING:
+                mapping[row["id"]] = NUTRIENT_NBR_MAPPING[nbr]
+    return mapping or dict(NUTRIENT_ID_MAPPING)
+
+
+def import_fdc_csv(source_dir: str, db_path: str = USDA_LOCAL_DB_PATH, include_branded: bool = False) -> int:
+    """
+    Imports an FDC CSV download into the local SQLite store, replacing its contents.
+    Returns the number of foods imported.
+    """
+    data_types = set(DEFAULT_DATA_TYPES)
+    if include_branded:
+        data_types.add("branded_food")
+
+    foods = {}
+    with open(os.path.join(source_dir, "food.csv"), newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row.get("data_type") in data_types and row.get("description"):
+                foods[row["fdc_id"]] = {"description": row["description"], "data_type": row["data_type"]}
+    logger.info(f"Selected {len(foods)} foods from food.csv")
+
+    nutrient_mapping = _read_nutrient_mapping(os.path.join(source_dir, "nutrient.csv"))
+    macros = defaultdict(dict)
+    with open(os.path.join(source_dir, "food_nutrient.csv"), newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            key = nutrient_mapping.get(row.get("nutrient_id"))
+            if not key or row.get("fdc_id") not in foods:
+                continue
+            try:
+                amount = float(row["amount"])
+            except (TypeError, ValueError):
+                continue
+            macros[row["fdc_id"]].setdefault(key, amount)
+
+    # Fall back to Atwater energy where the standard energy value is missing
+    for values in macros.values():
+        atwater = values.pop("calories_atwater", None)
+        if atwater is not None:
+            values.setdefault("calories", atwater)
+
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    tmp_path = f"{db_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute(
+            "CREATE TABLE foods ("
+            "fdc_id INTEGER PRIMARY KEY, description TEXT NOT NULL, data_type TEXT NOT NULL, "
+            "calories REAL, protein REAL, carbs REAL, fat REAL, sugar REAL, fiber REAL)"
+        )
+        rows = [
+            (int(fdc_id), food["description"], food["data_type"], *(macros[fdc_id].get(k) for k in MACRO_KEYS))
+            for fdc_id, food in foods.items()
+            if "calories" in macros.get(fdc_id, {})
+        ]
+        conn.executemany("INSERT INTO foods VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+    # Swap the new file in atomically so running workers never see a half-written store
+    os.replace(tmp_path, db_path)
+    logger.info(f"Imported {len(rows)} foods into {db_path}")
+    return len(rows)
+
+
+# ===================== FUZZY INDEX =====================
+
+class FoodIndex:
+    """In-memory trigram/token index over the local FDC foods table."""
+
+    def __init__(self, rows: List[tuple]):
+        self.descriptions: List[str] = []
+        self.data_types: List[str] = []
+        self.token_sets: List[frozenset] = []
+        self.trigram_counts = array("H")
+        self.macros: List[Dict[str, float]] = []
+        self.postings: Dict[str, array] = defaultdict(lambda: array("I"))
+
+        for fdc_id, description, data_type, *values in rows:
+            idx = len(self.descriptions)
+            normalized = normalize_food_name(description)
+            trigrams = _trigrams(normalized)
+            self.descriptions.append(description)
+            self.data_types.append(data_type)
+            self.token_sets.append(frozenset(normalized.split()))
+            self.trigram_counts.append(min(len(trigrams), 65535))
+            self.macros.append({k: v for k, v in zip(MACRO_KEYS, values) if v is not None})
+            for trigram in trigrams:
+                self.postings[trigram].append(idx)
+        self.postings = dict(self.postings)
+
+    def __len__(self):
+        return len(self.descriptions)
+
+    @classmethod
+    def load(cls, db_path: str = USDA_LOCAL_DB_PATH) -> Optional["FoodIndex"]:
+        if not os.path.exists(db_path):
+            return None
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute(
+                "SELECT fdc_id, description, data_type, calories, protein, carbs, fat, sugar, fiber FROM foods"
+            ).fetchall()
+        finally:
+            conn.close()
+        index = cls(rows)
+        logger.info(f"Loaded local USDA index with {len(index)} foods from {db_path}")
+        return index
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[float, int]]:
+        """Returns up to `limit` (score, row) pairs, best first."""
+        normalized = normalize_food_name(query)
+        if not normalized:
+            return []
+        query_trigrams = _trigrams(normalized)
+        query_tokens = normalized.split()
+
+        shared = defaultdict(int)
+        for trigram in query_trigrams:
+            for idx in self.postings.get(trigram, ()):
+                shared[idx] += 1
+
+        scored = []
+        for idx, count in shared.items():
+            # Coverage of the query dominates; Jaccard penalizes long, unrelated descriptions
+            coverage = count / len(query_trigrams)
+            jaccard = count / (len(query_trigrams) + self.trigram_counts[idx] - count)
+            tokens = self.token_sets[idx]
+            token_coverage = sum(1 for t in query_tokens if t in tokens) / len(query_tokens)
+            score = (
+                0.5 * token_coverage + 0.3 * coverage + 0.2 * jaccard
+                + DATA_TYPE_PRIORITY.get(self.data_types[idx], 0.0)
+            )
+            scored.append((min(score, 1.0), idx))
+
+        scored.sort(key=lambda item: (-item[0], len(self.descriptions[item[1]])))
+        return scored[:limit]
+
+
+_index: Optional[FoodIndex] = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+
+def get_food_index() -> Optional[FoodIndex]:
+    """Returns the process-wide food index, loading it on first use. None if no local store exists."""
+    global _index, _index_loaded
+    if not _index_loaded:
+        with _index_lock:
+            if not _index_loaded:
+                try:
+                    _index = FoodIndex.load()
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to load local USDA store: {str(e)}")
+                    _index = None
+                _index_loaded = True
+    return _index
+
+
+@lru_cache(maxsize=4096)
+def lookup_local_macros(ingredient: str) -> Optional[Dict[str, float]]:
+    """
+    Returns per-100g macros for the best local match of an ingredient name,
+    or None if there is no local store or no sufficiently close match.
+    """
+    index = get_food_index()
+    if index is None:
+        return None
+
+    matches = index.search(ingredient, limit=1)
+    if not matches or matches[0][0] < USDA_LOCAL_MIN_SCORE:
+        return None
+
+    score, idx = matches[0]
+    logger.debug(f"Local USDA match for '{ingredient}': {index.descriptions[idx]} ({score:.2f})")
+    return dict(index.macros[idx])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the offline USDA FoodData Central store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="Import an FDC CSV download")
+    import_parser.add_argument("source_dir", help="Directory containing food.csv and food_nutrient.csv")
+    import_parser.add_argument("--db", default=USDA_LOCAL_DB_PATH, help="Path of the SQLite store to write")
+    import_parser.add_argument("--include-branded", action="store_true", help="Also import branded foods")
+
+    search_parser = subparsers.add_parser("search", help="Show the best local matches for a name")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--limit", type=int, default=5)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    if args.command == "import":
+        import_fdc_csv(args.source_dir, args.db, args.include_branded)
+    else:
+        index = get_food_index()
+        if index is None:
+            print(f"No local USDA store found at {USDA_LOCAL_DB_PATH}")
+            return
+        for score, idx in index.search(args.query, args.limit):
+            print(f"{score:.3f}  {index.descriptions[idx]}  {index.macros[idx]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,19 @@
+import os
+
+# WORKER_POOL=gevent runs tasks as greenlets; the standard library has to be patched
+# before anything below opens a socket or creates a lock
+WORKER_POOL = os.getenv("WORKER_POOL", "prefork")
+if WORKER_POOL == "gevent":
+    from app.utils.green import patch_for_pool
+    patch_for_pool(WORKER_POOL)
+
 from app.utils.celery_config import celery_app
 import app.utils.tasks 
 
 if __name__ == '__main__':
-    celery_app.worker_main(['worker', '--loglevel=info'])
\ No newline at end of file
+    # A standalone worker consumes every queue unless WORKER_QUEUES names a subset
+    queues = os.getenv("WORKER_QUEUES") or ",".join(queue.name for queue in celery_app.conf.task_queues)
+    argv = ['worker', '--loglevel=info', '-Q', queues, '-P', WORKER_POOL]
+    if os.getenv("WORKER_CONCURRENCY"):
+        argv.append(f"--concurrency={os.getenv('WORKER_CONCURRENCY')}")
+    celery_app.worker_main(argv)
@@ -0,0 +1,71 @@
+from collections import defaultdict
+
+from pymongo.errors import OperationFailure
+
+from app.utils import indexes
+from app.utils.indexes import HOT_QUERIES, INDEXES, IndexSpec, _plan_stages, check_query_plans, ensure_indexes
+from app.utils.meal_index import plan_meals_filter, request_meals_filter
+
+
+class FakeCollection:
+    def __init__(self, existing=()):
+        self.existing = [{"key": {"_id": 1}}] + [{"key": dict(keys)} for keys in existing]
+        self.created = []
+
+    def list_indexes(self):
+        return self.existing
+
+    def create_index(self, keys, name):
+        self.created.append(name)
+
+
+def test_index_name_matches_mongodb_default():
+    assert IndexSpec("chat_sessions", [("user_id", 1), ("created_at", -1)]).name == "user_id_1_created_at_-1"
+
+
+def test_ensure_indexes_only_creates_missing_ones():
+    database = defaultdict(FakeCollection)
+    database["meals"] = FakeCollection(existing=[[("meal_id", 1)]])
+
+    created = ensure_indexes(database)
+
+    assert "meals.meal_id_1" not in created
+    assert "meals.meal_plan_id_1" in created
+    assert len(created) == len(INDEXES) - 1
+    assert ensure_indexes(defaultdict(FakeCollection, {
+        name: FakeCollection(existing=[spec.keys for spec in INDEXES if spec.collection == name])
+        for name in {spec.collection for spec in INDEXES}
+    })) == []
+
+
+def test_plan_stages_walks_nested_plans():
+    plan = {
+        "stage": "FETCH",
+        "inputStage": {"stage": "OR", "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}]},
+    }
+
+    assert _plan_stages(plan) == ["FETCH", "OR", "IXSCAN", "COLLSCAN"]
+
+
+def test_check_query_plans_reports_collection_scans_and_failures(monkeypatch):
+    def explain(query, database=None):
+        if query.description == "meal by id":
+            return ["COLLSCAN"]
+        if query.description == "user by id":
+            raise OperationFailure("explain not allowed")
+        return ["FETCH", "IXSCAN"]
+
+    monkeypatch.setattr(indexes, "explain_query", explain)
+
+    failures = check_query_plans()
+
+    assert len(failures) == 2
+    assert failures[0].startswith("meals: meal by id does a COLLSCAN")
+    assert "explain failed" in failures[1]
+
+
+def test_hot_queries_match_the_meal_filters():
+    filters = [query.filter for query in HOT_QUERIES if query.collection == "meals"]
+
+    assert plan_meals_filter("plan-id") in filters
+    assert request_meals_filter("hash") in filters
@@ -0,0 +1,46 @@
+import pytest
+
+from app.utils.llm_json import LLMJSONError, parse_llm_json, repair_json
+
+def test_single_meal_object_becomes_one_item_list():
+    assert parse_llm_json('{"title": "x", "ingredients": [{"name": "x", "quantity": "1 g"}]}', expect=list) == [
+        {"title": "x", "ingredients": [{"name": "x", "quantity": "1 g"}]}
+    ]
+
+
+def test_wrapper_key_is_unwrapped():
+    assert parse_llm_json('{"meals": [{"title": "a"}, {"title": "b"}]}', expect=list) == [{"title": "a"}, {"title": "b"}]
+
+
+def test_unknown_list_field_is_not_unwrapped():
+    assert parse_llm_json('{"tags": ["a", "b"]}', expect=list) == [{"tags": ["a", "b"]}]
+
+
+def test_fenced_reply_with_prose():
+    text = 'Here you go:\n```json\n[{"title": "a"}]\n```\nEnjoy!'
+    assert parse_llm_json(text, expect=list) == [{"title": "a"}]
+
+
+def test_trailing_comma_is_repaired():
+    assert parse_llm_json('[{"title": "a",},]', expect=list) == [{"title": "a"}]
+
+
+def test_truncated_array_drops_incomplete_element():
+    assert parse_llm_json('[{"title": "a"}, {"title": "b", "ingredients": [{"na', expect=list) == [{"title": "a"}]
+
+
+def test_raw_newline_in_string_is_repaired():
+    assert parse_llm_json('{"instructions": "Step 1\nStep 2"}', expect=dict) == {"instructions": "Step 1\nStep 2"}
+
+
+def test_expect_dict_takes_first_object_of_list():
+    assert parse_llm_json('[1, {"a": 1}, {"b": 2}]', expect=dict) == {"a": 1}
+
+
+def test_unrecoverable_reply_raises():
+    with pytest.raises(LLMJSONError):
+        parse_llm_json("no json here", expect=list)
+
+
+def test_repair_json_closes_open_containers():
+    assert repair_json('{"a": [1, 2') == '{"a": [1, 2]}'
@@ -0,0 +1,98 @@
+import threading
+
+from app.utils import meal_index
+from app.utils.meal_index import MealIndex, plan_meals_filter, reuse_meals_for_slots
+from app.utils.portion_solver import ADJUSTMENT_NOTE
+
+
+def stored_meal(meal_id, name, meal_type, calories, dietary_type="Vegan"):
+    return {
+        "meal_id": meal_id, "meal_name": name, "meal_type": meal_type, "dietary_type": dietary_type,
+        "macros": {"calories": calories, "protein": calories / 20, "carbs": calories / 10, "fat": calories / 40},
+        "ingredients": [{"name": "tofu", "quantity": "100 g"}], "meal_text": "Cook." + ADJUSTMENT_NOTE,
+    }
+
+
+class EmptyCollection:
+    """Stands in for the meals collection so index refreshes find nothing new."""
+
+    def find(self, *args, **kwargs):
+        return self
+
+    def sort(self, *args, **kwargs):
+        return []
+
+
+def test_reused_slots_reference_the_stored_meal(monkeypatch):
+    meals = [stored_meal("m1", "Tofu Bowl", "Lunch", 600), stored_meal("m2", "Tofu Wrap", "Lunch", 610)]
+    monkeypatch.setattr(meal_index, "find_nearest_meals", lambda meal_type, dietary_type, macros, k, exclude_titles: meals[:k])
+
+    reused = reuse_meals_for_slots(["Lunch", "Lunch"], {"Lunch": {"calories": 600}}, "Vegan")
+
+    assert [reused[i]["reused_from"] for i in (0, 1)] == ["m1", "m2"]
+    assert reused[0]["instructions"] == "Cook."
+
+
+def test_index_finds_nearest_meal_within_tolerance():
+    index = MealIndex(collection=EmptyCollection())
+    for meal in (stored_meal("m1", "Small", "Lunch", 300), stored_meal("m2", "Right", "Lunch", 600)):
+        index.add_meal(meal)
+
+    matches = index.nearest("Lunch", "Vegan", stored_meal("t", "", "Lunch", 600)["macros"], k=2)
+
+    assert [m.meal_id for m in matches] == ["m2"]
+    assert index.add_meal(stored_meal("m2", "Right", "Lunch", 600)) is False
+
+
+def test_plan_meals_filter_includes_reused_meals():
+    assert plan_meals_filter("p1") == {"$or": [{"meal_plan_id": "p1"}, {"reused_in_plans": "p1"}]}
+
+
+class SlowCollection:
+    """Stands in for the meals collection, counting reads and holding each one until released."""
+
+    def __init__(self, meals):
+        self.meals = meals
+        self.reads = 0
+        self.release = threading.Event()
+
+    def find(self, query, projection=None):
+        self.reads += 1
+        self.release.wait(5)
+        after = query.get("_id", {}).get("$gt", -1)
+        return SortedMeals([meal for meal in self.meals if meal["_id"] > after])
+
+
+class SortedMeals(list):
+    def sort(self, *args, **kwargs):
+        return self
+
+
+def test_concurrent_refreshes_read_the_collection_once():
+    meals = [dict(stored_meal(f"m{i}", f"Meal {i}", "Lunch", 500 + i), _id=i) for i in range(3)]
+    collection = SlowCollection(meals)
+    index = MealIndex(collection=collection, refresh_seconds=60)
+
+    threads = [threading.Thread(target=index.refresh_if_stale) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    collection.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert collection.reads == 1
+    assert len(index) == 3
+
+
+def test_first_load_keeps_meals_added_before_it():
+    collection = SlowCollection([dict(stored_meal("m1", "Stored", "Lunch", 600), _id=1)])
+    collection.release.set()
+    index = MealIndex(collection=collection)
+    index.add_meal(stored_meal("m2", "Just Saved", "Lunch", 605))
+
+    assert index.refresh() == 1
+    assert len(index) == 2
+
+    collection.meals.append(dict(stored_meal("m3", "Newer", "Lunch", 610), _id=2))
+    assert index.refresh() == 1
+    assert {m.meal_id for m in index.nearest("Lunch", "Vegan", {"calories": 600, "protein": 30, "carbs": 60, "fat": 15}, k=3)} == {"m1", "m2", "m3"}
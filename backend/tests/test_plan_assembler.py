@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from app.utils import plan_assembler
+from app.utils.meal_index import MealMatch, macro_vector
+from app.utils.plan_assembler import (
+    assemble_full_day_plan, assemble_single_type_plan, meal_type_targets, score_day_combinations,
+)
+
+DAILY = {"calories": 2000, "protein": 150, "carbs": 200, "fat": 70, "fiber": 30, "sugar": 50}
+
+
+def match(meal_id, macros):
+    return MealMatch(meal_id, meal_id, 0.0, macro_vector(macros))
+
+
+class RecordingIndex:
+    """Meal index that records the targets it is queried with and returns fixed pools."""
+
+    def __init__(self, pools):
+        self.pools = pools
+        self.targets = {}
+
+    def nearest(self, meal_type, dietary_type, target_macros, k=1, tolerance=None, exclude_titles=()):
+        self.targets[meal_type] = target_macros
+        return self.pools.get(meal_type, [])[:k]
+
+
+def test_meal_type_targets_split_share_over_meals():
+    assert meal_type_targets(DAILY, "Dinner")["calories"] == pytest.approx(700)
+    assert meal_type_targets(DAILY, "Dinner", 2)["calories"] == pytest.approx(350)
+
+
+def test_single_type_instant_plan_targets_match_generation(monkeypatch):
+    index = RecordingIndex({"Lunch": [match(f"l{i}", {"calories": 200}) for i in range(3)]})
+    monkeypatch.setattr(plan_assembler, "get_meal_index", lambda: index)
+
+    assert len(assemble_single_type_plan("Lunch", None, DAILY, 3)) == 3
+    # Generation targets daily * ratio / meals of the type, i.e. 2000 * 0.30 / 3
+    assert index.targets["Lunch"]["calories"] == pytest.approx(200)
+
+
+def test_single_type_instant_plan_needs_a_meal_per_day(monkeypatch):
+    index = RecordingIndex({"Lunch": [match("l0", {"calories": 200})]})
+    monkeypatch.setattr(plan_assembler, "get_meal_index", lambda: index)
+
+    assert assemble_single_type_plan("Lunch", None, DAILY, 2) is None
+
+
+def test_score_day_combinations_prefers_on_target_day():
+    target = {"calories": 1000, "protein": 100}
+    pools = [
+        [match("a-exact", {"calories": 600, "protein": 60}), match("a-off", {"calories": 900, "protein": 90})],
+        [match("b-exact", {"calories": 400, "protein": 40})],
+    ]
+
+    scores = score_day_combinations(pools, target, tolerance=0.1)
+
+    assert scores.shape == (2, 1)
+    assert scores[0, 0] == pytest.approx(0, abs=1e-6)
+    assert np.isinf(scores[1, 0])
+
+
+def test_full_day_plan_uses_distinct_meals(monkeypatch):
+    num_days = 2
+    day = {key: value / num_days for key, value in DAILY.items()}
+    pools = {
+        meal_type: [match(f"{meal_type}-{i}", meal_type_targets(day, meal_type)) for i in range(num_days)]
+        for meal_type in plan_assembler.FULL_DAY_MEAL_TYPES
+    }
+    index = RecordingIndex(pools)
+    monkeypatch.setattr(plan_assembler, "get_meal_index", lambda: index)
+
+    days = assemble_full_day_plan(None, DAILY, num_days)
+
+    assert len(days) == num_days
+    assert len({m.meal_id for d in days for m in d}) == 4 * num_days
+    assert index.targets["Breakfast"]["calories"] == pytest.approx(2000 * 0.25 / num_days)
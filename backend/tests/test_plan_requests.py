@@ -0,0 +1,57 @@
+from app.utils.plan_requests import bucket_macro, build_request_hash, canonical_request, dietary_tokens, meal_counts_for
+
+
+def request(**overrides):
+    base = {
+        "meal_type": "Full Day", "dietary_preferences": "Vegan, Gluten-Free", "calories": 2010,
+        "protein": 101, "carbs": 250, "fat": 70, "fiber": 30, "sugar": 40, "meal_algorithm": "experimental",
+    }
+    return dict(base, **overrides)
+
+
+def test_bucket_macro_rounds_to_nearest_bucket():
+    assert bucket_macro("calories", 2010) == 2000
+    assert bucket_macro("calories", 2025) == 2050
+    assert bucket_macro("protein", 102) == 100
+    assert bucket_macro("protein", None) == 0
+    assert bucket_macro("fat", "not a number") == 0
+
+
+def test_dietary_tokens_ignore_order_case_and_punctuation():
+    assert dietary_tokens("Gluten-Free, Vegan") == dietary_tokens("vegan; gluten free") == ["gluten free", "vegan"]
+    assert dietary_tokens("Vegan and vegan") == ["vegan"]
+    assert dietary_tokens("") == []
+
+
+def test_equivalent_requests_share_a_hash():
+    first = request()
+    second = request(dietary_preferences="gluten free; vegan", calories=1990, protein=99)
+
+    assert build_request_hash(first) == build_request_hash(second)
+
+
+def test_different_shapes_get_different_hashes():
+    assert build_request_hash(request()) != build_request_hash(request(calories=2300))
+    assert build_request_hash(request()) != build_request_hash(request(meal_type="Lunch"))
+    assert build_request_hash(request()) != build_request_hash(request(dietary_preferences="Vegan"))
+
+
+def test_pantry_only_counts_for_pantry_requests():
+    plain = request(pantry_ingredients=["rice"])
+    assert build_request_hash(plain) == build_request_hash(request(pantry_ingredients=["tofu"]))
+    assert "pantry" not in canonical_request(plain)
+
+    rice = request(meal_algorithm="pantry", pantry_ingredients=["Rice", "tofu"])
+    same_rice = request(meal_algorithm="pantry", pantry_ingredients=["tofu ", "rice"])
+    beans = request(meal_algorithm="pantry", pantry_ingredients=["beans"])
+    assert build_request_hash(rice) == build_request_hash(same_rice)
+    assert build_request_hash(rice) != build_request_hash(beans)
+
+
+def test_missing_algorithm_defaults_to_experimental():
+    assert build_request_hash(request(meal_algorithm=None)) == build_request_hash(request())
+
+
+def test_meal_counts_for_full_day_and_single_meal():
+    assert meal_counts_for("Full Day", 2) == ({"Breakfast": 2, "Lunch": 2, "Dinner": 2, "Snack": 2}, 8)
+    assert meal_counts_for("Dinner", 3) == ({"Dinner": 3}, 3)
@@ -0,0 +1,78 @@
+import numpy as np
+
+from app.utils.portion_solver import (
+    ADJUSTMENT_NOTE, MIN_PORTION_SCALE, adjust_meal_portions, needs_adjustment,
+    solve_portion_multipliers,
+)
+
+
+def ingredient(name, quantity, calories, protein, carbs, fat):
+    return {
+        "name": name,
+        "quantity": quantity,
+        "macros": {"calories": calories, "protein": protein, "carbs": carbs, "fat": fat, "fiber": 0, "sugar": 0},
+    }
+
+
+def meal(*ingredients):
+    totals = {key: sum(i["macros"][key] for i in ingredients) for key in ingredients[0]["macros"]}
+    return {"title": "Test meal", "ingredients": list(ingredients), "instructions": "Cook.", "nutrition": totals}
+
+
+def test_meal_on_target_is_left_untouched():
+    on_target = meal(ingredient("rice", "100 g", 130, 3, 28, 0))
+    assert not needs_adjustment(on_target, on_target["nutrition"])
+    assert adjust_meal_portions([on_target], [on_target["nutrition"]]) == [on_target]
+
+
+def test_solver_recovers_exact_multipliers():
+    # Chicken and rice contribute independent nutrients, so the target has an exact solution
+    matrix = np.array([[[165.0, 31.0, 0.0, 3.6, 0.0, 0.0], [130.0, 2.7, 28.0, 0.3, 0.0, 0.0]]])
+    expected = np.array([1.5, 0.5])
+    targets = (matrix[0] * expected[:, None]).sum(axis=0)[None, :]
+
+    multipliers = solve_portion_multipliers(matrix, targets, np.ones((1, 2), dtype=bool), iterations=2000)
+
+    np.testing.assert_allclose(multipliers[0], expected, atol=0.02)
+
+
+def test_solver_respects_bounds_and_padding():
+    matrix = np.array([[[100.0, 10.0, 0.0, 0.0, 0.0, 0.0], [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]]])
+    # Only a zero portion would hit this target, so the multiplier stops at the lower bound
+    targets = np.array([[0.0, 0.0, 0.0, 0.0, 0.0, 0.0]])
+    mask = np.array([[True, False]])
+
+    multipliers = solve_portion_multipliers(matrix, targets, mask)
+
+    assert multipliers[0, 0] == MIN_PORTION_SCALE
+    assert multipliers[0, 1] == 1.0
+
+
+def test_adjusted_totals_match_scaled_ingredients():
+    original = meal(
+        ingredient("chicken breast", "200 g", 330, 62, 0, 7.2),
+        ingredient("white rice", "1 cup", 205, 4.3, 45, 0.4),
+    )
+    target = {"calories": 400, "protein": 45, "carbs": 25, "fat": 5, "fiber": 0, "sugar": 0}
+
+    adjusted = adjust_meal_portions([original], [target])[0]
+
+    assert adjusted["instructions"].endswith(ADJUSTMENT_NOTE)
+    calories = sum(i["macros"]["calories"] for i in adjusted["ingredients"])
+    assert adjusted["nutrition"]["calories"] == int(round(calories))
+    assert abs(adjusted["nutrition"]["calories"] - target["calories"]) < abs(original["nutrition"]["calories"] - target["calories"])
+    # Quantities are scaled by the same factor as the macros
+    chicken = adjusted["ingredients"][0]
+    factor = chicken["macros"]["calories"] / 330
+    assert chicken["quantity"] == f"{200 * factor:.1f}".rstrip("0").rstrip(".") + " g"
+
+
+def test_meal_without_ingredient_macros_scales_by_calories():
+    plain = {"title": "Toast", "ingredients": [{"name": "bread", "quantity": "2 slices"}],
+             "instructions": "", "nutrition": {"calories": 200, "protein": 6}}
+
+    adjusted = adjust_meal_portions([plain], [{"calories": 300}])[0]
+
+    assert adjusted["ingredients"][0]["quantity"] == "3 slices"
+    assert adjusted["nutrition"]["calories"] == 300
+    assert adjusted["nutrition"]["protein"] == 9
@@ -0,0 +1,54 @@
+import pytest
+
+from app.utils.quantity_parser import parse_quantity, resolve_unit, scale_quantity, to_grams
+
+
+@pytest.mark.parametrize("text, amount, unit", [
+    ("2 cups", 2.0, "cup"),
+    ("1 1/2 tbsp", 1.5, "tbsp"),
+    ("½ tsp", 0.5, "tsp"),
+    ("1½ cups", 1.5, "cup"),
+    ("0.75 cup", 0.75, "cup"),
+    ("a pinch", 1.0, "pinch"),
+])
+def test_parse_quantity(text, amount, unit):
+    parsed = parse_quantity(text)
+    assert parsed.amount == pytest.approx(amount)
+    assert parsed.unit == unit
+
+
+def test_unknown_word_is_not_a_unit():
+    parsed = parse_quantity("2 eggs")
+    assert parsed.amount == 2.0
+    assert parsed.unit is None
+
+
+def test_range_value_is_midpoint():
+    assert parse_quantity("2-3 cloves").value == pytest.approx(2.5)
+
+
+def test_unparseable_quantity():
+    assert parse_quantity("to taste") is None
+    assert to_grams("to taste", "salt") is None
+
+
+def test_tablespoon_and_teaspoon_shorthand():
+    assert resolve_unit("T") == "tbsp"
+    assert resolve_unit("t") == "tsp"
+
+
+def test_to_grams_mass_volume_and_count():
+    assert to_grams("1 lb", "chicken") == pytest.approx(453.6, rel=1e-3)
+    assert to_grams("1 cup", "water") == pytest.approx(236.6, rel=1e-2)
+    assert to_grams("2", "egg") == pytest.approx(2 * to_grams("1", "egg"))
+
+
+@pytest.mark.parametrize("quantity, factor, expected", [
+    ("0.75 cup", 1.0, "0.8 cup"),
+    ("2 cups", 1.5, "3 cups"),
+    ("1 1/2 tbsp olive oil", 2.0, "3 tbsp olive oil"),
+    ("2-3 cloves", 2.0, "4-6 cloves"),
+    ("to taste", 2.0, "to taste"),
+])
+def test_scale_quantity(quantity, factor, expected):
+    assert scale_quantity(quantity, factor) == expected
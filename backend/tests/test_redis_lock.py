@@ -0,0 +1,52 @@
+import pytest
+
+from app.utils import redis_client as redis_module
+from app.utils.redis_client import LOCK_FENCE_KEY, RedisLock
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """Runs the lock scripts against an in-memory Redis."""
+    client = fakeredis.FakeStrictRedis()
+    for name in ("_ACQUIRE_LOCK_SCRIPT", "_RELEASE_LOCK_SCRIPT", "_EXTEND_LOCK_SCRIPT"):
+        monkeypatch.setattr(redis_module, name, client.register_script(getattr(redis_module, name).script))
+    return client
+
+
+def test_fencing_tokens_follow_acquisition_order(fake_redis):
+    first = RedisLock("lock:plan", ttl_ms=60000)
+    assert first.acquire()
+
+    # The first holder's lease expires and another worker takes the lock
+    fake_redis.delete("lock:plan")
+    second = RedisLock("lock:plan", ttl_ms=60000)
+    assert second.acquire()
+
+    assert second.fencing_token > first.fencing_token
+    assert int(fake_redis.get(LOCK_FENCE_KEY)) == second.fencing_token
+
+
+def test_held_lock_is_not_acquired_and_takes_no_token(fake_redis):
+    holder = RedisLock("lock:plan")
+    assert holder.acquire()
+
+    contender = RedisLock("lock:plan")
+    assert not contender.acquire()
+    assert contender.fencing_token is None
+    assert not contender.acquired
+    assert int(fake_redis.get(LOCK_FENCE_KEY)) == holder.fencing_token
+
+
+def test_release_only_deletes_own_lock(fake_redis):
+    first = RedisLock("lock:plan")
+    assert first.acquire()
+    fake_redis.delete("lock:plan")
+    second = RedisLock("lock:plan")
+    assert second.acquire()
+
+    assert not first.release()
+    assert fake_redis.get("lock:plan") == second.token.encode()
+    assert second.release()
+    assert fake_redis.get("lock:plan") is None
@@ -0,0 +1,59 @@
+import requests
+
+from app.utils import usda_client
+from app.utils.usda_client import USDAClient, _NOT_FOUND
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self._payload = payload or {}
+
+    def json(self):
+        return self._payload
+
+
+def make_client(monkeypatch, responses):
+    """A client whose USDA session returns (or raises) the given responses in order."""
+    monkeypatch.setattr(usda_client, "get_cache", lambda key: None)
+    monkeypatch.setattr(usda_client, "set_cache", lambda key, value, ttl: True)
+    monkeypatch.setattr(usda_client, "lookup_local_macros", lambda key: None)
+    monkeypatch.setattr(usda_client, "USDA_API_FALLBACK", True)
+    monkeypatch.setenv("USDA_API_KEY", "test-key")
+    client = USDAClient()
+
+    def get(*args, **kwargs):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(client._session, "get", get)
+    return client
+
+
+def test_transient_failure_is_not_memoized(monkeypatch):
+    hit = FakeResponse(200, {"foods": [{"foodNutrients": [{"nutrientId": 208, "value": 120}]}]})
+    client = make_client(monkeypatch, [requests.ConnectionError("down"), FakeResponse(503), hit])
+
+    assert client.fetch("rice") is None
+    assert client.fetch("rice") is None
+    assert client.fetch("rice") == {"calories": 120}
+    assert client._memo_get("rice") == {"calories": 120}
+
+
+def test_confirmed_miss_is_memoized(monkeypatch):
+    client = make_client(monkeypatch, [FakeResponse(200, {"foods": []})])
+
+    assert client.fetch("unobtainium") is None
+    assert client._memo_get("unobtainium") is _NOT_FOUND
+    # Served from the memo, so no second request is made
+    assert client.fetch("unobtainium") is None
+
+
+def test_missing_api_key_is_not_memoized(monkeypatch):
+    client = make_client(monkeypatch, [])
+    monkeypatch.delenv("USDA_API_KEY")
+
+    assert client.fetch("rice") is None
+    assert client._memo_get("rice") is None
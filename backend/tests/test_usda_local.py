@@ -0,0 +1,59 @@
+from app.utils.usda_local import FoodIndex, _trigrams, normalize_food_name
+
+ROWS = [
+    (1, "Rice, white, long-grain, cooked", "sr_legacy_food", 130, 2.7, 28.2, 0.3, 0.1, 0.4),
+    (2, "Rice, brown, long-grain, cooked", "sr_legacy_food", 123, 2.7, 25.6, 1.0, 0.2, 1.6),
+    (3, "Chicken, broiler, breast, meat only, cooked, roasted", "sr_legacy_food", 165, 31.0, 0.0, 3.6, 0.0, 0.0),
+    (4, "Chicken breast, grilled", "survey_fndds_food", 151, 30.5, 0.0, 3.2, None, None),
+    (5, "Olive oil", "foundation_food", 884, 0.0, 0.0, 100.0, 0.0, 0.0),
+]
+
+
+def best(index, query):
+    return index.descriptions[index.search(query, limit=1)[0][1]]
+
+
+def test_normalize_food_name():
+    assert normalize_food_name("  Chicken Breast, RAW (skinless) ") == "chicken breast raw skinless"
+    assert _trigrams("egg") == {" eg", "egg", "gg "}
+
+
+def test_search_ranks_the_closest_food_first():
+    index = FoodIndex(ROWS)
+
+    assert len(index) == 5
+    assert best(index, "brown rice") == "Rice, brown, long-grain, cooked"
+    assert best(index, "white rice") == "Rice, white, long-grain, cooked"
+    assert best(index, "olive oil") == "Olive oil"
+
+
+def test_search_scores_are_sorted_and_bounded():
+    results = FoodIndex(ROWS).search("chicken breast", limit=3)
+
+    scores = [score for score, _ in results]
+    assert len(results) <= 3
+    assert scores == sorted(scores, reverse=True)
+    assert all(0 < score <= 1.0 for score in scores)
+
+
+def test_data_type_priority_breaks_ties():
+    rows = [
+        (1, "Egg, whole, raw", "survey_fndds_food", 143, 12.6, 0.7, 9.5, 0.4, 0.0),
+        (2, "Egg, whole, raw", "foundation_food", 148, 12.4, 1.0, 10.0, 0.2, 0.0),
+    ]
+
+    assert FoodIndex(rows).search("egg", limit=1)[0][1] == 1
+
+
+def test_missing_macros_are_left_out():
+    index = FoodIndex(ROWS)
+
+    assert index.macros[3] == {"calories": 151, "protein": 30.5, "carbs": 0.0, "fat": 3.2}
+
+
+def test_unmatched_or_empty_query_returns_nothing():
+    index = FoodIndex(ROWS)
+
+    assert index.search("") == []
+    assert index.search("%%%") == []
+    assert index.search("zzqx") == []